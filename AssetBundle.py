@@ -0,0 +1,223 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2019 Steve Cotton (Octalot)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Preprocessed images, so that the game doesn't decode, rotate or tile images during play.
+
+The bundle is a single file holding the raw pixels of every rotated car, the frog's base image and
+every tiled terrain row, which is memory-mapped at startup instead of decoding the PNGs. It's a
+build step, and the game works without it:
+
+    ./AssetBundle.py
+
+The bundle records the size and modification time of each source image, and is ignored if any of
+them have changed. Whether or not there's a bundle, warm_up() fills the image caches before the
+first race, so that the first car of each type doesn't cause a hitch.
+"""
+
+try:
+    import os
+    import sys
+    import argparse
+    import json
+    import mmap
+    import struct
+    import pygame
+    from GameConstants import GameConstants
+    from Hazards import Car, Grass, Road, TiledBackground
+    from Frogs import Frog
+    from Utils import ImageCache, TeamColorPainter, convert_for_display
+except ImportError as err:
+    print ("couldn't load module. %s" % (err))
+    sys.exit(2)
+
+bundle_path = ImageCache.data_path ("assets.bundle")
+
+# The file starts with the magic, the version and the length of the JSON header
+_magic = b"DFBUNDLE"
+_version = 1
+_preamble = struct.Struct ("<8sII")
+# Each image's pixels start on a multiple of this
+_alignment = 16
+
+def bundle_contents(width):
+    """The images that the game uses, as a list of (cache, kind, filename, arguments) where kind is
+    "rotated" or "tiled", and arguments are the extra arguments to load_rotated_image or
+    load_tiled_image. The width is the width of the terrain rows, which is the camera's width.
+    """
+    contents = []
+    car_files = sorted (set (Car.fast_car_sprites + Car.car_sprites + Car.slow_car_sprites))
+    for filename in car_files:
+        for rotation in sorted (set ((Car.rotation (1), Car.rotation (-1)))):
+            contents.append ((Car.image_cache, "rotated", filename, (rotation,)))
+    for filename in Frog.sprites_files:
+        # Not all of the frog's animation frames exist yet
+        if os.path.exists (ImageCache.data_path (filename)):
+            contents.append ((TeamColorPainter.image_cache, "rotated", filename, (0,)))
+    for filename in Grass.background_images + Road.background_images:
+        contents.append ((TiledBackground.image_cache, "tiled", filename, (width, GameConstants.road_width)))
+    return contents
+
+def _source_stamps(contents):
+    """The size and modification time of each source file, to check that the bundle is up to date"""
+    stamps = {}
+    for cache, kind, filename, arguments in contents:
+        stat = os.stat (ImageCache.data_path (filename))
+        stamps[filename] = [stat.st_size, stat.st_mtime_ns]
+    return stamps
+
+def _load_from_cache(cache, kind, filename, arguments):
+    if kind == "rotated":
+        return cache.load_rotated_image (filename, *arguments)
+    else:
+        return cache.load_tiled_image (filename, *arguments)
+
+def build(path=bundle_path, width=1024):
+    """Write the bundle, decoding the images from their source files"""
+    contents = bundle_contents (width)
+    entries = []
+    blobs = []
+    offset = 0
+    for cache, kind, filename, arguments in contents:
+        # Use a fresh cache, so that this doesn't read an older bundle's images
+        image = _load_from_cache (ImageCache(), kind, filename, arguments)
+        pixel_format = "RGBA" if image.get_flags() & pygame.SRCALPHA else "RGB"
+        pixels = pygame.image.tobytes (image, pixel_format)
+        entries.append ({
+            "kind": kind,
+            "filename": filename,
+            "arguments": list (arguments),
+            "size": list (image.get_size()),
+            "format": pixel_format,
+            "offset": offset,
+            "length": len (pixels),
+        })
+        padding = -len (pixels) % _alignment
+        blobs.append (pixels + bytes (padding))
+        offset += len (pixels) + padding
+
+    header = json.dumps ({
+        "width": width,
+        "sources": _source_stamps (contents),
+        "images": entries,
+    }).encode ("utf-8")
+    header += b" " * (-(_preamble.size + len (header)) % _alignment)
+    with open (path, "wb") as output:
+        output.write (_preamble.pack (_magic, _version, len (header)))
+        output.write (header)
+        for blob in blobs:
+            output.write (blob)
+    return len (entries)
+
+class AssetBundle:
+    """A memory-mapped bundle file. The images are created by pygame.image.frombuffer, so until
+    they're converted to the display's format they share the mapped memory instead of copying it,
+    and close() can only be called once none of them are still using it.
+    """
+
+    def __init__(self, path=bundle_path):
+        # The mapping stays valid after the file is closed
+        with open (path, "rb") as bundle_file:
+            self._map = mmap.mmap (bundle_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, header_length = _preamble.unpack_from (self._map)
+        if magic != _magic or version != _version:
+            raise ValueError ("%s is not a version %d asset bundle" % (path, _version))
+        self.header = json.loads (self._map[_preamble.size:_preamble.size + header_length].decode ("utf-8"))
+        self._data_start = _preamble.size + header_length
+
+    def is_current(self, width):
+        """False if the bundle was built for a different width, or any source image has changed"""
+        if self.header["width"] != width:
+            return False
+        try:
+            return self.header["sources"] == _source_stamps (bundle_contents (width))
+        except OSError:
+            return False
+
+    def images(self):
+        """Yields (kind, filename, arguments, image) for each image in the bundle"""
+        view = memoryview (self._map)
+        for entry in self.header["images"]:
+            start = self._data_start + entry["offset"]
+            pixels = view[start:start + entry["length"]]
+            image = pygame.image.frombuffer (pixels, tuple (entry["size"]), entry["format"])
+            yield entry["kind"], entry["filename"], tuple (entry["arguments"]), image
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def warm_up(width=1024, path=bundle_path, scale=1):
+    """Fill Car.image_cache, TiledBackground.image_cache and the frog's base image, including the
+    collision masks, so that nothing is loaded from a file during a race.
+
+    If there's an up-to-date bundle at path then the images come from it, otherwise they're decoded
+    from the PNG files. Returns true if the bundle was used.
+
+    If the game is drawn at a different scale to the world (see Rendering.LayeredRenderer), the
+    scaled copies of the images are made as well.
+    """
+    contents = bundle_contents (width)
+    used_bundle = False
+    if path and os.path.exists (path):
+        try:
+            bundle = AssetBundle (path)
+        except (OSError, ValueError) as message:
+            print ("Ignoring asset bundle:", message)
+            bundle = None
+        if bundle and bundle.is_current (width):
+            caches = {(kind, filename, arguments): cache for cache, kind, filename, arguments in contents}
+            for kind, filename, arguments, image in bundle.images():
+                cache = caches.get ((kind, filename, arguments))
+                if cache is None:
+                    continue
+                # Converting copies the pixels out of the mapped file; headless, they stay mapped
+                image = convert_for_display (image)
+                if kind == "rotated":
+                    cache.store_rotated_image (filename, arguments[0], image)
+                else:
+                    cache.store_tiled_image (filename, arguments[0], arguments[1], image)
+            used_bundle = True
+        # Headless, the images are still in the mapped memory, and it has to stay open
+        if bundle and (not used_bundle or pygame.display.get_surface() is not None):
+            bundle.close()
+
+    # Anything that wasn't in the bundle is loaded here, and the masks are built
+    for cache, kind, filename, arguments in contents:
+        _load_from_cache (cache, kind, filename, arguments)
+        if kind == "rotated":
+            cache.load_rotated_mask (filename, arguments[0])
+    if scale != 1:
+        for cache in {cache for cache, kind, filename, arguments in contents}:
+            cache.prescale (scale)
+    return used_bundle
+
+def main():
+    parser = argparse.ArgumentParser (description="Build the Darting Frogs asset bundle")
+    parser.add_argument ("--output", default=bundle_path, help="where to write the bundle")
+    parser.add_argument ("--width", type=int, default=1024, help="width of the game's screen, which is the width of the terrain rows")
+    args = parser.parse_args()
+    pygame.init()
+    count = build (args.output, args.width)
+    print ("Wrote %d images to %s" % (count, args.output))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,426 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2019 Steve Cotton (Octalot)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Micro-benchmarks for the parts of the game that run every tick or every spawn.
+
+This runs with SDL's dummy video driver, so it doesn't need a screen. Each benchmark times one
+subsystem in isolation, and the results are written as JSON. Passing the JSON from an earlier run
+with --compare reports any benchmark that has become slower, and exits with status 1 if there was
+a regression.
+
+    ./Benchmarks.py --output baseline.json
+    ./Benchmarks.py --compare baseline.json
+"""
+
+try:
+    import os
+    # This must be set before pygame initialises its display module
+    os.environ.setdefault ("SDL_VIDEODRIVER", "dummy")
+    import argparse
+    import contextlib
+    import gettext
+    import io
+    import json
+    import platform
+    import random
+    import sys
+    import timeit
+    import pygame
+    from pygame.locals import *
+    from GameConstants import GameConstants
+    from Hazards import Car, CenterPoint, Road, TiledBackground
+    from Frogs import Frog, FrogPositionIndex
+    from Utils import ImageCache, TeamColorPainter, get_bounding_box
+    from Collisions import AnalyticLaneCollisions, LaneCollisionIndex
+    from Traffic import ArrayTraffic, numpy
+    from Simulation import RaceSimulation
+    from Crowd import AiCrowd
+    from Planner import LanePlanner
+    from Scheduler import TimerWheel
+    from Rendering import LayeredRenderer
+except ImportError as err:
+    print ("couldn't load module. %s" % (err))
+    sys.exit(2)
+
+gettext.install ('DartingFrogs', 'data/locale')
+
+# The area used for the benchmarks, the same size as the real game's screen
+camera_area = pygame.Rect (0, 0, 1024, 700)
+
+# Frog counts used for the benchmarks that scale with the number of players
+frog_counts = [8, 64, 512]
+
+# Each registered benchmark is a function which does any setup, and then returns the function to
+# be timed. They're run in the order that they're registered.
+_benchmarks = []
+
+def benchmark(name):
+    """Decorator to register a benchmark's setup function under the given name"""
+    def register(setup):
+        _benchmarks.append ((name, setup))
+        return setup
+    return register
+
+def make_frogs(count, seed=0):
+    """Create count frogs, scattered over the camera_area with a fixed seed so that each run of the
+    benchmarks tests the same positions.
+    """
+    rng = random.Random (seed)
+    frogs = []
+    # Frog.__init__ prints a line for each frog, which would swamp the benchmark's output
+    with contextlib.redirect_stdout (io.StringIO()):
+        for i in range (count):
+            frog = Frog ("bench %d" % i, pygame.Color (255, 0, 255, 255), Frog.PlacementHint.player, i, 0, camera_area)
+            frog.rect.left = rng.randrange (0, camera_area.width - frog.rect.width)
+            frog.rect.top = rng.randrange (0, camera_area.height - frog.rect.height)
+            frogs.append (frog)
+    return frogs
+
+def make_dense_traffic(car_spacing=150):
+    """Fill the camera_area with roads, each with a car every car_spacing pixels.
+
+    Returns (roads, hazard_sprites).
+    """
+    hazard_sprites = pygame.sprite.Group()
+    roads = []
+    speeds = [speed for speed in Road.random_speeds]
+    for i in range (int (camera_area.height / GameConstants.road_width) + 1):
+        rect = Rect (0, i * GameConstants.road_width, camera_area.width, GameConstants.road_width)
+        road = Road (hazard_sprites, rect, speeds[i % len (speeds)])
+        for x in range (-100, camera_area.width + 100, car_spacing):
+            road.spawn_car (x)
+        roads.append (road)
+    return roads, hazard_sprites
+
+@benchmark("ImageCache.load_rotated_image (cold)")
+def bench_load_rotated_image_cold():
+    def run():
+        ImageCache().load_rotated_image ("cars/GalardB.png", 90)
+    return run
+
+@benchmark("ImageCache.load_rotated_image (cached)")
+def bench_load_rotated_image_cached():
+    cache = ImageCache()
+    def run():
+        cache.load_rotated_image ("cars/GalardB.png", 90)
+    return run
+
+@benchmark("ImageCache.load_tiled_image (cold)")
+def bench_load_tiled_image_cold():
+    def run():
+        ImageCache().load_tiled_image ("terrain/road1.png", camera_area.width, GameConstants.road_width)
+    return run
+
+@benchmark("TeamColorPainter.load_image (new color)")
+def bench_team_color_painter():
+    colors = [pygame.Color (r, 255 - r, 128, 255) for r in range (0, 256, 32)]
+    counter = [0]
+    def run():
+        counter[0] += 1
+        TeamColorPainter._recolor.cache_clear()
+        TeamColorPainter.load_image (Frog.sprites_files[0], colors[counter[0] % len (colors)])
+    return run
+
+@benchmark("TeamColorPainter.load_image (cached color)")
+def bench_team_color_painter_cached():
+    color = pygame.Color (255, 0, 0, 255)
+    def run():
+        TeamColorPainter.load_image (Frog.sprites_files[0], color)
+    return run
+
+@benchmark("Car.__init__")
+def bench_car_init():
+    start_point = CenterPoint (-100, 32)
+    def run():
+        Car (start_point, camera_area.width + 100, 3)
+    return run
+
+@benchmark("Car.create and kill (pooled)")
+def bench_car_create_pooled():
+    start_point = CenterPoint (-100, 32)
+    hazard_sprites = pygame.sprite.Group()
+    def run():
+        car = Car.create (start_point, camera_area.width + 100, 3)
+        hazard_sprites.add (car)
+        car.kill()
+    return run
+
+@benchmark("Road.update (first update, spawning a screenful of cars)")
+def bench_road_initial_spawn():
+    hazard_sprites = pygame.sprite.Group()
+    rect = Rect (0, 0, camera_area.width, GameConstants.road_width)
+    def run():
+        road = Road (hazard_sprites, rect, 3)
+        road.update()
+        hazard_sprites.empty()
+    return run
+
+@benchmark("Road.update (spawning one car)")
+def bench_road_spawn():
+    hazard_sprites = pygame.sprite.Group()
+    road = Road (hazard_sprites, Rect (0, 0, camera_area.width, GameConstants.road_width), 3)
+    road.update()
+    def run():
+        road.spawn_age = road.age + 1
+        road.update()
+        # Car.kill() takes the car out of the road's lanes as well as out of hazard_sprites
+        for car in road.cars.sprites():
+            car.kill()
+        road.spawn_log.clear()
+    return run
+
+for count in frog_counts:
+    @benchmark("get_bounding_box (%d frogs)" % count)
+    def bench_bounding_box(count=count):
+        frog_sprites = pygame.sprite.Group (make_frogs (count))
+        def run():
+            get_bounding_box (frog_sprites)
+        return run
+
+for count in frog_counts:
+    @benchmark("FrogPositionIndex front, back and bottom_at_least (%d frogs)" % count)
+    def bench_frog_position_index(count=count):
+        index = FrogPositionIndex()
+        for frog in make_frogs (count):
+            index.add (frog)
+        def run():
+            index.front()
+            index.back()
+            index.bottom_at_least (camera_area.bottom - GameConstants.jump_length)
+        return run
+
+for count in frog_counts:
+    @benchmark("spritecollide with collide_mask (%d frogs, dense traffic)" % count)
+    def bench_spritecollide(count=count):
+        frog_sprites = pygame.sprite.Group (make_frogs (count))
+        roads, hazard_sprites = make_dense_traffic()
+        def run():
+            for frog in frog_sprites:
+                pygame.sprite.spritecollide (frog, hazard_sprites, False, collided=pygame.sprite.collide_mask)
+        return run
+
+for count in frog_counts:
+    @benchmark("LaneCollisionIndex rebuild and collide (%d frogs, dense traffic)" % count)
+    def bench_lane_collision_index(count=count):
+        frog_sprites = pygame.sprite.Group (make_frogs (count))
+        roads, hazard_sprites = make_dense_traffic()
+        index = LaneCollisionIndex()
+        def run():
+            index.rebuild (roads)
+            for frog in frog_sprites:
+                index.collide (frog)
+        return run
+
+for count in frog_counts:
+    @benchmark("AnalyticLaneCollisions rebuild and collide (%d frogs, dense traffic)" % count)
+    def bench_analytic_collisions(count=count):
+        frog_sprites = pygame.sprite.Group (make_frogs (count))
+        roads, hazard_sprites = make_dense_traffic()
+        collisions = AnalyticLaneCollisions()
+        def run():
+            collisions.rebuild (roads)
+            for frog in frog_sprites:
+                collisions.collide (frog)
+        return run
+
+for count in frog_counts:
+    @benchmark("RaceSimulation.handle_event (%d players)" % count)
+    def bench_handle_event(count=count):
+        simulation = RaceSimulation (camera_area, seed=0)
+        # Each player has a different joystick button
+        with contextlib.redirect_stdout (io.StringIO()):
+            for i in range (count):
+                simulation.add_player (pygame.event.Event (JOYBUTTONDOWN, joy=i // 32, button=i % 32))
+        events = [pygame.event.Event (event_type, joy=(count - 1) // 32, button=(count - 1) % 32) for event_type in (JOYBUTTONDOWN, JOYBUTTONUP)]
+        def run():
+            for event in events:
+                simulation.handle_event (event)
+        return run
+
+for count in frog_counts:
+    @benchmark("LanePlanner start_tick and should_jump (%d AI frogs, dense traffic)" % count)
+    def bench_lane_planner(count=count):
+        frogs = make_frogs (count)
+        # Frogs are always still on a row boundary when they plan
+        for frog in frogs:
+            frog.rect.top -= frog.rect.top % GameConstants.jump_length
+        roads, hazard_sprites = make_dense_traffic()
+        # The planner forgets the forecasts for roads that have been killed
+        road_sprites = pygame.sprite.Group (roads)
+        road_sprites.update()
+        planner = LanePlanner()
+        def run():
+            planner.start_tick (road_sprites)
+            for frog in frogs:
+                planner.should_jump (frog)
+        return run
+
+# Number of cars for the "rush hour" traffic benchmarks
+rush_hour_cars = 5000
+
+@benchmark("Car sprite group update (%d cars)" % rush_hour_cars)
+def bench_sprite_traffic():
+    hazard_sprites = pygame.sprite.Group()
+    start_point = CenterPoint (0, 32)
+    for i in range (rush_hour_cars):
+        # Far enough from the kill point that none of them are killed during the benchmark
+        hazard_sprites.add (Car (start_point, 10 ** 9, 1))
+    def run():
+        hazard_sprites.update()
+    return run
+
+@benchmark("ArrayTraffic update (%d cars)" % rush_hour_cars)
+def bench_array_traffic():
+    traffic = ArrayTraffic()
+    road = Road (None, Rect (0, 0, camera_area.width, GameConstants.road_width), 1, traffic)
+    road.killx = 10 ** 9
+    for i in range (rush_hour_cars):
+        traffic.spawn (road, 0)
+    def run():
+        traffic.update()
+    return run
+
+@benchmark("TimerWheel tick (%d callbacks waiting)" % rush_hour_cars)
+def bench_timer_wheel():
+    wheel = TimerWheel()
+    rng = random.Random (0)
+    # Each callback schedules itself again when it's run, so the number waiting stays the same
+    def reschedule():
+        wheel.call_at (wheel.now + rng.randrange (1, 10000), reschedule)
+    for i in range (rush_hour_cars):
+        wheel.call_at (rng.randrange (1, 10000), reschedule)
+    def run():
+        wheel.advance (wheel.now + 1)
+    return run
+
+# Number of frogs for the crowd benchmark
+crowd_frogs = 2000
+
+@benchmark("AiCrowd update and collide (%d frogs, dense traffic)" % crowd_frogs)
+def bench_crowd():
+    crowd = AiCrowd (crowd_frogs, camera_area, seed=0)
+    # Spread the crowd over the screen, instead of starting them all in one row
+    crowd.top[:] = numpy.random.default_rng (0).integers (0, camera_area.height, size=crowd_frogs)
+    roads, hazard_sprites = make_dense_traffic()
+    cars = [(car.rect, car.mask) for car in hazard_sprites]
+    # Colliding removes frogs, so each run starts from the same crowd
+    initial = {name: getattr (crowd, name).copy() for name in ("left", "top", "step", "pause", "color")}
+    def run():
+        for name, array in initial.items():
+            setattr (crowd, name, array.copy())
+        crowd.count = crowd_frogs
+        crowd.update()
+        crowd.collide (cars)
+    return run
+
+# Scales for the rendering benchmarks, see DartingFrogs.py's --render-scale
+render_scales = [1, 0.5]
+
+for scale in render_scales:
+    @benchmark("LayeredRenderer full redraw (render scale %g)" % scale)
+    def bench_render(scale=scale):
+        screen = pygame.Surface ((round (camera_area.width * scale), round (camera_area.height * scale)))
+        with contextlib.redirect_stdout (io.StringIO()):
+            simulation = RaceSimulation (camera_area, seed=0, ai_frogs=4, ai_waits_for_players=False)
+            for i in range (60):
+                simulation.step()
+        renderer = LayeredRenderer (screen, (0x40, 0x80, 0x40), dirty_rects=False, scale=scale)
+        # The first draw scales the images, after that they're cached
+        renderer.draw (simulation)
+        def run():
+            renderer.draw (simulation)
+        return run
+
+def run_benchmarks(name_filter=None, repeat=5):
+    """Run each benchmark whose name contains name_filter, returning a dict of the results.
+
+    The timing is the best of repeat runs, each run calls the benchmark enough times to take at
+    least 0.2 seconds.
+    """
+    results = {}
+    for name, setup in _benchmarks:
+        if name_filter and name_filter not in name:
+            continue
+        if numpy is None and ("ArrayTraffic" in name or "AiCrowd" in name):
+            print ("%-64s skipped, needs NumPy" % name, file=sys.stderr)
+            continue
+        function = setup()
+        timer = timeit.Timer (function)
+        number, _unused = timer.autorange()
+        best = min (timer.repeat (repeat=repeat, number=number))
+        results[name] = {
+            "seconds_per_call": best / number,
+            "calls": number,
+            "repeats": repeat,
+        }
+        print ("%-64s %12.3f us" % (name, 1e6 * best / number), file=sys.stderr)
+    return results
+
+def compare(results, baseline, tolerance):
+    """Print a comparison against the results of an earlier run. Returns the names of benchmarks
+    that are slower than baseline by more than tolerance (a fraction, 0.1 means 10% slower).
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            print ("%-64s (new)" % name, file=sys.stderr)
+            continue
+        ratio = result["seconds_per_call"] / baseline[name]["seconds_per_call"]
+        if ratio > 1 + tolerance:
+            status = "REGRESSION"
+            regressions.append (name)
+        elif ratio < 1 - tolerance:
+            status = "faster"
+        else:
+            status = ""
+        print ("%-64s %6.2fx %s" % (name, ratio, status), file=sys.stderr)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser (description="Run the Darting Frogs micro-benchmarks")
+    parser.add_argument ("--output", help="write the JSON results to this file instead of stdout")
+    parser.add_argument ("--compare", metavar="BASELINE", help="JSON results of an earlier run to compare against")
+    parser.add_argument ("--tolerance", type=float, default=0.1, help="fraction slower than the baseline that counts as a regression")
+    parser.add_argument ("--filter", help="only run benchmarks whose name contains this string")
+    parser.add_argument ("--repeat", type=int, default=5, help="number of timing runs, the fastest is reported")
+    args = parser.parse_args()
+
+    pygame.init()
+    # The images are converted to the display's format, as they would be in the real game
+    pygame.display.set_mode ((camera_area.width, camera_area.height))
+
+    results = run_benchmarks (args.filter, args.repeat)
+    report = {
+        "python": platform.python_version(),
+        "pygame": pygame.version.ver,
+        "benchmarks": results,
+    }
+    if args.output:
+        with open (args.output, "w") as output:
+            json.dump (report, output, indent=2, sort_keys=True)
+    else:
+        json.dump (report, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+    if args.compare:
+        with open (args.compare) as baseline_file:
+            baseline = json.load (baseline_file)["benchmarks"]
+        if compare (results, baseline, args.tolerance):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
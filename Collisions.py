@@ -0,0 +1,196 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2019 Steve Cotton (Octalot)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Collision detection between frogs and the cars on the roads"""
+
+try:
+    import sys
+    from bisect import bisect_left, bisect_right
+    import pygame
+    from GameConstants import GameConstants
+    from Hazards import Car
+except ImportError as err:
+    print ("couldn't load module. %s" % (err))
+    sys.exit(2)
+
+# For each mask, (mask, (bounds, core)), see mask_shape()
+_mask_shapes = {}
+
+def mask_shape(mask):
+    """Returns (bounds, core) for a mask, both are Rects relative to the mask's top-left. The bounds
+    contain every set bit, the core is a rect (which may be empty) where every bit is set. Masks are
+    shared by all sprites using the same image, so this is cached by identity.
+    """
+    key = id (mask)
+    if key in _mask_shapes and _mask_shapes[key][0] is mask:
+        return _mask_shapes[key][1]
+    rects = mask.get_bounding_rects()
+    if rects:
+        bounds = rects[0].unionall (rects[1:])
+    else:
+        bounds = pygame.Rect (0, 0, 0, 0)
+    core = bounds.copy()
+    while core.width > 0 and core.height > 0:
+        solid = pygame.mask.Mask (core.size, fill=True)
+        if mask.overlap_area (solid, core.topleft) == core.width * core.height:
+            break
+        core.inflate_ip (-2, -2)
+    if core.width <= 0 or core.height <= 0:
+        core = pygame.Rect (0, 0, 0, 0)
+    _mask_shapes[key] = (mask, (bounds, core))
+    return bounds, core
+
+def largest_car_size():
+    """The (width, height) of the widest and of the tallest car images, in either direction"""
+    widest = 0
+    tallest = 0
+    for spritefile in set (Car.fast_car_sprites + Car.car_sprites + Car.slow_car_sprites):
+        for speed in (1, -1):
+            width, height = Car.image_cache.load_rotated_image (spritefile, Car.rotation (speed)).get_size()
+            widest = max (widest, width)
+            tallest = max (tallest, height)
+    return widest, tallest
+
+def car_overhang():
+    """How far a car can stick out above or below its road"""
+    width, height = largest_car_size()
+    return max (0, -(-(height - GameConstants.road_width) // 2))
+
+class LaneCollisionIndex:
+    """A broadphase for collisions between frogs and cars.
+
+    Every car belongs to exactly one Road, so instead of testing each frog against every car on
+    screen, the cars are bucketed by their road, and within the road by which bucket_width-wide
+    interval of x they overlap. A frog is then only tested against the cars in the one or two lanes
+    that it overlaps, and only in the buckets that it overlaps.
+
+    The index is a snapshot, call rebuild() each tick after the cars have moved.
+    """
+
+    def __init__(self, bucket_width=128):
+        self.bucket_width = bucket_width
+        self._lane_tops = []
+        self._lanes = []
+        self._tallest_lane = 0
+
+    def rebuild(self, roads):
+        """Index the cars of each Road in roads, using each road's cars group."""
+        bucket_width = self.bucket_width
+        lanes = []
+        for road in roads:
+            # Normally a lane is exactly the road's rect, but a car taller than the road would
+            # overhang in to the neighbouring roads.
+            extent = road.rect.unionall ([car.rect for car in road.cars]) if road.cars else road.rect
+            buckets = {}
+            for car in road.cars:
+                for bucket in range (car.rect.left // bucket_width, car.rect.right // bucket_width + 1):
+                    buckets.setdefault (bucket, []).append (car)
+            if buckets:
+                lanes.append ((extent.top, extent.bottom, buckets))
+        lanes.sort (key=lambda lane: lane[0])
+        self._lanes = lanes
+        self._lane_tops = [lane[0] for lane in lanes]
+        self._tallest_lane = max ((bottom - top for top, bottom, buckets in lanes), default=0)
+
+    def candidates(self, rect):
+        """Returns the set of cars in the buckets that rect overlaps, without any pixel tests."""
+        result = set()
+        bucket_width = self.bucket_width
+        first_bucket = rect.left // bucket_width
+        last_bucket = rect.right // bucket_width
+        # Lanes are sorted by their top, everything before index starts above rect.bottom
+        index = bisect_left (self._lane_tops, rect.bottom)
+        while index > 0:
+            index -= 1
+            top, bottom, buckets = self._lanes[index]
+            if top + self._tallest_lane <= rect.top:
+                break
+            if bottom <= rect.top:
+                continue
+            for bucket in range (first_bucket, last_bucket + 1):
+                if bucket in buckets:
+                    result.update (buckets[bucket])
+        return result
+
+    def collide(self, sprite, collided=pygame.sprite.collide_mask):
+        """The equivalent of pygame.sprite.spritecollide (sprite, cars, False, collided), for all of
+        the cars in the index.
+        """
+        return [car for car in self.candidates (sprite.rect) if collided (sprite, car)]
+
+class AnalyticLaneCollisions:
+    """Collision detection that uses the lanes' fixed speeds, instead of indexing the cars each tick.
+
+    All of the cars on a Road move at the road's speed, so in a frame of reference that moves with
+    them every car is stationary, and the x-columns that each car occupies are a fixed interval
+    that's known from the moment it spawns. The Road keeps these intervals sorted (see
+    Road.lane_offsets), and the interval that a frog occupies at tick age is just its world x range
+    shifted by speed * age. Finding the cars that a frog might touch is then a binary search, so the
+    cost doesn't depend on how many cars are on the road.
+
+    The pixel test is only needed at the edges of the images: if the opaque parts of the images'
+    bounding boxes don't overlap then there's no collision, and if the solid cores of both images
+    overlap then there certainly is one. Anything else falls back to the collided function.
+
+    This has the same interface as LaneCollisionIndex, but rebuild() only sorts the roads, it doesn't
+    look at the cars. It only works for Car sprites spawned by Road.spawn_car, not for ArrayTraffic.
+    """
+
+    def __init__(self):
+        # Upper bounds on the size of a car, so that the binary search doesn't miss a wide car, and
+        # the vertical test doesn't miss one that overhangs its road.
+        self._widest_car = largest_car_size()[0]
+        self._overhang = car_overhang()
+        self._roads = []
+        self._road_tops = []
+        self._tallest_road = 0
+
+    def rebuild(self, roads):
+        """Take a snapshot of which roads exist, sorted by their top"""
+        self._roads = sorted (roads, key=lambda road: road.rect.top)
+        self._road_tops = [road.rect.top for road in self._roads]
+        self._tallest_road = max ((road.rect.height for road in self._roads), default=0)
+
+    def collide(self, sprite, collided=pygame.sprite.collide_mask):
+        """The equivalent of pygame.sprite.spritecollide (sprite, cars, False, collided), for the
+        cars on all of the roads. The collided function must agree with the sprites' masks.
+        """
+        rect = sprite.rect
+        bounds, core = mask_shape (sprite.mask)
+        bounds = bounds.move (rect.topleft)
+        core = core.move (rect.topleft)
+        result = []
+        # Roads are sorted by their top, everything before index starts above bounds.bottom
+        index = bisect_left (self._road_tops, bounds.bottom + self._overhang)
+        while index > 0:
+            index -= 1
+            road = self._roads[index]
+            if road.rect.top + self._tallest_road + self._overhang <= bounds.top:
+                break
+            if road.rect.bottom + self._overhang <= bounds.top:
+                continue
+            # The frog's x range, in the frame of reference of the road's cars
+            shift = road.speed * road.age
+            first = bisect_right (road.lane_offsets, bounds.left - shift - self._widest_car)
+            last = bisect_left (road.lane_offsets, bounds.right - shift)
+            for car in road.lane_cars[first:last]:
+                car_bounds, car_core = mask_shape (car.mask)
+                if not bounds.colliderect (car_bounds.move (car.rect.topleft)):
+                    continue
+                if core.colliderect (car_core.move (car.rect.topleft)) or collided (sprite, car):
+                    result.append (car)
+        return result
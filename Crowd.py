@@ -0,0 +1,174 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2019 Steve Cotton (Octalot)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Hundreds or thousands of AI frogs, racing along with the players.
+
+This needs NumPy, which is otherwise optional.
+"""
+
+try:
+    import sys
+    import pygame
+    from GameConstants import GameConstants
+    from Frogs import Frog
+    from Utils import TeamColorPainter
+except ImportError as err:
+    print ("couldn't load module. %s" % (err))
+    sys.exit(2)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class CrowdSprite(pygame.sprite.Sprite):
+    """A sprite that's only used to draw one of the AiCrowd's frogs, reused for different frogs each
+    frame in the same way as Traffic.TrafficSprite.
+    """
+    def __init__(self):
+        pygame.sprite.Sprite.__init__(self)
+        self.image = None
+        self.rect = pygame.Rect (0, 0, 0, 0)
+
+class AiCrowd:
+    """A crowd of AI frogs, with the same behaviour as AiFrog, stored as NumPy arrays instead of
+    sprites.
+
+    Each frog is an index in to the arrays: its left and top edges in world coordinates, its jump
+    step (an index in to GameConstants.frog_jump_movement, or -1 for a still frog), how many ticks
+    it will pause for before jumping again, and which of the team colors it has. Every frog shares
+    the same mask, and the frogs of each color share the same image.
+
+    update() advances all of the frogs in one vectorized step, and collide() removes the frogs that
+    have been run over.
+    """
+
+    # The frogs' colors, they're recolored by TeamColorPainter once for the whole crowd
+    team_colors = [
+        (255, 0, 255),
+        (255, 255, 255),
+        (255, 200, 0),
+        (80, 160, 255),
+        (255, 80, 80),
+        (160, 80, 255),
+    ]
+
+    # The frog_jump_movement, with an extra 0 so that a frog that's finished jumping can be
+    # indexed without a special case
+    _movement = GameConstants.frog_jump_movement + [0]
+
+    def __init__(self, count, camera_area, distance_align=0, seed=None):
+        """Create count frogs, starting just below camera_area (like AiFrogs, they're forced to jump
+        on to the screen). The seed is for the crowd's decisions of how long to pause between jumps.
+        """
+        if numpy is None:
+            raise RuntimeError ("AiCrowd requires NumPy")
+        self.random = numpy.random.default_rng (seed)
+        spritefile = Frog.sprites_files[0]
+        self._images = [TeamColorPainter.load_image (spritefile, color) for color in __class__.team_colors]
+        self.mask = TeamColorPainter.load_mask (spritefile)
+        self.width, self.height = self._images[0].get_size()
+        self._movement_array = numpy.array (__class__._movement, dtype=numpy.int32)
+
+        self.count = count
+        self.left = self.random.integers (camera_area.left, camera_area.right - self.width, size=count, dtype=numpy.int32)
+        start_top = camera_area.top + distance_align + (int (camera_area.height / GameConstants.jump_length) + 1) * GameConstants.jump_length
+        self.top = numpy.full (count, start_top, dtype=numpy.int32)
+        self.step = numpy.full (count, -1, dtype=numpy.int32)
+        self.pause = numpy.zeros (count, dtype=numpy.int32)
+        self.color = self.random.integers (0, len (self._images), size=count, dtype=numpy.int16)
+
+        # Reused each frame by materialize()
+        self._sprites = []
+
+    def __len__(self):
+        return self.count
+
+    def _keep(self, keep):
+        """Remove the frogs where keep is false"""
+        for name in ("left", "top", "step", "pause", "color"):
+            setattr (self, name, getattr (self, name)[keep])
+        self.count = len (self.left)
+
+    def bounding_box(self):
+        """The smallest Rect containing all of the frogs, or None if there aren't any"""
+        if not self.count:
+            return None
+        left = int (self.left.min())
+        top = int (self.top.min())
+        return pygame.Rect (left, top, int (self.left.max()) + self.width - left, int (self.top.max()) + self.height - top)
+
+    def force_jumps(self, camera_bottom, screen_scroll):
+        """The equivalent of RaceSimulation._scroll calling jump_forced() for each frog that's at the
+        bottom of the screen, camera_bottom is after scrolling.
+        """
+        forced = (self.step < 0) & (self.top + self.height + screen_scroll >= camera_bottom)
+        self.step[forced] = 0
+
+    def update(self):
+        """The equivalent of AiFrog.update() for every frog"""
+        last_step = len (__class__._movement) - 1
+        step = self.step
+        # Frog.update(), either moving one step of a jump, or finishing a jump
+        finished = step == last_step
+        jumping = (step >= 0) & ~finished
+        self.top[jumping] += self._movement_array[step[jumping]]
+        step[jumping] += 1
+        step[finished] = -1
+
+        # Still frogs count down their pause, and then start a new jump
+        still = step < 0
+        ready = still & (self.pause == 0)
+        self.pause[still & ~ready] -= 1
+        ready_count = int (numpy.count_nonzero (ready))
+        if ready_count:
+            self.pause[ready] = self.random.integers (1, 6, size=ready_count, dtype=numpy.int32)
+            self.top[ready] += self._movement_array[0]
+            step[ready] = 1
+
+    def collide(self, cars):
+        """Remove every frog that's hit by one of the cars, which are (rect, mask) pairs. Returns the
+        number of frogs removed.
+        """
+        if not self.count:
+            return 0
+        hit = numpy.zeros (self.count, dtype=bool)
+        left = self.left
+        top = self.top
+        for rect, mask in cars:
+            near = numpy.flatnonzero ((left < rect.right) & (left + self.width > rect.left) & (top < rect.bottom) & (top + self.height > rect.top) & ~hit)
+            for index in near:
+                if self.mask.overlap (mask, (rect.left - int (left[index]), rect.top - int (top[index]))):
+                    hit[index] = True
+        hits = int (numpy.count_nonzero (hit))
+        if hits:
+            self._keep (~hit)
+        return hits
+
+    def materialize(self, group, camera):
+        """Make the sprites in group match the frogs that are visible in camera, like
+        ArrayTraffic.materialize()
+        """
+        visible = numpy.flatnonzero ((self.left < camera.right) & (self.left + self.width > camera.left) & (self.top < camera.bottom) & (self.top + self.height > camera.top))
+        while len (self._sprites) < len (visible):
+            self._sprites.append (CrowdSprite())
+        for sprite, index in zip (self._sprites, visible):
+            sprite.image = self._images[self.color[index]]
+            sprite.rect = pygame.Rect (int (self.left[index]), int (self.top[index]), self.width, self.height)
+        group.add (self._sprites[:len (visible)])
+        for sprite in self._sprites[len (visible):]:
+            sprite.kill()
@@ -25,31 +25,73 @@ when that key is pressed again.
 """
 
 try:
+    import argparse
     import gettext
+    import os
     import sys
-    import random
+    import time
     import pygame
+    from pygame.locals import *
     from GameConstants import GameConstants
-    from Hazards import Grass, Road
-    from MessageSprites import *
-    from Utils import *
-    from Frogs import PlayerFrog
+    from Simulation import RaceSimulation
+    from Hazards import Road
+    from Rendering import LayeredRenderer
+    import AssetBundle
+    from Replay import ReplayWriter
+    from Profiling import FrameTimer, FrameTimeOverlay
 except ImportError as err:
     print ("couldn't load module. %s" % (err))
     sys.exit(2)
 
 gettext.install ('DartingFrogs', 'data/locale')
 
+def parse_options(argv=None):
+    parser = argparse.ArgumentParser (description=_("A multiplayer frog-racing game"))
+    parser.add_argument ("--full-redraw", action="store_true", help=_("redraw the whole screen every frame, instead of only the parts that changed"))
+    parser.add_argument ("--rush-hour", action="store_true", help=_("much busier roads, with the cars simulated as NumPy arrays instead of sprites"))
+    parser.add_argument ("--ai", type=int, default=0, metavar="COUNT", help=_("add this many AI frogs to each race, they look at the traffic before jumping"))
+    parser.add_argument ("--crowd", type=int, default=0, metavar="COUNT", help=_("add this many AI frogs to each race, this needs NumPy"))
+    parser.add_argument ("--record", metavar="DIRECTORY", help=_("save a replay of each race in this directory, which can be played back with Replay.py"))
+    parser.add_argument ("--fps", type=int, default=60, help=_("the maximum frame rate, 0 for no limit; the game runs at the same speed whatever this is"))
+    parser.add_argument ("--interpolate", action="store_true", help=_("when the frame rate is higher than the game's tick rate, draw the cars and frogs between their positions on each tick"))
+    parser.add_argument ("--profile", action="store_true", help=_("show how long each phase of each frame takes"))
+    parser.add_argument ("--profile-csv", metavar="DIRECTORY", help=_("save the time of each phase of each frame in this directory, as a CSV file for each race"))
+    parser.add_argument ("--render-scale", type=float, default=1.0, metavar="SCALE", help=_("draw the game at this fraction of its normal resolution, and let the display scale it to the window; 0.5 draws a quarter of the pixels"))
+    parser.add_argument ("--fullscreen", action="store_true", help=_("scale the game to fill the whole display"))
+    options = parser.parse_args (argv)
+    # The terrain is drawn in rows, which need to be a whole number of pixels tall
+    if options.render_scale <= 0 or not (options.render_scale * GameConstants.road_width).is_integer():
+        parser.error (_("the render scale must be a multiple of 1/%d") % GameConstants.road_width)
+    return options
+
 def main():
+    options = parse_options()
+
     # Initialise screen
     pygame.init()
     pygame.font.init()
     if not pygame.font.get_init():
         print ("Could not initialize fonts")
     camera_area = pygame.Rect (0, 0, 1024, 700)
-    screen = pygame.display.set_mode((camera_area.width, camera_area.height))
+    # The internal resolution that the game is drawn at. In SCALED mode, SDL scales that to the size
+    # of the window or the display once per frame, usually on the GPU.
+    render_size = (round (camera_area.width * options.render_scale), round (camera_area.height * options.render_scale))
+    flags = 0
+    if options.render_scale != 1 or options.fullscreen:
+        flags |= SCALED
+    if options.fullscreen:
+        flags |= FULLSCREEN
+    screen = pygame.display.set_mode(render_size, flags)
     pygame.display.set_caption(_('Darting Frogs'))
 
+    # Load all of the images now, so that the first car of each type doesn't cause a hitch
+    AssetBundle.warm_up (camera_area.width, scale=options.render_scale)
+
+    # Only queue the events that the game uses, so that (for example) mouse motion doesn't need to be
+    # filtered out of each frame's events
+    pygame.event.set_blocked (None)
+    pygame.event.set_allowed ([QUIT] + RaceSimulation.input_event_types)
+
     # Initialise joysticks
     print ("Joystick count:", pygame.joystick.get_count())
     for i in range (pygame.joystick.get_count()):
@@ -57,218 +99,124 @@ def main():
 
     play_again = True
     while play_again:
-        play_again = multiplayer_race (screen, camera_area)
+        play_again = multiplayer_race (screen, camera_area, options)
 
-def multiplayer_race (screen, camera_area) -> bool:
+def multiplayer_race (screen, camera_area, options=None) -> bool:
     """Each call of this function runs one complete game, from waiting for
     players until game over.
 
     Returns true if there should be another game. When the escape key is
     pressed, this returns false.
-    """
-    # Fill background
-    background = pygame.Surface(screen.get_size())
-    background = background.convert()
-    background.fill((0x40, 0x80, 0x40))
-
-    # Initialise players
-    players = []
-    new_players_can_join = PlayersCanJoinMessage()
-    new_players_can_join.rect.midtop = camera_area.midtop
-    game_over_sprite = None
-    distance_covered = 0
-    distance_until_next_hazard = GameConstants.road_width
-    # The text saying how far the frogs have gone
-    next_milestone = GameConstants.milestone_distance
 
-    # Initialise sprite groups
-    frog_sprites = pygame.sprite.Group(players)
-    # Scenery isn't dangerous (but includes roads, which spawn hazards)
-    scenery_sprites = pygame.sprite.Group()
-    # Hazard sprites are the ones that will kill colliding frogs
-    hazard_sprites = pygame.sprite.Group()
-    # There's no separate title screen, it's just something that's shown on top
-    # of the grass area before any players join. Feel free to remove this if you
-    credits_message = MultiLineMessageSprite([
-        "Darting Frogs",
-        "by Octalot (Steve Cotton), based on Tom Chance's GPLv2+ PyGame tutorial",
-        "cars and trucks by Lowder2 (CC-BY 3.0) and Satik64 (CC0)",
-        "road textures by Thomas Oppl for SuperTuxKart (CC-BY-SA 3.0)",
-        "grass textures from Widelands (GPLv2+)",
-        "Thanks to all of the above, and to the OpenGameArt and PyGame communities",
-    ], firstLineSize=40)
-    credits_message.rect.bottomleft = camera_area.bottomleft
-
-    # Message sprites are overlayed over everything else
-    message_sprites = pygame.sprite.Group()
-    message_sprites.add (new_players_can_join)
-    message_sprites.add (credits_message);
-
-    # Initialise clock and RNG
+    The game logic is in RaceSimulation, this function handles the clock,
+    the quit keys and the drawing. The options are the result of
+    parse_options(), None means to use the defaults.
+    """
+    if options is None:
+        options = parse_options ([])
+
+    # Shown anywhere that there isn't any scenery
+    background_color = (0x40, 0x80, 0x40)
+
+    if options.rush_hour:
+        simulation = RaceSimulation (camera_area, array_traffic=True, spawn_range=Road.rush_hour_spawn_range, crowd=options.crowd, ai_frogs=options.ai, row_worker=True)
+    else:
+        simulation = RaceSimulation (camera_area, crowd=options.crowd, ai_frogs=options.ai, row_worker=True)
+    renderer = LayeredRenderer (screen, background_color, dirty_rects=not options.full_redraw, scale=options.render_scale)
+
+    recorder = None
+    if options.record:
+        os.makedirs (options.record, exist_ok=True)
+        recorder = ReplayWriter (os.path.join (options.record, time.strftime ("race-%Y%m%d-%H%M%S.replay")), simulation)
+        print ("Recording race with seed", simulation.seed)
+
+    if options.profile or options.profile_csv:
+        simulation.frame_timer = FrameTimer (keep_history=bool (options.profile_csv))
+    if options.profile:
+        renderer.overlay_sprites.add (FrameTimeOverlay (simulation.frame_timer))
+
+    try:
+        return _run_race (screen, simulation, renderer, background_color, recorder, options)
+    finally:
+        if recorder is not None:
+            recorder.close()
+        if options.profile_csv:
+            os.makedirs (options.profile_csv, exist_ok=True)
+            simulation.frame_timer.write_csv (os.path.join (options.profile_csv, time.strftime ("frame-times-%Y%m%d-%H%M%S.csv")))
+
+# If the game falls behind, it runs at most this many ticks before drawing a frame. Below
+# GameConstants.ticks_per_second / max_ticks_per_frame frames per second, the game slows down.
+max_ticks_per_frame = 5
+
+# A tick can run this fraction of a tick early. With the frame rate the same as the tick rate, the
+# frames are sometimes a millisecond early and sometimes a millisecond late, and this stops that
+# alternating between zero and two ticks per frame.
+tick_tolerance = 0.1
+
+def _run_race (screen, simulation, renderer, background_color, recorder, options) -> bool:
+    """The event loop of multiplayer_race, recorder is either None or a ReplayWriter. The phases of
+    each frame are timed by simulation.frame_timer.
+
+    The simulation runs at a fixed GameConstants.ticks_per_second, independent of the frame rate.
+    The time since the last frame is added to an accumulator, and as many ticks are run as fit in
+    it; the frame rate may be higher than the tick rate, in which case some frames don't run any
+    ticks, or lower, in which case some frames run several ticks.
+    """
+    timer = simulation.frame_timer
+    tick_seconds = 1.0 / GameConstants.ticks_per_second
+    accumulator = 0.0
+    last_frame_time = time.perf_counter()
+    # Events that have arrived since the last tick
+    inputs = []
+
+    # Initialise clock
     clock = pygame.time.Clock()
-    random_number_generator = random.Random()
-
-    # For the first screen, generate some roads and cover the rest of the start-screen in grass
-    initial_roads = random_number_generator.sample(range (0,4), 3)
-    for i in range (-1, 1 + int (camera_area.height / GameConstants.road_width)):
-        if i in initial_roads:
-            new_scenery = Road (hazard_sprites, Rect(0, i * GameConstants.road_width, camera_area.width, GameConstants.road_width))
-        else:
-            new_scenery = Grass (Rect(0, i * GameConstants.road_width, camera_area.width, GameConstants.road_width))
-        scenery_sprites.add (new_scenery)
-        new_scenery.update()
 
     # Blit everything to the screen
-    screen.blit(background, (0, 0))
+    screen.fill(background_color)
     pygame.display.flip()
 
     # Event loop
     while 1:
-        # Make sure game doesn't run at more than 60 frames per second
-        clock.tick(60)
+        timer.start_frame()
+        # Limit the frame rate, with 0 this doesn't wait at all
+        clock.tick(options.fps)
+        timer.mark ("wait")
+        now = time.perf_counter()
+        accumulator = min (accumulator + now - last_frame_time, max_ticks_per_frame * tick_seconds)
+        last_frame_time = now
 
         for event in pygame.event.get():
             if event.type == QUIT:
                 return False
             elif event.type == KEYDOWN and event.key == K_ESCAPE:
                     return False
-            elif event.type in [KEYDOWN, MOUSEBUTTONDOWN, JOYBUTTONDOWN]:
-                already_controls_a_frog = False
-                for player in players:
-                    if player.test_input_matches (event):
-                        already_controls_a_frog = True
-                        player.jump()
-                if not already_controls_a_frog:
-                    if new_players_can_join.alive():
-                        frog = PlayerFrog (input_event=event, column=len(players), distance_align=-distance_until_next_hazard)
-                        players.append (frog)
-                        frog_sprites.add (frog)
-                        frog.jump()
-                        message_sprites.add (EachJoiningPlayerMessage (frog))
-                    else:
-                        # todo: show that the new-player phase has ended
-                        pass
-
-            elif event.type in [KEYUP, MOUSEBUTTONUP, JOYBUTTONUP]:
-                for player in players:
-                    if player.test_input_matches (event):
-                        player.rest()
-
-            # To support JOYAXISMOTION would need logic for which positions represent "button down",
-            # which represent "button up", and which pairs of axis should represent a single frog.
-            # IMO buttons and keys seem better suited to this game anyway.
-            elif event.type == JOYAXISMOTION:
-                if new_players_can_join.alive():
-                    new_players_can_join.kill()
-                    new_players_can_join = PlayersCanJoinMessage(new_players_can_join)
-                    message_sprites.add(new_players_can_join)
-
-        # Find out where the frogs are, calculate whether the screen should scroll
-        screen_scroll = 0
-        bounds = get_bounding_box (frog_sprites)
-        if bounds != None:
-            # Scroll if no-one's near the bottom
-            if bounds.bottom < 0.8 * camera_area.height:
-                screen_scroll += 1
-            # Scroll if anyone is ahead
-            if bounds.top < 0.5 * camera_area.height:
-                screen_scroll += 1
-            # Scroll faster if someone is far ahead
-            if bounds.top < 0.2 * camera_area.height:
-                screen_scroll += 2
-            # Jumpy scroll if someone is almost off-screen
-            if bounds.top < GameConstants.furthest_single_tick_jump:
-                screen_scroll += GameConstants.furthest_single_tick_jump - bounds.top
-        # In a single-player game, the screen always scrolls
-        if len (frog_sprites) == 1 and screen_scroll == 0 and not new_players_can_join.alive():
-            screen_scroll = 1
-        # When the game over message is being displayed, the screen scrolls continually. This
-        # scrolls at a fixed speed, it's no problem if a frog jumps off the top of the screen.
-        if game_over_sprite != None:
-            screen_scroll = 3
-
-        # Screen scroll is really moving everything downwards
-        for entity in frog_sprites:
-            entity.rect.move_ip (0, screen_scroll)
-        for entity in scenery_sprites:
-            entity.rect.move_ip (0, screen_scroll)
-        for entity in hazard_sprites:
-            entity.rect.move_ip (0, screen_scroll)
-        for entity in message_sprites:
-            entity.rect.move_ip (0, screen_scroll)
-
-        # If any frogs are at the back of the screen, move them
-        if screen_scroll:
-            distance_covered += screen_scroll
-            distance_until_next_hazard -= screen_scroll
-            for player in players:
-                if player.rect.bottom + screen_scroll >= camera_area.height:
-                    player.jump_forced()
-
-        # Scrolling the screen may introduce a new hazard or hazard-spawning scenery
-        if distance_until_next_hazard <= 0:
-            distance_until_next_hazard += GameConstants.road_width
-            hazard = random_number_generator.choice (("grass", "road", "road"))
-            if hazard == "grass":
-                new_scenery = Grass (Rect(0, -distance_until_next_hazard, camera_area.width, GameConstants.road_width))
-                scenery_sprites.add (new_scenery)
-            if hazard == "road":
-                new_scenery = Road (hazard_sprites, Rect(0, -distance_until_next_hazard, camera_area.width, GameConstants.road_width))
-                scenery_sprites.add (new_scenery)
-
-        if distance_covered >= next_milestone:
-            milestone = MessageSprite (_("Distance: %d") % next_milestone)
-            milestone.rect.midtop = camera_area.midtop
-            message_sprites.add (milestone)
-            next_milestone += GameConstants.milestone_distance
-
-        message_sprites.update()
-        hazard_sprites.update()
-        scenery_sprites.update()
-        frog_sprites.update()
-
-        offscreenRemoval = []
-        for entity in scenery_sprites:
-            if entity.rect.top > camera_area.height:
-                offscreenRemoval.append (entity)
-        for entity in hazard_sprites:
-            if entity.rect.top > camera_area.height:
-                offscreenRemoval.append (entity)
-        for entity in message_sprites:
-            if entity.rect.top > camera_area.height:
-                offscreenRemoval.append (entity)
-        for entity in offscreenRemoval:
-            entity.kill()
-        if game_over_sprite and not game_over_sprite.alive():
-            return True
-
-        # Now check for collisions
-        for player in frog_sprites:
-            hit = pygame.sprite.spritecollide (player, hazard_sprites, False, collided=pygame.sprite.collide_mask)
-            if (hit):
-                player.kill()
-                new_players_can_join.kill()
-        # Check for game over
-        if (not frog_sprites) and (not new_players_can_join.alive()):
-            if not game_over_sprite:
-                game_over_sprite = MessageSprite (_("GAME OVER (distance %d)") % distance_covered)
-                game_over_sprite.rect.midtop = camera_area.midtop
-                message_sprites.add (game_over_sprite)
-        # Check for victory in multiplayer, if there is exactly one frog still alive
-        if len (frog_sprites) == 1 and len (players) > 1:
-            if not game_over_sprite:
-                for player in players:
-                    if player.alive():
-                        game_over_sprite = VictoryMessage (player)
-                        game_over_sprite.rect.midtop = camera_area.midtop
-                        message_sprites.add (game_over_sprite)
-
-        screen.blit(background, (0, 0))
-        scenery_sprites.draw(screen)
-        hazard_sprites.draw(screen)
-        frog_sprites.draw(screen)
-        message_sprites.draw(screen)
-        pygame.display.flip()
+            else:
+                inputs.append (event)
+        timer.mark ("input")
+
+        while accumulator >= (1 - tick_tolerance) * tick_seconds:
+            if options.interpolate and accumulator < (2 - tick_tolerance) * tick_seconds:
+                # This is the last tick before drawing
+                renderer.remember_positions (simulation)
+            simulation.step (inputs)
+            if recorder is not None:
+                recorder.record (inputs)
+                timer.mark ("record")
+            inputs = []
+            accumulator -= tick_seconds
+            if simulation.finished:
+                return True
+
+        renderer.overlay_sprites.update (simulation.camera)
+        if options.interpolate:
+            dirty = renderer.draw (simulation, max (0.0, min (1.0, accumulator / tick_seconds)))
+        else:
+            dirty = renderer.draw (simulation)
+        timer.mark ("draw")
+        renderer.update_display (dirty)
+        timer.mark ("flip")
+        timer.end_frame()
 
 if __name__ == '__main__':
     main()
@@ -23,6 +23,8 @@ try:
     from enum import Enum
     import sys
     import random
+    from bisect import bisect_left, insort
+    from itertools import count
     import pygame
     from pygame.locals import *
     from GameConstants import GameConstants
@@ -46,6 +48,22 @@ class InputTest:
         else:
             return event.type
 
+    def dispatch_key(event):
+        """A tuple identifying the key or button of a KEYDOWN, KEYUP, MOUSEBUTTONDOWN, MOUSEBUTTONUP,
+        JOYBUTTONDOWN or JOYBUTTONUP event, which is the same for the UP and DOWN events. Two events
+        have the same dispatch_key exactly when an InputTest for one matches the other. Returns None
+        for any other type of event.
+        """
+        down_type = __class__.getDownType (event)
+        if down_type == KEYDOWN:
+            return (KEYDOWN, event.key)
+        elif down_type == MOUSEBUTTONDOWN:
+            return (MOUSEBUTTONDOWN, event.button)
+        elif down_type == JOYBUTTONDOWN:
+            return (JOYBUTTONDOWN, event.joy, event.button)
+        else:
+            return None
+
     def __init__(self, event):
         self.event_type = __class__.getDownType (event)
         if self.event_type == KEYDOWN:
@@ -131,15 +149,25 @@ class Frog(pygame.sprite.Sprite):
 
     sprites_files = ['frog_resting.png', 'frog_jump.png']
 
-    def __init__(self, name, team_color, placement_hint, column=0, distance_align=0):
+    # For player-controlled frogs, the InputTest.dispatch_key of the key or button that controls it
+    dispatch_key = None
+    # The FrogPositionIndex that this frog is in, if any, which is told whenever the frog moves
+    position_index = None
+
+    def __init__(self, name, team_color, placement_hint, column=0, distance_align=0, camera_area=None):
+        """camera_area is the Rect of the visible area, in the coordinates that the frog's rect will
+        use, and the frog is placed relative to it. If it's None then the display surface is used, a
+        headless simulation must pass it explicitly.
+        """
         pygame.sprite.Sprite.__init__(self)
         print ("Creating a new frog for", name, "in column", column)
         self.name = name
         self.team_color = team_color
         self.image = TeamColorPainter.load_image(__class__.sprites_files[0], team_color)
         self.rect = self.image.get_rect()
-        self.mask = pygame.mask.from_surface(self.image)
-        screen = pygame.display.get_surface()
+        self.mask = TeamColorPainter.load_mask(__class__.sprites_files[0])
+        if camera_area is None:
+            camera_area = pygame.display.get_surface().get_rect()
         self.state = Frog.State.still
         self.stateStep = 0;
 
@@ -147,20 +175,20 @@ class Frog(pygame.sprite.Sprite):
         # multiple of jump_length), newly-created frogs start at a vertically-aligned point.
         if placement_hint == Frog.PlacementHint.player:
             # Player frogs start on-screen, about a jump from the bottom of the screen.
-            self.rect.top = distance_align + (int (screen.get_rect().height / GameConstants.jump_length) - 1) * GameConstants.jump_length
+            self.rect.top = camera_area.top + distance_align + (int (camera_area.height / GameConstants.jump_length) - 1) * GameConstants.jump_length
         else:
             # AI frogs start off-screen, and so will be jump_forced() on to the screen
-            self.rect.top = distance_align + (int (screen.get_rect().height / GameConstants.jump_length) + 1) * GameConstants.jump_length
+            self.rect.top = camera_area.top + distance_align + (int (camera_area.height / GameConstants.jump_length) + 1) * GameConstants.jump_length
 
         # Place the frog horizontally.  There are four placement areas: left AI area, left player
         # area, right player area, right AI area. The "/ 5" is because keeping all players in the
         # middle 40% of the screen lets the players at the edge see more.  If there's an absurd
         # number of players, the algorithm starts putting them near the center again.
         frog_width = self.rect.width
-        placement_area_width = int (screen.get_rect().width / 5) - frog_width
+        placement_area_width = int (camera_area.width / 5) - frog_width
         use_left_side = column % 2
         offset_from_center = (frog_width * int (column / 2)) % placement_area_width
-        screen_centerx = int (screen.get_rect().width / 2)
+        screen_centerx = camera_area.left + int (camera_area.width / 2)
         if placement_hint == Frog.PlacementHint.ai:
             offset_from_center += placement_area_width
         if use_left_side:
@@ -180,12 +208,19 @@ class Frog(pygame.sprite.Sprite):
             # The scrolling code should keep frogs on screen
             self.rect.move_ip (0, GameConstants.frog_jump_movement[self.stateStep])
             self.stateStep = self.stateStep + 1
+            if self.position_index is not None:
+                self.position_index.moved (self)
         elif self.state == Frog.State.jump_repeat:
             self.stateStep = 0
         elif self.state == Frog.State.jump_and_stop:
             self.state = Frog.State.still
             self.stateStep = 0
 
+    def kill(self):
+        if self.position_index is not None:
+            self.position_index.remove (self)
+        super().kill()
+
     def get_name(self):
         return self.name
 
@@ -214,31 +249,114 @@ class Frog(pygame.sprite.Sprite):
         if self.state == Frog.State.jump_repeat:
             self.state = Frog.State.jump_and_stop
 
+class FrogPositionIndex:
+    """The live frogs, sorted by how far up the screen they are, for the scrolling decisions.
+
+    Frogs are kept as a sorted list of (rect.top, serial number) keys, with the serial number
+    breaking ties in the order that the frogs were added. A frog in the index tells it when it moves
+    and when it's killed, so the list is only changed for the frogs that are jumping, and finding the
+    front-runner, the back-marker or the frogs near the bottom of the screen is a binary search
+    instead of a scan of every frog.
+
+    Every frog has the same image, so sorting by the tops of the frogs also sorts their bottoms.
+    """
+
+    def __init__(self):
+        self._keys = []
+        self._frogs = {}
+        self._key_of = {}
+        self._serials = count()
+
+    def __len__(self):
+        return len (self._keys)
+
+    def add(self, frog):
+        key = (frog.rect.top, next (self._serials))
+        insort (self._keys, key)
+        self._frogs[key] = frog
+        self._key_of[frog] = key
+        frog.position_index = self
+
+    def remove(self, frog):
+        key = self._key_of.pop (frog, None)
+        if key is not None:
+            del self._keys[bisect_left (self._keys, key)]
+            del self._frogs[key]
+        frog.position_index = None
+
+    def moved(self, frog):
+        old_key = self._key_of[frog]
+        if old_key[0] == frog.rect.top:
+            return
+        del self._keys[bisect_left (self._keys, old_key)]
+        del self._frogs[old_key]
+        key = (frog.rect.top, old_key[1])
+        insort (self._keys, key)
+        self._frogs[key] = frog
+        self._key_of[frog] = key
+
+    def front(self):
+        """The frog that's furthest ahead, or None if there aren't any frogs"""
+        if not self._keys:
+            return None
+        return self._frogs[self._keys[0]]
+
+    def back(self):
+        """The frog that's furthest behind, or None if there aren't any frogs"""
+        if not self._keys:
+            return None
+        return self._frogs[self._keys[-1]]
+
+    def bottom_at_least(self, y):
+        """The frogs whose rect.bottom is y or more, which are the frogs within the bottom N pixels
+        of a screen when y is the screen's bottom minus N.
+        """
+        if not self._keys:
+            return []
+        height = self._frogs[self._keys[0]].rect.height
+        start = bisect_left (self._keys, (y - height,))
+        return [self._frogs[key] for key in self._keys[start:]]
+
 class PlayerFrog(Frog):
     """A frog controlled by a player (instead of a computer-controlled frog)"""
-    def __init__(self, input_event, column=0, distance_align=0):
+    def __init__(self, input_event, column=0, distance_align=0, camera_area=None):
         input_test = InputTest (input_event)
         name = input_test.describe_name()
         team_color = input_test.get_team_color()
-        Frog.__init__(self, name, team_color, Frog.PlacementHint.player, column, distance_align)
+        Frog.__init__(self, name, team_color, Frog.PlacementHint.player, column, distance_align, camera_area)
         self.input_test = input_test
+        self.dispatch_key = InputTest.dispatch_key (input_event)
 
     def test_input_matches(self, event):
         return self.input_test.matches (event)
 
 class AiFrog(Frog):
     """A computer-controlled frog"""
-    def __init__(self, input_event, column=0, distance_align=0):
+    def __init__(self, input_event, column=0, distance_align=0, camera_area=None, seed=None, planner=None):
+        """If seed is given, the AI's decisions are reproducible.
+
+        Without a planner, the AI jumps after a random pause and ignores the traffic. With a
+        Planner.LanePlanner, it asks the planner when it's safe to jump, and only falls back to the
+        random pauses when the planner is over its budget.
+        """
         name = _("AI %d") % column
         team_color = pygame.Color (255, 0, 255, 255)
-        Frog.__init__(self, name, team_color, Frog.PlacementHint.ai, column, distance_align)
-        self.random_number_generator = random.Random()
+        Frog.__init__(self, name, team_color, Frog.PlacementHint.ai, column, distance_align, camera_area)
+        self.random_number_generator = random.Random (seed)
         self.ai_pause = 0
+        self.planner = planner
 
     def update(self):
         Frog.update(self)
         if self.state == Frog.State.still:
-            if self.ai_pause == 0:
+            decision = None
+            if self.planner is not None:
+                decision = self.planner.should_jump (self)
+            if decision is not None:
+                if decision:
+                    self.jump_forced()
+                    Frog.update(self)
+            elif self.ai_pause == 0:
                 self.ai_pause = self.random_number_generator.randint (1, 5)
                 self.jump_forced()
                 Frog.update(self)
@@ -30,5 +30,9 @@ class GameConstants:
     # The furthest a frog can move in a single clock tick
     furthest_single_tick_jump = max (map (abs, frog_jump_movement))
 
+    # All of the speeds are in pixels per clock tick, and the simulation runs at this rate whatever
+    # the frame rate is.
+    ticks_per_second = 60
+
     # How far apart the "distance 1000" messages are
     milestone_distance = 2500
@@ -23,6 +23,7 @@
 try:
     import sys
     import random
+    from bisect import bisect_left
     import pygame
     from pygame.locals import *
     from Utils import ImageCache
@@ -35,6 +36,52 @@ class CenterPoint:
         self.x = x
         self.y = y
 
+class SpritePool:
+    """Killed sprites which can be re-initialised and used again, instead of creating new ones.
+
+    Long games create and kill thousands of cars and terrain rows, recycling them avoids the
+    allocations and the garbage collector's pauses. The classes using a pool put a sprite in to it
+    from their kill() method, and take one out in their create() function.
+    """
+
+    def __init__(self, max_size=256):
+        """At most max_size killed sprites are kept, any more are left for the garbage collector"""
+        self.max_size = max_size
+        self._free = []
+        # Statistics, see stats()
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+
+    def acquire(self):
+        """Returns a killed sprite, or None if the pool is empty and the caller should create one"""
+        if self._free:
+            self.reused += 1
+            return self._free.pop()
+        self.created += 1
+        return None
+
+    def release(self, sprite):
+        if len (self._free) < self.max_size:
+            self._free.append (sprite)
+        else:
+            self.discarded += 1
+
+    def stats(self):
+        """The number of sprites waiting in the pool, how many have been created and reused, and
+        how many were discarded because the pool was full.
+        """
+        return {
+            "free": len (self._free),
+            "created": self.created,
+            "reused": self.reused,
+            "discarded": self.discarded,
+        }
+
+def pool_stats():
+    """The stats() of each of the sprite pools, keyed by the class name"""
+    return {cls.__name__: cls.pool.stats() for cls in (Car, Grass, Road)}
+
 class Car(pygame.sprite.Sprite):
     """Cars (including trucks) that travel on a road"""
 
@@ -66,54 +113,159 @@ class Car(pygame.sprite.Sprite):
     ]
 
     image_cache = ImageCache()
+    pool = SpritePool()
+
+    # Used to choose the car's image if the caller doesn't supply a random number generator
+    shared_random = random.Random()
+
+    def rotation(speed):
+        """The car images are loaded pointing north, this is how far to rotate them for a car that's
+        moving at speed.
+        """
+        if speed > 0:
+            return -90
+        else:
+            return 90
+
+    def choose_image(speed, random_number_generator):
+        """Returns (spritefile, rotation) for a new car travelling at speed"""
+        if abs (speed) > 4:
+            spritefile = random_number_generator.choice (__class__.fast_car_sprites)
+        elif abs (speed) > 2:
+            spritefile = random_number_generator.choice (__class__.car_sprites)
+        else:
+            spritefile = random_number_generator.choice (__class__.slow_car_sprites)
+        return spritefile, __class__.rotation (speed)
+
+    def create(start_point, kill_point, speed=1, random_number_generator=None, spritefile=None):
+        """Returns a car, reusing a killed one from the pool if there is one. The arguments are the
+        same as for the constructor.
+        """
+        car = __class__.pool.acquire()
+        if car is None:
+            return Car (start_point, kill_point, speed, random_number_generator, spritefile)
+        car.reset (start_point, kill_point, speed, random_number_generator, spritefile)
+        return car
 
-    def __init__(self, start_point, kill_point, speed=1):
+    def __init__(self, start_point, kill_point, speed=1, random_number_generator=None, spritefile=None):
         """The car spawns with its center at start_point, which should be off-screen.
 
         Positive speeds make the car travel left-to-right, negative means right-to-left.
         When the center of the car reaches kill_point, the sprite is removed
+
+        The random_number_generator chooses the car's image, unless it's already been chosen
+        with choose_image() and is given as spritefile.
         """
         pygame.sprite.Sprite.__init__(self)
-        self.speed = speed
+        self.reset (start_point, kill_point, speed, random_number_generator, spritefile)
 
-        spritefile = None
-        if abs (speed) > 4:
-            spritefile = random.Random().choice (__class__.fast_car_sprites)
-        elif abs (speed) > 2:
-            spritefile = random.Random().choice (__class__.car_sprites)
-        else:
-            spritefile = random.Random().choice (__class__.slow_car_sprites)
+    def reset(self, start_point, kill_point, speed=1, random_number_generator=None, spritefile=None):
+        """Re-initialise the car in place, as if the constructor had been called with these
+        arguments.
+        """
+        self.speed = speed
+        if random_number_generator is None:
+            random_number_generator = __class__.shared_random
 
-        # The car images are loaded pointing north
-        if speed > 0:
-            self.image = __class__.image_cache.load_rotated_image (spritefile, -90)
+        if spritefile is None:
+            spritefile, rotation = __class__.choose_image (speed, random_number_generator)
         else:
-            self.image = __class__.image_cache.load_rotated_image (spritefile, 90)
-        self.mask = pygame.mask.from_surface(self.image)
+            rotation = __class__.rotation (speed)
+        self.spritefile = spritefile
+        self.image = __class__.image_cache.load_rotated_image (spritefile, rotation)
+        self.mask = __class__.image_cache.load_rotated_mask (spritefile, rotation)
         self.rect = self.image.get_rect()
         self.rect.center = start_point.x, start_point.y
         self.kill_point = kill_point
+        # Set by Road.spawn_car, see Road.lane_offsets
+        self.road = None
+        self.lane_offset = None
+        # Set by schedule_kill()
+        self.schedule = None
+        self.despawn_event = None
+        self.offscreen_event = None
+
+    def schedule_kill(self, schedule):
+        """Use a Scheduler.RaceSchedule to kill the car on the tick that it passes kill_point, or
+        when it scrolls off the bottom of the screen, instead of checking for both in update().
+        This must be called on the tick that the car is created, before its first update().
+        """
+        if self.kill_point > 0:
+            distance = self.kill_point - self.rect.left
+        else:
+            distance = self.rect.right - self.kill_point
+        # The number of updates until update() would have found it past the kill_point
+        ticks = max (1, distance // abs (self.speed) + 1)
+        self.schedule = schedule
+        self.despawn_event = schedule.ticks.call_at (schedule.ticks.now + ticks, self.kill)
+        self.offscreen_event = schedule.call_when_offscreen (self, self.kill)
 
     def update(self):
         self.rect.move_ip (self.speed, 0)
+        if self.schedule is not None:
+            return
         if self.kill_point > 0 and self.rect.left > self.kill_point:
             self.kill()
         elif self.kill_point < 0 and self.rect.right < self.kill_point:
             self.kill()
 
     def kill(self):
-        super().kill()
+        if self.alive():
+            super().kill()
+            if self.road is not None:
+                self.road.forget_car (self)
+            if self.schedule is not None:
+                self.schedule.ticks.cancel (self.despawn_event)
+                self.schedule.scroll.cancel (self.offscreen_event)
+                self.schedule = None
+            __class__.pool.release (self)
+
+class RowPlan:
+    """The random choices for a row of grass or road, made by Grass.plan() or Road.plan() before the
+    row is created. They don't touch any sprites, so they can be made ahead of time, on another
+    thread (see LanePipeline.py). The row takes over the plan's random number generator, and
+    carries on using it.
+    """
+
+    def __init__(self, kind, rect, imagefile, random_number_generator):
+        # "grass" or "road"
+        self.kind = kind
+        self.rect = rect
+        self.imagefile = imagefile
+        self.random = random_number_generator
+        # The rest are only used by roads
+        self.speed = None
+        self.min_spawn_ticks = None
+        self.max_spawn_ticks = None
+        self.spawnx = None
+        self.killx = None
+        # The (spawnx, spritefile) of each car that's already on the road when it appears
+        self.cars = []
+        # The number of ticks after the road's first update() until it spawns a car at spawnx
+        self.first_spawn_ticks = None
 
 class TiledBackground(pygame.sprite.Sprite):
-    """Common code for roads and grass areas that will be drawn with lots of copies of a single image."""
+    """Common code for roads and grass areas that will be drawn with lots of copies of a single image.
+
+    Each subclass has its own SpritePool, killed rows are put in to it to be reused by create().
+    """
 
     image_cache = ImageCache()
 
     def __init__(self, rect, imagefile):
         pygame.sprite.Sprite.__init__(self)
+        self.set_image (rect, imagefile)
+
+    def set_image(self, rect, imagefile):
         self.rect = rect
+        self.imagefile = imagefile
         self.image = __class__.image_cache.load_tiled_image (imagefile, rect.width, rect.height)
 
+    def kill(self):
+        if self.alive():
+            super().kill()
+            self.pool.release (self)
+
 class Grass(TiledBackground):
     """Grass is not hazardous, but it's here to use the TiledBackground"""
 
@@ -124,72 +276,239 @@ class Grass(TiledBackground):
         "terrain/meadow4_00.png",
     ]
 
-    def __init__(self, rect):
-        TiledBackground.__init__(self, rect, random.Random().choice(__class__.background_images))
+    pool = SpritePool()
+
+    def create(rect, seed=None, plan=None):
+        """Returns a Grass, reusing a killed one from the pool if there is one"""
+        grass = __class__.pool.acquire()
+        if grass is None:
+            return Grass (rect, seed, plan)
+        grass.reset (rect, seed, plan)
+        return grass
+
+    def plan(rect, seed=None):
+        """The RowPlan for Grass (rect, seed)"""
+        random_number_generator = random.Random (seed)
+        return RowPlan ("grass", rect, random_number_generator.choice (__class__.background_images), random_number_generator)
+
+    def __init__(self, rect, seed=None, plan=None):
+        """If seed is given, the image is chosen by a random number generator with that seed. A plan
+        from Grass.plan() replaces the seed.
+        """
+        if plan is None:
+            plan = __class__.plan (rect, seed)
+        self.random = plan.random
+        TiledBackground.__init__(self, rect, plan.imagefile)
+
+    def reset(self, rect, seed=None, plan=None):
+        if plan is None:
+            if seed is not None:
+                self.random.seed (seed)
+            self.set_image (rect, self.random.choice(__class__.background_images))
+        else:
+            self.random = plan.random
+            self.set_image (rect, plan.imagefile)
 
 class Road(TiledBackground):
     """A road is both a background, and a monsterspawn for cars."""
 
     random_speeds = [1, 2, 3, 3, 3, 4, 4, 4, 5, 5, 8, -1, -2, -3, -3, -3, -4, -4, -4, -5, -5, -8]
     random_spawn_range = [300, 1000]
+    # For stress-testing, much denser traffic than random_spawn_range
+    rush_hour_spawn_range = [90, 240]
 
     background_images = [
         "terrain/road1.png",
         "terrain/road2.png",
     ]
 
-    def __init__(self, car_sprite_group, rect, speed=0):
+    pool = SpritePool()
+
+    def create(car_sprite_group, rect, speed=0, traffic=None, spawn_range=None, seed=None, schedule=None, plan=None):
+        """Returns a Road, reusing a killed one from the pool if there is one. The arguments are the
+        same as for the constructor.
+        """
+        road = __class__.pool.acquire()
+        if road is None:
+            return Road (car_sprite_group, rect, speed, traffic, spawn_range, seed, schedule, plan)
+        road.reset (car_sprite_group, rect, speed, traffic, spawn_range, seed, schedule, plan)
+        return road
+
+    def plan(rect, speed=0, spawn_range=None, random_number_generator=None):
+        """Make all of the random choices for a new road, in the same order as the road itself would:
+        its image, its speed if speed is 0, and the cars that are already on it when it appears.
+        Returns a RowPlan.
+        """
+        if random_number_generator is None:
+            random_number_generator = random.Random()
+        plan = RowPlan ("road", rect, random_number_generator.choice (__class__.background_images), random_number_generator)
+        if not speed:
+            speed = random_number_generator.choice (__class__.random_speeds)
+        plan.speed = speed
+        if spawn_range is None:
+            spawn_range = __class__.random_spawn_range
+        # At least one tick, otherwise the loop below would never finish
+        plan.min_spawn_ticks = max (1, int (spawn_range[0] / abs (speed)))
+        plan.max_spawn_ticks = max (plan.min_spawn_ticks + 1, int (spawn_range[1] / abs (speed)))
+        # Cars are created in the middle (vertically) of the road at x=spawnx, and disappear at killx
+        if speed < 0:
+            plan.spawnx = rect.width + 100
+            plan.killx = -100
+        else:
+            plan.spawnx = -100
+            plan.killx = rect.width + 100
+        # The road will still be off-screen on its first update(), which puts cars that are already
+        # on the road between killx and spawnx, so that the roads don't start empty
+        spawnx = plan.killx
+        if speed < 0:
+            while spawnx < plan.spawnx:
+                spawnx -= speed * random_number_generator.randrange (plan.min_spawn_ticks, plan.max_spawn_ticks)
+                plan.cars.append ((spawnx, Car.choose_image (speed, random_number_generator)[0]))
+        else:
+            while spawnx > plan.spawnx:
+                spawnx -= speed * random_number_generator.randrange (plan.min_spawn_ticks, plan.max_spawn_ticks)
+                plan.cars.append ((spawnx, Car.choose_image (speed, random_number_generator)[0]))
+        plan.first_spawn_ticks = random_number_generator.randrange (plan.min_spawn_ticks, plan.max_spawn_ticks)
+        plan.first_spawn_ticks += int (abs (spawnx - plan.spawnx) / abs (speed))
+        return plan
+
+    def __init__(self, car_sprite_group, rect, speed=0, traffic=None, spawn_range=None, seed=None, schedule=None, plan=None):
         """The cars on a road all travel at the same speed
 
         speed=0 means to randomly generate a speed.
 
         Spawned cars will be added to the car_sprite_group passed to the
         constructor, collision detection will treat sprites in the
-        car_sprite_group as deadly hazards.
+        car_sprite_group as deadly hazards. They are also added to this road's
+        own cars group, so that collision detection can look at one lane at a
+        time.
+
+        If traffic is given, the cars are added to it instead of being
+        sprites, for example an ArrayTraffic. The spawn_range overrides
+        random_spawn_range, the distance in pixels between cars.
+
+        Everything random about the road, including its cars, comes from the road's own random
+        number generator. If seed is given, that's seeded with it, so that the road can be
+        reproduced exactly.
+
+        If schedule is given, a Scheduler.RaceSchedule, the road schedules each of its spawns with
+        it instead of waiting for them in update(), and each sprite car schedules its own kill. The
+        road must still be updated on every tick, and the schedule's ticks must be run after the
+        updates.
+
+        If plan is given, a RowPlan from Road.plan(), it replaces speed, spawn_range and seed.
         """
-        TiledBackground.__init__(self, rect, random.Random().choice(__class__.background_images))
-        self.car_sprite_group = car_sprite_group
+        # The TiledBackground part is initialised by reset()
+        pygame.sprite.Sprite.__init__(self)
         self.random = random.Random()
-        self.rect = rect
-        if speed:
-            self.speed = speed
-        else:
-            self.speed = self.random.choice (__class__.random_speeds)
-        self.min_spawn_ticks = int (__class__.random_spawn_range[0] / abs (self.speed))
-        self.max_spawn_ticks = int (__class__.random_spawn_range[1] / abs (self.speed))
-        # Cars are created in the middle (vertically) of the road at x=spawnx, and disappear at killx
-        if self.speed < 0:
-            self.spawnx = self.rect.width + 100
-            self.killx = -100
-        else:
-            self.spawnx = -100
-            self.killx = self.rect.width + 100
-        # Put some cars on the road during the first update() call
-        self.ticks_until_next_spawn = -1
+        self.cars = pygame.sprite.Group()
+        self.reset (car_sprite_group, rect, speed, traffic, spawn_range, seed, schedule, plan)
+
+    def reset(self, car_sprite_group, rect, speed=0, traffic=None, spawn_range=None, seed=None, schedule=None, plan=None):
+        """Re-initialise the road in place, as if the constructor had been called with these
+        arguments.
+        """
+        if plan is None:
+            if seed is not None:
+                self.random.seed (seed)
+            plan = __class__.plan (rect, speed, spawn_range, self.random)
+        self.random = plan.random
+        self.set_image (rect, plan.imagefile)
+        self.car_sprite_group = car_sprite_group
+        self.traffic = traffic
+        self.schedule = schedule
+        self.spawn_event = None
+        # Any of the old cars that are still alive belong to a road that's gone
+        for car in self.cars:
+            car.road = None
+        self.cars.empty()
+        # The number of times that update() has been called
+        self.age = 0
+        # Cars on a road all move at the same speed, so in a frame of reference that moves with the
+        # cars, each car's position is constant: car.rect.left == car.lane_offset + speed * age.
+        # These are the lane_offsets of the cars, sorted, and the cars in the same order.
+        self.lane_offsets = []
+        self.lane_cars = []
+        # Each car's (lane_offset, mask, spritefile), in the order that they were spawned. Cars are
+        # only killed once they've left the screen, so this only grows, which lets Planner's
+        # LaneForecasts and Network's DeltaEncoder be updated incrementally. Reset replaces the
+        # list, rather than emptying it.
+        self.spawn_log = []
+        self.speed = plan.speed
+        self.min_spawn_ticks = plan.min_spawn_ticks
+        self.max_spawn_ticks = plan.max_spawn_ticks
+        self.spawnx = plan.spawnx
+        self.killx = plan.killx
+        self.initial_cars = plan.cars
+        self.first_spawn_ticks = plan.first_spawn_ticks
+        # The age at which the next car will be spawned at spawnx. None until the first update(),
+        # which puts the plan's cars on the road.
+        self.spawn_age = None
 
     def update(self):
-        # Negative ticks_until_next_spawn mean this is the first update() for this road, and it will
-        # still be off-screen.  Spawn a car that's already on the road, so that the roads don't
-        # start empty.
-        if self.ticks_until_next_spawn < 0:
-            spawnx = self.killx
-            if self.speed < 0:
-                while spawnx < self.spawnx:
-                    spawnx -= self.speed * random.randrange (self.min_spawn_ticks, self.max_spawn_ticks)
-                    self.spawn_car(spawnx)
-            else:
-                while spawnx > self.spawnx:
-                    spawnx -= self.speed * random.randrange (self.min_spawn_ticks, self.max_spawn_ticks)
-                    self.spawn_car(spawnx)
-            self.ticks_until_next_spawn = random.randrange (self.min_spawn_ticks, self.max_spawn_ticks)
-            self.ticks_until_next_spawn += int (abs (spawnx - self.spawnx) / abs (self.speed))
-        elif self.ticks_until_next_spawn == 0:
-            self.spawn_car (self.spawnx)
-            self.ticks_until_next_spawn = random.randrange (self.min_spawn_ticks, self.max_spawn_ticks)
-        else:
-            self.ticks_until_next_spawn -= 1
+        self.age += 1
+        # This is the first update() for this road, and it will still be off-screen.  Spawn the
+        # cars that are already on the road, so that the roads don't start empty.
+        if self.spawn_age is None:
+            for spawnx, spritefile in self.initial_cars:
+                self.spawn_car (spawnx, spritefile)
+            self.spawn_age = self.age + self.first_spawn_ticks + 1
+            if self.schedule is not None:
+                self._schedule_spawn()
+        elif self.schedule is None and self.age == self.spawn_age:
+            self._spawn_next()
 
-    def spawn_car(self, spawnx):
+    def _spawn_next(self):
+        self.spawn_car (self.spawnx)
+        self.spawn_age = self.age + self.random.randrange (self.min_spawn_ticks, self.max_spawn_ticks) + 1
+
+    def _schedule_spawn(self):
+        # Each road's spawns keep the order of the roads' first updates, the same order as updating
+        # all of the roads would spawn them in
+        ticks = self.schedule.ticks
+        order = None if self.spawn_event is None else self.spawn_event.order
+        self.spawn_event = ticks.call_at (ticks.now + self.spawn_age - self.age, self._scheduled_spawn, order=order)
+
+    def _scheduled_spawn(self):
+        self._spawn_next()
+        self._schedule_spawn()
+
+    def next_spawn_age(self):
+        """The age at which the next car will be spawned at spawnx, or None if the road hasn't had
+        its first update() yet.
+        """
+        return self.spawn_age
+
+    def spawn_car(self, spawnx, spritefile=None):
+        """Spawn a car centered at spawnx, its image is chosen at random unless spritefile is given"""
+        if self.traffic is not None:
+            self.traffic.spawn (self, spawnx, spritefile)
+            return
         start_point = CenterPoint (spawnx, self.rect.centery)
-        car = Car (start_point, self.killx, self.speed)
+        car = Car.create (start_point, self.killx, self.speed, self.random, spritefile)
         self.car_sprite_group.add (car)
+        self.cars.add (car)
+        car.road = self
+        car.lane_offset = car.rect.left - self.speed * self.age
+        index = bisect_left (self.lane_offsets, car.lane_offset)
+        self.lane_offsets.insert (index, car.lane_offset)
+        self.lane_cars.insert (index, car)
+        self.spawn_log.append ((car.lane_offset, car.mask, car.spritefile))
+        if self.schedule is not None:
+            car.schedule_kill (self.schedule)
+
+    def forget_car(self, car):
+        """Called when one of this road's cars is killed, to remove it from the lane_offsets"""
+        index = bisect_left (self.lane_offsets, car.lane_offset)
+        while self.lane_cars[index] is not car:
+            index += 1
+        del self.lane_offsets[index]
+        del self.lane_cars[index]
+
+    def kill(self):
+        if self.alive() and self.schedule is not None:
+            if self.spawn_event is not None:
+                self.schedule.ticks.cancel (self.spawn_event)
+            self.spawn_event = None
+            self.schedule = None
+        super().kill()
@@ -0,0 +1,138 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2019 Steve Cotton (Octalot)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Planning the rows of grass and road several screens ahead of the camera.
+
+Once a race has started, the only thing that uses the race's random number generator is choosing
+the next row and its seed, and everything else about a row comes from its own generator with that
+seed. So the rows can be chosen as far ahead as we like without changing the race, and the work of
+making a row (its speed, the cars that are already on it, loading its images) can be done before
+it's needed: either on a worker thread, or a row at a time on the ticks that don't add a row. When
+the screen scrolls far enough for a new row, the simulation just takes the next RowPlan from the
+queue.
+"""
+
+try:
+    import sys
+    import random
+    from collections import deque
+    from concurrent.futures import Future, ThreadPoolExecutor
+    import pygame
+    from pygame.locals import *
+    from GameConstants import GameConstants
+    from Hazards import Car, Grass, Road, TiledBackground
+except ImportError as err:
+    print ("couldn't load module. %s" % (err))
+    sys.exit(2)
+
+def prepare_row(kind, rect, seed, spawn_range=None):
+    """Make the RowPlan for a row, and load the images that it needs in to the image caches. This
+    is the part that runs on the worker thread.
+    """
+    if kind == "grass":
+        plan = Grass.plan (rect, seed)
+    else:
+        plan = Road.plan (rect, spawn_range=spawn_range, random_number_generator=random.Random (seed))
+        rotation = Car.rotation (plan.speed)
+        for spawnx, spritefile in plan.cars:
+            Car.image_cache.load_rotated_mask (spritefile, rotation)
+    TiledBackground.image_cache.load_tiled_image (plan.imagefile, rect.width, rect.height)
+    return plan
+
+class LanePipeline:
+    """A queue of the RowPlans for up to lookahead_rows rows, which are planned in the order that
+    rows() generates them. The queue is filled when the pipeline is created, and then topped up by
+    prepare_ahead(). If threaded is true the rows are prepared on a worker thread, which is shared
+    by all of the pipelines.
+
+    The pipeline can be deep-copied, as Replay.snapshot() does; the copy waits for any rows that are
+    still being prepared.
+    """
+
+    # The rows to choose between, repeating an entry makes it more likely to be chosen
+    row_kinds = ("grass", "road", "road")
+
+    # Created when it's first needed, so that nothing starts a thread unless it's used
+    _executor = None
+
+    def __init__(self, random_number_generator, width, next_top, spawn_range=None, lookahead_rows=33, threaded=False):
+        """random_number_generator is the race's own generator, the pipeline takes it over. The first
+        row will be at next_top, and each row after that is just above the previous one.
+        """
+        self.random = random_number_generator
+        self.width = width
+        self.next_top = next_top
+        self.spawn_range = spawn_range
+        self.lookahead_rows = lookahead_rows
+        self.threaded = threaded
+        # Each item is either a RowPlan, or a Future that will be one
+        self._queue = deque()
+        self._rows = self.rows()
+        self._fill()
+
+    def rows(self):
+        """Generates the (kind, rect, seed) of each row, making the same calls to the race's random
+        number generator as choosing each row at the last moment would.
+        """
+        while True:
+            kind = self.random.choice (__class__.row_kinds)
+            seed = self.random.getrandbits (32)
+            rect = Rect (0, self.next_top, self.width, GameConstants.road_width)
+            self.next_top -= GameConstants.road_width
+            yield kind, rect, seed
+
+    def next_row(self):
+        """The RowPlan for the next row, for Grass.create or Road.create"""
+        if not self._queue:
+            self._prepare_one()
+        plan = self._queue.popleft()
+        if isinstance (plan, Future):
+            plan = plan.result()
+        return plan
+
+    def prepare_ahead(self):
+        """Top up the queue, called on ticks that don't need a new row. Without a worker thread,
+        this only prepares one row, to spread the work over several ticks.
+        """
+        if self.threaded:
+            self._fill()
+        elif len (self._queue) < self.lookahead_rows:
+            self._prepare_one()
+
+    def _fill(self):
+        while len (self._queue) < self.lookahead_rows:
+            self._prepare_one()
+
+    def _prepare_one(self):
+        kind, rect, seed = next (self._rows)
+        if self.threaded:
+            if __class__._executor is None:
+                __class__._executor = ThreadPoolExecutor (max_workers=1, thread_name_prefix="LanePipeline")
+            self._queue.append (__class__._executor.submit (prepare_row, kind, rect, seed, self.spawn_range))
+        else:
+            self._queue.append (prepare_row (kind, rect, seed, self.spawn_range))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Neither the generator nor the Futures can be copied
+        del state["_rows"]
+        state["_queue"] = deque (plan.result() if isinstance (plan, Future) else plan for plan in self._queue)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update (state)
+        self._rows = self.rows()
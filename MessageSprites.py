@@ -18,6 +18,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 try:
+    from collections import OrderedDict
     from enum import IntEnum
     import gettext
     import pygame
@@ -26,8 +27,66 @@ except ImportError as err:
     print ("couldn't load module. %s" % (err))
     sys.exit(2)
 
+class TextCache:
+    """Fonts and rendered text, shared by all of the message sprites.
+
+    pygame.font.SysFont looks up the system's fonts each time it's called, so each size of font is
+    only created once. Rendered lines of text are kept in a least-recently-used cache of up to
+    max_entries Surfaces, along with the finished images of whole messages. Each line is rendered
+    whole, including any numbers in it, so that it keeps the font's kerning.
+
+    The Surfaces are shared, callers must treat them as read-only.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._fonts = {}
+        self._rendered = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def font(self, size):
+        font = self._fonts.get (size)
+        if font is None:
+            font = self._fonts[size] = pygame.font.SysFont (None, size)
+        return font
+
+    def cached(self, key, create):
+        """The Surface stored for key, or the result of calling create() which is then stored"""
+        surface = self._rendered.get (key)
+        if surface is not None:
+            self._rendered.move_to_end (key)
+            self.hits += 1
+            return surface
+        self.misses += 1
+        surface = create()
+        self._rendered[key] = surface
+        if len (self._rendered) > self.max_entries:
+            self._rendered.popitem (last=False)
+            self.evictions += 1
+        return surface
+
+    def render(self, text, size, color):
+        """The same as font(size).render (text, True, color)"""
+        color = tuple (color)
+        return self.cached (("text", text, size, color), lambda: self.font (size).render (text, True, color))
+
+    def stats(self):
+        """The same kind of counts as Hazards.SpritePool.stats()"""
+        return {
+            "fonts": len (self._fonts),
+            "entries": len (self._rendered),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
 class MultiLineMessageSprite(pygame.sprite.Sprite):
     """General support for showing text on screen"""
+
+    text_cache = TextCache()
+
     def __init__(self, messages, fontsize=None, firstLineSize=None, fontColor=None):
         """messages should be an array of strings, each string will become one on-screen line. If
         fontsize is given it will override the default size, if firstLineSize is given then it will
@@ -36,27 +95,30 @@ class MultiLineMessageSprite(pygame.sprite.Sprite):
         pygame.sprite.Sprite.__init__(self)
         if fontsize is None:
             fontsize = 20
-        font = pygame.font.SysFont(None, fontsize)
         if firstLineSize is None:
-            firstFont = font
-        else:
-            firstFont = pygame.font.SysFont(None, firstLineSize)
+            firstLineSize = fontsize
         if fontColor is None:
             fontColor = (255, 255, 255)
-        height = firstFont.get_linesize() + (len(messages) - 1) * font.get_linesize()
-        width = firstFont.size(messages[0])[0]
-        for x in messages:
-            width = max(width, font.size(x)[0])
-        self.image = pygame.Surface ((width, height), flags=SRCALPHA)
+        fontColor = tuple (fontColor)
+        key = ("message", tuple (messages), fontsize, firstLineSize, fontColor)
+        self.image = __class__.text_cache.cached (key, lambda: __class__._render_lines (messages, fontsize, firstLineSize, fontColor))
         self.rect = self.image.get_rect()
-        for x in [0]:
-            renderedText = firstFont.render (messages[x], True, fontColor)
-            self.image.blit(renderedText, (0, 0))
-            nextTop = firstFont.get_linesize()
-        for x in range(1, len(messages)):
-            renderedText = font.render (messages[x], True, fontColor)
-            self.image.blit(renderedText, (0, nextTop))
+
+    def _render_lines(messages, fontsize, firstLineSize, fontColor):
+        text_cache = __class__.text_cache
+        font = text_cache.font (fontsize)
+        firstFont = text_cache.font (firstLineSize)
+        lines = [text_cache.render (messages[0], firstLineSize, fontColor)]
+        lines.extend (text_cache.render (x, fontsize, fontColor) for x in messages[1:])
+        height = firstFont.get_linesize() + (len(messages) - 1) * font.get_linesize()
+        width = max (line.get_width() for line in lines)
+        image = pygame.Surface ((width, height), flags=SRCALPHA)
+        image.blit (lines[0], (0, 0))
+        nextTop = firstFont.get_linesize()
+        for renderedText in lines[1:]:
+            image.blit (renderedText, (0, nextTop))
             nextTop += font.get_linesize()
+        return image
 
 class MessageSprite(MultiLineMessageSprite):
     """A single line of text"""
@@ -94,16 +156,20 @@ class EachJoiningPlayerMessage(pygame.sprite.Sprite):
             fontsize = 50
         else:
             fontsize = 20
-        font = pygame.font.SysFont(None, fontsize)
-        renderedText = font.render (message, True, frog.get_color())
-        with_border = renderedText.get_rect().inflate (10, 10)
-        self.image = pygame.Surface (with_border.size, flags=SRCALPHA)
-        self.image.fill ((0, 0, 0, 0x20))
-        self.image.blit (renderedText, (5, 5))
+        color = tuple (frog.get_color())
+        self.image = MultiLineMessageSprite.text_cache.cached (("joining", message, fontsize, color), lambda: __class__._render_name (message, fontsize, color))
         self.rect = self.image.get_rect()
         self.rect.centerx = frog.rect.centerx
         self.rect.top = frog.rect.centery
 
+    def _render_name(message, fontsize, color):
+        renderedText = MultiLineMessageSprite.text_cache.render (message, fontsize, color)
+        with_border = renderedText.get_rect().inflate (10, 10)
+        image = pygame.Surface (with_border.size, flags=SRCALPHA)
+        image.fill ((0, 0, 0, 0x20))
+        image.blit (renderedText, (5, 5))
+        return image
+
 class VictoryMessage(MessageSprite):
     """Shown as the game_over_sprite if someone won a multiplayer game"""
     def __init__(self, victor):
@@ -0,0 +1,715 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2019 Steve Cotton (Octalot)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Playing races over a LAN, with one authoritative server and thin clients.
+
+The server runs the only RaceSimulation, at 60 ticks per second. Clients send it their key presses
+and releases, and after each tick the server sends every client the same compact binary delta: the
+new scenery rows, the cars that spawned (with their lane's speed), the frogs that joined, moved or
+died, and the camera. The clients don't run the game logic, they keep a RaceMirror of the sprites
+that's updated from the deltas; a car's speed is all that's needed to move it on the following
+ticks, so cars are only sent once. A client that's just connected, or that fell behind, gets a
+keyframe of the whole state instead.
+
+    ./Network.py server --ai 2
+    ./Network.py client 192.168.1.10
+
+Each message is framed by its length as a 4-byte little-endian integer, and starts with a byte
+that says which kind of message it is. The server also pings each client every ping_interval ticks
+and keeps statistics of the round-trip times, which it prints every few seconds.
+"""
+
+try:
+    import os
+    import sys
+    import argparse
+    import asyncio
+    import contextlib
+    import gettext
+    import io
+    import statistics
+    import struct
+    import time
+    from collections import deque
+    import pygame
+    from pygame.locals import *
+    from GameConstants import GameConstants
+    from Hazards import Car, Grass, Road, TiledBackground
+    from Frogs import Frog
+    from MessageSprites import *
+    from Utils import TeamColorPainter
+    from Simulation import RaceSimulation
+    from Replay import ReplayWriter
+except ImportError as err:
+    print ("couldn't load module. %s" % (err))
+    sys.exit(2)
+
+gettext.install ('DartingFrogs', 'data/locale')
+
+default_port = 5119
+
+# Kinds of message, client to server
+_hello = 1
+_input = 2
+_pong = 3
+# Kinds of message, server to client
+_welcome = 10
+_tick = 11
+_keyframe = 12
+_ping = 13
+
+_frame = struct.Struct ("<I")
+_kind = struct.Struct ("<B")
+_hello_message = struct.Struct ("<BB")
+_input_message = struct.Struct ("<BBI")
+_ping_message = struct.Struct ("<BI")
+_welcome_message = struct.Struct ("<BHHH")
+# kind, tick, camera top, flags, and which of the sections follow
+_tick_header = struct.Struct ("<BIiBB")
+_count = struct.Struct ("<H")
+# top, grass or road, index in to the background_images, speed
+_row = struct.Struct ("<iBBb")
+# left, top, speed, index in to car_images
+_car = struct.Struct ("<iibB")
+# id, left, top, color, length of the name
+_join = struct.Struct ("<HiiBBBB")
+# id, how far it moved up or down since the last tick
+_move = struct.Struct ("<Hb")
+_death = struct.Struct ("<H")
+_winner = struct.Struct ("<H")
+
+# Bits of the tick flags
+_players_can_join = 1
+_game_over = 2
+# Bits of the sections
+_rows_section = 1
+_cars_section = 2
+_joins_section = 4
+_moves_section = 8
+_deaths_section = 16
+
+_no_winner = 0xffff
+
+# Every image that a car can have, so that a car's image can be sent as an index
+car_images = sorted (set (Car.fast_car_sprites + Car.car_sprites + Car.slow_car_sprites))
+_row_kinds = (Grass, Road)
+
+def _frame_message(payload):
+    return _frame.pack (len (payload)) + payload
+
+async def _read_message(reader):
+    """The payload of the next message from the stream"""
+    length, = _frame.unpack (await reader.readexactly (_frame.size))
+    return await reader.readexactly (length)
+
+class DeltaEncoder:
+    """Turns the changes made by each of a RaceSimulation's ticks in to a tick message.
+
+    The encoder remembers what it has already sent: the scenery rows, how many of each road's
+    spawn_log it has sent, and where it last said each frog was. Every client gets the same tick
+    messages, so this is shared by all of them. A keyframe describes the whole state without
+    changing what the encoder remembers.
+    """
+
+    def __init__(self, simulation):
+        self.simulation = simulation
+        self.frog_ids = {}
+        self._sent_rows = set()
+        # For each road, its spawn_log and how much of it has been sent
+        self._sent_spawns = {}
+        self._frog_tops = {}
+        # Everything that's already in the simulation is sent in keyframes, not as changes
+        self.encode_tick()
+
+    def frog_id(self, frog):
+        frog_id = self.frog_ids.get (frog)
+        if frog_id is None:
+            frog_id = self.frog_ids[frog] = len (self.frog_ids)
+        return frog_id
+
+    def _flags(self):
+        simulation = self.simulation
+        flags = 0
+        if simulation.new_players_can_join.alive():
+            flags |= _players_can_join
+        if simulation.game_over_sprite is not None:
+            flags |= _game_over
+        return flags
+
+    def _winner(self):
+        """The id of the only frog left alive, if the race was won, for the VictoryMessage"""
+        simulation = self.simulation
+        if len (simulation.frog_sprites) == 1 and len (simulation.players) > 1:
+            return self.frog_id (next (iter (simulation.frog_sprites)))
+        return _no_winner
+
+    def _encode_row(row):
+        kind = _row_kinds.index (type (row))
+        speed = row.speed if kind else 0
+        return _row.pack (row.rect.top, kind, type (row).background_images.index (row.imagefile), speed)
+
+    def _encode_car(left, top, speed, spritefile):
+        return _car.pack (left, top, speed, car_images.index (spritefile))
+
+    def _encode_join(self, frog):
+        color = frog.get_color()
+        name = frog.get_name().encode ("utf-8")[:255]
+        return _join.pack (self.frog_id (frog), frog.rect.left, frog.rect.top, color[0], color[1], color[2], len (name)) + name
+
+    def _message(self, kind, sections):
+        """The tick header followed by each of the non-empty (bit, encoded entries) sections"""
+        simulation = self.simulation
+        flags = self._flags()
+        present = 0
+        body = []
+        for bit, entries in sections:
+            if entries:
+                present |= bit
+                body.append (_count.pack (len (entries)))
+                body.extend (entries)
+        if flags & _game_over:
+            body.append (_winner.pack (self._winner()))
+        return _tick_header.pack (kind, simulation.ticks, simulation.camera.top, flags, present) + b"".join (body)
+
+    def encode_tick(self):
+        """The tick message for the tick that the simulation has just run"""
+        simulation = self.simulation
+        rows = []
+        for row in simulation.scenery_sprites:
+            if row not in self._sent_rows:
+                rows.append (__class__._encode_row (row))
+        # Rows are reused from a SpritePool, so they have to be forgotten when they're killed
+        self._sent_rows = set (simulation.scenery_sprites)
+
+        # Every car that spawned on this tick, at its position after spawning
+        cars = []
+        sent_spawns = {}
+        for road in simulation.road_sprites:
+            spawn_log, sent = self._sent_spawns.get (road, (None, 0))
+            if spawn_log is not road.spawn_log:
+                sent = 0
+            for lane_offset, mask, spritefile in road.spawn_log[sent:]:
+                image = Car.image_cache.load_rotated_image (spritefile, Car.rotation (road.speed))
+                cars.append (__class__._encode_car (lane_offset + road.speed * road.age, road.rect.centery - image.get_height() // 2, road.speed, spritefile))
+            sent_spawns[road] = (road.spawn_log, len (road.spawn_log))
+        self._sent_spawns = sent_spawns
+
+        joins = []
+        moves = []
+        for frog in simulation.frog_sprites:
+            top = self._frog_tops.get (frog)
+            if top is None:
+                joins.append (self._encode_join (frog))
+            else:
+                frog_id = self.frog_id (frog)
+                dy = frog.rect.top - top
+                while dy:
+                    step = max (-128, min (127, dy))
+                    moves.append (_move.pack (frog_id, step))
+                    dy -= step
+            self._frog_tops[frog] = frog.rect.top
+        deaths = []
+        for frog in [frog for frog in self._frog_tops if not frog.alive()]:
+            deaths.append (_death.pack (self.frog_id (frog)))
+            del self._frog_tops[frog]
+
+        return self._message (_tick, ((_rows_section, rows), (_cars_section, cars), (_joins_section, joins), (_moves_section, moves), (_deaths_section, deaths)))
+
+    def encode_keyframe(self):
+        """A message describing everything that's in the race now"""
+        simulation = self.simulation
+        rows = [__class__._encode_row (row) for row in simulation.scenery_sprites]
+        cars = [__class__._encode_car (car.rect.left, car.rect.top, car.speed, car.spritefile) for car in simulation.hazard_sprites]
+        joins = [self._encode_join (frog) for frog in simulation.frog_sprites]
+        return self._message (_keyframe, ((_rows_section, rows), (_cars_section, cars), (_joins_section, joins)))
+
+class MirrorSprite(pygame.sprite.Sprite):
+    """A sprite in a RaceMirror, it only has an image and a position"""
+    def __init__(self, image, topleft):
+        pygame.sprite.Sprite.__init__(self)
+        self.image = image
+        self.rect = image.get_rect (topleft=topleft)
+
+class MirrorCar(MirrorSprite):
+    """Moves like a Car, and is killed at the same point"""
+    def __init__(self, image, topleft, speed, kill_point):
+        MirrorSprite.__init__(self, image, topleft)
+        self.speed = speed
+        self.kill_point = kill_point
+
+    def update(self, ticks=1):
+        self.rect.move_ip (self.speed * ticks, 0)
+        if self.kill_point > 0 and self.rect.left > self.kill_point:
+            self.kill()
+        elif self.kill_point < 0 and self.rect.right < self.kill_point:
+            self.kill()
+
+class MirrorFrog(MirrorSprite):
+    """Has the name and color that EachJoiningPlayerMessage and VictoryMessage need"""
+    def __init__(self, name, team_color, topleft):
+        MirrorSprite.__init__(self, TeamColorPainter.load_image (Frog.sprites_files[0], team_color), topleft)
+        self.name = name
+        self.team_color = team_color
+
+    def get_name(self):
+        return self.name
+
+    def get_color(self):
+        return self.team_color
+
+class RaceMirror:
+    """A client's copy of the server's race, built from the tick and keyframe messages.
+
+    It has the same sprite groups and camera as a RaceSimulation, so the LayeredRenderer can draw
+    it, but it doesn't run any of the game logic itself.
+    """
+
+    def __init__(self, camera_area):
+        self.camera_area = camera_area
+        self.camera = camera_area.copy()
+        self.traffic = None
+        self.scenery_sprites = pygame.sprite.Group()
+        self.hazard_sprites = pygame.sprite.Group()
+        self.frog_sprites = pygame.sprite.Group()
+        self.crowd_sprites = pygame.sprite.Group()
+        self.message_sprites = pygame.sprite.Group()
+        self.frogs = {}
+        self.ticks = 0
+        self.players_can_join = None
+        self.game_over_sprite = None
+        self.start_top = camera_area.top
+
+    def _clear(self):
+        for group in (self.scenery_sprites, self.hazard_sprites, self.frog_sprites, self.message_sprites):
+            for sprite in group.sprites():
+                sprite.kill()
+        self.frogs = {}
+        self.players_can_join = None
+        self.game_over_sprite = None
+
+    def apply(self, payload):
+        """Update the mirror from a tick or keyframe message"""
+        kind, tick, camera_top, flags, present = _tick_header.unpack_from (payload)
+        position = _tick_header.size
+        if kind == _keyframe:
+            self._clear()
+            if tick == 0:
+                self.start_top = camera_top
+        else:
+            self.hazard_sprites.update (tick - self.ticks)
+        self.ticks = tick
+        self.camera.top = camera_top
+
+        def entries(bit, entry):
+            nonlocal position
+            if not present & bit:
+                return
+            count, = _count.unpack_from (payload, position)
+            position += _count.size
+            for i in range (count):
+                values = entry.unpack_from (payload, position)
+                position += entry.size
+                yield values
+
+        for top, kind, image_index, speed in entries (_rows_section, _row):
+            imagefile = _row_kinds[kind].background_images[image_index]
+            row = MirrorSprite (TiledBackground.image_cache.load_tiled_image (imagefile, self.camera_area.width, GameConstants.road_width), (0, top))
+            row.speed = speed
+            self.scenery_sprites.add (row)
+        for left, top, speed, image_index in entries (_cars_section, _car):
+            image = Car.image_cache.load_rotated_image (car_images[image_index], Car.rotation (speed))
+            kill_point = self.camera_area.width + 100 if speed > 0 else -100
+            self.hazard_sprites.add (MirrorCar (image, (left, top), speed, kill_point))
+        for frog_id, left, top, red, green, blue, name_length in entries (_joins_section, _join):
+            name = payload[position:position + name_length].decode ("utf-8", "replace")
+            position += name_length
+            frog = MirrorFrog (name, pygame.Color (red, green, blue, 255), (left, top))
+            self.frogs[frog_id] = frog
+            self.frog_sprites.add (frog)
+            if kind == _tick:
+                self.message_sprites.add (EachJoiningPlayerMessage (frog))
+        for frog_id, dy in entries (_moves_section, _move):
+            frog = self.frogs.get (frog_id)
+            if frog is not None:
+                frog.rect.move_ip (0, dy)
+        for frog_id, in entries (_deaths_section, _death):
+            frog = self.frogs.pop (frog_id, None)
+            if frog is not None:
+                frog.kill()
+
+        self._update_messages (flags)
+        if flags & _game_over and self.game_over_sprite is None:
+            winner, = _winner.unpack_from (payload, position)
+            if winner in self.frogs:
+                self.game_over_sprite = VictoryMessage (self.frogs[winner])
+            else:
+                self.game_over_sprite = MessageSprite (_("GAME OVER (distance %d)") % (self.start_top - camera_top))
+            self.game_over_sprite.rect.midtop = self.camera.midtop
+            self.message_sprites.add (self.game_over_sprite)
+        self._remove_offscreen()
+
+    def _update_messages(self, flags):
+        if flags & _players_can_join:
+            if self.players_can_join is None:
+                self.players_can_join = PlayersCanJoinMessage()
+                self.players_can_join.rect.midtop = self.camera.midtop
+                self.message_sprites.add (self.players_can_join)
+        elif self.players_can_join is not None:
+            self.players_can_join.kill()
+            self.players_can_join = None
+
+    def _remove_offscreen(self):
+        for group in (self.scenery_sprites, self.hazard_sprites, self.message_sprites):
+            for sprite in [sprite for sprite in group if sprite.rect.top > self.camera.bottom]:
+                sprite.kill()
+
+    def prepare_for_drawing(self):
+        pass
+
+class LatencyStats:
+    """Round-trip times to one client, in seconds, over the last max_samples pings"""
+
+    def __init__(self, max_samples=600):
+        self.samples = deque (maxlen=max_samples)
+
+    def add(self, seconds):
+        self.samples.append (seconds)
+
+    def summary(self):
+        """The count, min, median, 95th percentile and max, in milliseconds"""
+        if not self.samples:
+            return {"count": 0}
+        samples = sorted (self.samples)
+        return {
+            "count": len (samples),
+            "min": 1000 * samples[0],
+            "median": 1000 * statistics.median (samples),
+            "p95": 1000 * samples[min (len (samples) - 1, int (0.95 * len (samples)))],
+            "max": 1000 * samples[-1],
+        }
+
+class ClientConnection:
+    """The server's side of one client"""
+
+    def __init__(self, client_id, name, writer):
+        self.client_id = client_id
+        self.name = name
+        self.writer = writer
+        self.latency = LatencyStats()
+        # The time that each unanswered ping was sent, by ping id
+        self.pings = {}
+        # The keys that are held down, so they can be released if the client disconnects
+        self.held = set()
+        self.bytes_sent = 0
+        self.keyframes = 0
+        self.connected = time.perf_counter()
+        # Set when the client's send buffer is full, it gets a keyframe once it drains
+        self.lagging = False
+
+    def send(self, message):
+        self.writer.write (message)
+        self.bytes_sent += len (message)
+
+    def describe(self):
+        stats = self.latency.summary()
+        rate = self.bytes_sent / max (time.perf_counter() - self.connected, 1e-9) / 1024
+        if not stats["count"]:
+            return "%s: %.1f kB/s, no pings answered yet" % (self.name, rate)
+        return "%s: %.1f kB/s, %d keyframes, rtt min %.1f median %.1f p95 %.1f max %.1f ms" % (self.name, rate, self.keyframes, stats["min"], stats["median"], stats["p95"], stats["max"])
+
+class RaceServer:
+    """Runs races one after another, and sends them to every connected client.
+
+    A client's keys become JOYBUTTONDOWN and JOYBUTTONUP events for a joystick that no real
+    joystick will have, joystick number joystick_base + the client's id, with a button number for
+    each of the client's keys. The frogs are then named after the client and the key.
+    """
+
+    ticks_per_second = 60
+    # If the server can't keep up, the race slows down rather than running this many ticks at once
+    max_catch_up_ticks = 5
+    joystick_base = 1000
+    ping_interval = 30
+    # A client with more than this many bytes waiting to be sent stops getting tick messages,
+    # which bounds the memory and bandwidth spent on a slow client
+    send_buffer_limit = 256 * 1024
+
+    def __init__(self, camera_area, seed=None, ai_frogs=0, record=None, stats_interval=10):
+        self.camera_area = camera_area
+        self.seed = seed
+        self.ai_frogs = ai_frogs
+        self.record = record
+        self.stats_interval = stats_interval
+        self.clients = {}
+        self._next_client_id = 0
+        self._inputs = []
+        # For each (client id, key), its joystick button, and the frog's name
+        self._buttons = {}
+        self._button_names = {}
+        self._ping_id = 0
+        self.races = 0
+        self._new_race()
+
+    def _new_race(self):
+        if self.seed is not None:
+            seed = self.seed + self.races
+        else:
+            seed = None
+        # Each frog prints a line when it's created
+        with contextlib.redirect_stdout (io.StringIO()):
+            self.simulation = RaceSimulation (self.camera_area, seed=seed, ai_frogs=self.ai_frogs)
+        self.encoder = DeltaEncoder (self.simulation)
+        self.races += 1
+        self.replay = None
+        if self.record:
+            path = os.path.join (self.record, "race-%s-%d.replay" % (time.strftime ("%Y%m%d-%H%M%S"), self.races))
+            self.replay = ReplayWriter (path, self.simulation)
+        for client in self.clients.values():
+            self._send_keyframe (client)
+
+    def _send_keyframe(self, client):
+        client.lagging = False
+        client.keyframes += 1
+        client.send (_frame_message (self.encoder.encode_keyframe()))
+
+    def _button(self, client, key):
+        """The joystick event attributes for one of a client's keys"""
+        button = self._buttons.get ((client.client_id, key))
+        if button is None:
+            button = self._buttons[(client.client_id, key)] = len ([used for used in self._buttons if used[0] == client.client_id])
+            self._button_names[(__class__.joystick_base + client.client_id, button)] = "%s %s" % (client.name, pygame.key.name (key)) if client.name else pygame.key.name (key)
+        return __class__.joystick_base + client.client_id, button
+
+    def _press(self, client, key, down):
+        joy, button = self._button (client, key)
+        if down:
+            client.held.add (key)
+        else:
+            client.held.discard (key)
+        self._inputs.append (pygame.event.Event (JOYBUTTONDOWN if down else JOYBUTTONUP, joy=joy, button=button))
+
+    def step(self):
+        """Run one tick, and send it to the clients"""
+        simulation = self.simulation
+        inputs, self._inputs = self._inputs, []
+        with contextlib.redirect_stdout (io.StringIO()):
+            simulation.step (inputs)
+        if self.replay is not None:
+            self.replay.record (inputs)
+        # Name the new frogs after the clients, before they're sent
+        for frog in simulation.players:
+            if frog not in self.encoder.frog_ids and frog.dispatch_key is not None and frog.dispatch_key[0] == JOYBUTTONDOWN:
+                frog.name = self._button_names.get (frog.dispatch_key[1:], frog.name)
+        message = _frame_message (self.encoder.encode_tick())
+
+        ping = None
+        if simulation.ticks % __class__.ping_interval == 0:
+            self._ping_id += 1
+            ping = _frame_message (_ping_message.pack (_ping, self._ping_id))
+        now = time.perf_counter()
+        for client in self.clients.values():
+            buffered = client.writer.transport.get_write_buffer_size()
+            if client.lagging:
+                if buffered < __class__.send_buffer_limit // 4:
+                    self._send_keyframe (client)
+                continue
+            if buffered > __class__.send_buffer_limit:
+                client.lagging = True
+                continue
+            client.send (message)
+            if ping is not None:
+                client.pings[self._ping_id] = now
+                client.send (ping)
+                # Pings that were never answered are forgotten
+                for ping_id in [ping_id for ping_id in client.pings if ping_id < self._ping_id - 100]:
+                    del client.pings[ping_id]
+
+        if simulation.finished:
+            if self.replay is not None:
+                self.replay.close()
+            self._new_race()
+
+    async def handle_client(self, reader, writer):
+        """Talk to one client, until it disconnects"""
+        try:
+            payload = await _read_message (reader)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        kind, name_length = _hello_message.unpack_from (payload)
+        if kind != _hello:
+            writer.close()
+            return
+        name = payload[_hello_message.size:_hello_message.size + name_length].decode ("utf-8", "replace")
+        client_id = self._next_client_id
+        self._next_client_id += 1
+        client = ClientConnection (client_id, name or "client %d" % client_id, writer)
+        self.clients[client_id] = client
+        client.send (_frame_message (_welcome_message.pack (_welcome, client_id, self.camera_area.width, self.camera_area.height)))
+        self._send_keyframe (client)
+        try:
+            while True:
+                payload = await _read_message (reader)
+                kind, = _kind.unpack_from (payload)
+                if kind == _input:
+                    kind, down, key = _input_message.unpack (payload)
+                    self._press (client, key, down)
+                elif kind == _pong:
+                    kind, ping_id = _ping_message.unpack (payload)
+                    sent = client.pings.pop (ping_id, None)
+                    if sent is not None:
+                        client.latency.add (time.perf_counter() - sent)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            # Otherwise the client's frogs would keep jumping
+            for key in list (client.held):
+                self._press (client, key, False)
+            del self.clients[client_id]
+            print (client.describe(), "(disconnected)")
+            writer.close()
+
+    async def run_ticks(self, until=None):
+        """Step the simulation at ticks_per_second, forever or until the until future is done"""
+        loop = asyncio.get_running_loop()
+        tick_seconds = 1 / __class__.ticks_per_second
+        next_tick = loop.time()
+        next_stats = loop.time() + self.stats_interval
+        while until is None or not until.done():
+            ticks = 0
+            while loop.time() >= next_tick and ticks < __class__.max_catch_up_ticks:
+                self.step()
+                next_tick += tick_seconds
+                ticks += 1
+            if loop.time() >= next_tick:
+                # Slow down instead of trying to catch up
+                next_tick = loop.time()
+            if self.stats_interval and loop.time() >= next_stats:
+                next_stats += self.stats_interval
+                self.print_stats()
+            await asyncio.sleep (max (0, next_tick - loop.time()))
+
+    def print_stats(self):
+        print ("Race %d, tick %d, %d clients" % (self.races, self.simulation.ticks, len (self.clients)))
+        for client in self.clients.values():
+            print ("  " + client.describe())
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server (self.handle_client, host, port)
+        print ("Serving on %s" % ", ".join (str (sock.getsockname()) for sock in server.sockets))
+        async with server:
+            await self.run_ticks()
+
+class RaceClient:
+    """A connection to a RaceServer, keeping a RaceMirror of the race"""
+
+    def __init__(self, name=""):
+        self.name = name
+        self.mirror = None
+        self.client_id = None
+        self.messages = 0
+        self.bytes_received = 0
+        self._writer = None
+
+    async def connect(self, host, port=default_port):
+        reader, self._writer = await asyncio.open_connection (host, port)
+        name = self.name.encode ("utf-8")[:255]
+        self._writer.write (_frame_message (_hello_message.pack (_hello, len (name)) + name))
+        payload = await _read_message (reader)
+        kind, self.client_id, width, height = _welcome_message.unpack (payload)
+        self.mirror = RaceMirror (pygame.Rect (0, 0, width, height))
+        return reader
+
+    async def receive(self, reader):
+        """Apply the server's messages to the mirror, until the server disconnects"""
+        try:
+            while True:
+                payload = await _read_message (reader)
+                self.messages += 1
+                self.bytes_received += _frame.size + len (payload)
+                kind, = _kind.unpack_from (payload)
+                if kind == _ping:
+                    # Echoed straight back, so that the server measures the round trip
+                    self._writer.write (_frame_message (_ping_message.pack (_pong, _ping_message.unpack (payload)[1])))
+                elif kind in (_tick, _keyframe):
+                    self.mirror.apply (payload)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+    def press(self, key, down=True):
+        """Send a key press or release"""
+        self._writer.write (_frame_message (_input_message.pack (_input, 1 if down else 0, key)))
+
+    def close(self):
+        self._writer.close()
+
+async def _play(host, port, name):
+    """The client's window, with the race drawn from the mirror"""
+    from Rendering import LayeredRenderer
+    client = RaceClient (name)
+    reader = await client.connect (host, port)
+    screen = pygame.display.set_mode (client.mirror.camera_area.size)
+    pygame.display.set_caption (_("Darting Frogs"))
+    pygame.event.set_blocked (None)
+    pygame.event.set_allowed ([QUIT, KEYDOWN, KEYUP])
+    renderer = LayeredRenderer (screen, (0x40, 0x80, 0x40))
+    receiving = asyncio.ensure_future (client.receive (reader))
+    while not receiving.done():
+        for event in pygame.event.get():
+            if event.type == QUIT or (event.type == KEYDOWN and event.key == K_ESCAPE):
+                client.close()
+                return
+            if event.type in (KEYDOWN, KEYUP):
+                client.press (event.key, event.type == KEYDOWN)
+        renderer.render (client.mirror)
+        # The display only needs to keep up with the server's ticks
+        await asyncio.sleep (1 / RaceServer.ticks_per_second)
+    print ("The server closed the connection")
+
+def main():
+    parser = argparse.ArgumentParser (description="Play Darting Frogs over a network")
+    subparsers = parser.add_subparsers (dest="command", required=True)
+    server_parser = subparsers.add_parser ("server", help="run the race, for clients to connect to")
+    server_parser.add_argument ("--host", default="0.0.0.0", help="the address to listen on")
+    server_parser.add_argument ("--port", type=int, default=default_port)
+    server_parser.add_argument ("--ai", type=int, default=0, metavar="COUNT", help="add COUNT AI frogs to each race")
+    server_parser.add_argument ("--seed", type=int, help="seed the first race, later races use the following seeds")
+    server_parser.add_argument ("--record", metavar="DIRECTORY", help="save a replay of each race in DIRECTORY")
+    server_parser.add_argument ("--stats-interval", type=float, default=10, metavar="SECONDS", help="how often to print each client's bandwidth and latency, 0 for never")
+    client_parser = subparsers.add_parser ("client", help="connect to a server")
+    client_parser.add_argument ("host")
+    client_parser.add_argument ("--port", type=int, default=default_port)
+    client_parser.add_argument ("--name", default="", help="shown before the key name of each of your frogs")
+    args = parser.parse_args()
+
+    if args.command == "server":
+        # The server doesn't draw anything
+        os.environ["SDL_VIDEODRIVER"] = "dummy"
+        pygame.init()
+        if args.record:
+            os.makedirs (args.record, exist_ok=True)
+        server = RaceServer (pygame.Rect (0, 0, 1024, 700), seed=args.seed, ai_frogs=args.ai, record=args.record, stats_interval=args.stats_interval)
+        try:
+            asyncio.run (server.serve (args.host, args.port))
+        except KeyboardInterrupt:
+            server.print_stats()
+    else:
+        pygame.init()
+        asyncio.run (_play (args.host, args.port, args.name))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,336 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2019 Steve Cotton (Octalot)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""An AI that looks at the traffic before jumping.
+
+A frog only moves vertically, so the only question for an AI frog is when to jump. Every car on a
+road moves at the road's speed, so from the moment a car spawns it's known exactly which ticks it
+will be over any given x-range. For each road and each column that a frog is in, a LaneForecast
+holds the ticks when that column is blocked. The forecasts are shared by all of the AI frogs in
+the same column, and they're updated incrementally from the road's spawn_log as cars spawn, rather
+than being recomputed for each frog.
+"""
+
+try:
+    import sys
+    from bisect import bisect_left, bisect_right
+    from GameConstants import GameConstants
+    from Collisions import car_overhang, largest_car_size, mask_shape
+except ImportError as err:
+    print ("couldn't load module. %s" % (err))
+    sys.exit(2)
+
+def blocked_ages(left, right, low, high, speed):
+    """The first and last ages (inclusive) at which a car is over the columns [left, right), for a
+    car whose opaque columns are [low, high) in the road's moving frame. A car is over the column at
+    any age where low + speed * age < right and high + speed * age > left. If it never is, the
+    first is after the last.
+    """
+    if speed > 0:
+        return (left - high) // speed + 1, -((low - right) // speed) - 1
+    else:
+        return (low - right) // -speed + 1, -((left - high) // -speed) - 1
+
+class LaneForecast:
+    """The ticks when a column of a road is blocked by traffic.
+
+    The column is the x-range [left, right) in world coordinates. Times are the road's age, as in
+    Road.lane_offsets. The blocked ages are held as sorted, non-overlapping, inclusive windows; a
+    window is added for each car in the road's spawn_log, and windows that are in the past are
+    dropped.
+    """
+
+    def __init__(self, road, left, right):
+        self.road = road
+        self.left = left
+        self.right = right
+        # The road's spawn_log that this was built from, and how many of its cars have been added
+        self.spawn_log = road.spawn_log
+        self.cars_added = 0
+        self.starts = []
+        self.ends = []
+
+    def pending(self):
+        """The number of cars that have spawned on the road but aren't in the forecast yet"""
+        return len (self.road.spawn_log) - self.cars_added
+
+    def catch_up(self, limit):
+        """Add up to limit of the pending cars to the forecast, returns how many were added"""
+        road = self.road
+        if road.spawn_log is not self.spawn_log:
+            # The road has been reused from the pool, it's a different road now
+            self.spawn_log = road.spawn_log
+            self.cars_added = 0
+            self.starts = []
+            self.ends = []
+        added = 0
+        while added < limit and self.cars_added < len (self.spawn_log):
+            lane_offset, mask, spritefile = self.spawn_log[self.cars_added]
+            self._add_car (lane_offset, mask_shape (mask)[0], road.speed)
+            self.cars_added += 1
+            added += 1
+        return added
+
+    def _add_car(self, lane_offset, bounds, speed):
+        first, last = blocked_ages (self.left, self.right, lane_offset + bounds.left, lane_offset + bounds.right, speed)
+        if first > last:
+            return
+        # Insert the window, merging it with any windows that it overlaps or touches
+        index = bisect_left (self.ends, first - 1)
+        while index < len (self.starts) and self.starts[index] <= last + 1:
+            first = min (first, self.starts[index])
+            last = max (last, self.ends[index])
+            del self.starts[index]
+            del self.ends[index]
+        self.starts.insert (index, first)
+        self.ends.insert (index, last)
+
+    def forget_before(self, age):
+        """Drop the windows that end before age"""
+        index = bisect_left (self.ends, age)
+        if index:
+            del self.starts[:index]
+            del self.ends[:index]
+
+    def blocked(self, first_age, last_age=None):
+        """True if a car is over the column at any age from first_age to last_age, inclusive"""
+        if last_age is None:
+            last_age = first_age
+        index = bisect_right (self.starts, last_age) - 1
+        return index >= 0 and self.ends[index] >= first_age
+
+class _OverBudget(Exception):
+    """Raised inside LanePlanner's search when the tick's budget has been used up"""
+    pass
+
+class LanePlanner:
+    """Decides when AiFrogs should jump, using LaneForecasts.
+
+    Call start_tick() once per tick, before the frogs are updated, and each AiFrog that's standing
+    still asks should_jump(). The planner searches for a sequence of waits and jumps that keeps the
+    frog clear of traffic for the next horizon ticks, or until it reaches a row without a road, and
+    the frog jumps now only if that sequence starts with a jump. Rows that haven't been generated
+    yet are assumed to be safe, and each road's next car is included before it spawns (see
+    Road.next_spawn_age). A car after that can still spoil a plan, so if there's no way to survive
+    for the whole horizon, the frog settles for surviving a shorter time.
+
+    The work per tick is bounded, so that the cost doesn't grow without limit with the number of AI
+    frogs or the amount of traffic: at most forecast_budget cars are added to forecasts, and at
+    most search_budget forecast queries are made. Frogs in the same column and row share a
+    decision. A frog that's over the budget gets None from should_jump(), and falls back to the
+    simple AI. Both budgets are counted in units of work rather than measured in seconds, so the
+    decisions are the same on every computer, and races with AI frogs can still be replayed.
+    """
+
+    # Where a frog is relative to its starting top edge on each tick of a jump, the first tick of
+    # the jump is 0. On the tick after the last of these, the frog can jump again.
+    jump_path = [sum (GameConstants.frog_jump_movement[:step + 1]) for step in range (len (GameConstants.frog_jump_movement))]
+
+    def __init__(self, forecast_budget=64, search_budget=4000, horizon=64):
+        self.forecast_budget = forecast_budget
+        self.search_budget = search_budget
+        self.horizon = horizon
+        self.overhang = car_overhang()
+        self.widest_car = largest_car_size()[0]
+        # For each road, its forecasts by (left, right)
+        self._forecasts = {}
+        self._roads = []
+        self._road_tops = []
+        self._tallest_road = 0
+        # This tick's decisions by (left, right, top), and caches of things that are looked up
+        # repeatedly while searching: the _column()s, the _roads_overlapping() and the _jump_roads()
+        self._decisions = {}
+        self._columns = {}
+        self._overlapping = {}
+        self._jumps = {}
+        self._forecast_work = 0
+        self._search_work = 0
+        # Stats, for the benchmarks and for tuning the budgets
+        self.decisions = 0
+        self.over_budget = 0
+
+    def start_tick(self, roads):
+        """Take a snapshot of which roads exist, sorted by their top, and reset the budgets"""
+        self._roads = sorted (roads, key=lambda road: road.rect.top)
+        self._road_tops = [road.rect.top for road in self._roads]
+        self._tallest_road = max ((road.rect.height for road in self._roads), default=0)
+        for road in [road for road in self._forecasts if not road.alive()]:
+            del self._forecasts[road]
+        self._decisions = {}
+        self._columns = {}
+        self._overlapping = {}
+        self._jumps = {}
+        self._forecast_work = self.forecast_budget
+        self._search_work = self.search_budget
+
+    def forecast(self, road, left, right):
+        """The LaneForecast for a column of a road, brought as up to date as the budget allows"""
+        forecasts = self._forecasts.setdefault (road, {})
+        forecast = forecasts.get ((left, right))
+        if forecast is None:
+            forecast = LaneForecast (road, left, right)
+            forecasts[(left, right)] = forecast
+        if self._forecast_work and (forecast.pending() or forecast.spawn_log is not road.spawn_log):
+            self._forecast_work -= forecast.catch_up (self._forecast_work)
+            forecast.forget_before (road.age)
+        return forecast
+
+    def _roads_overlapping(self, top, bottom):
+        """The roads whose cars could touch the rows [top, bottom)"""
+        key = (top, bottom)
+        if key in self._overlapping:
+            return self._overlapping[key]
+        result = []
+        index = bisect_left (self._road_tops, bottom + self.overhang)
+        while index > 0:
+            index -= 1
+            road = self._roads[index]
+            if road.rect.top + self._tallest_road + self.overhang <= top:
+                break
+            if road.rect.bottom + self.overhang > top:
+                result.append (road)
+        self._overlapping[key] = result
+        return result
+
+    def _blocked(self, road, left, right, first_tick, last_tick):
+        """True if a car will be over the column of the road on any tick from first_tick to
+        last_tick, counting ticks from this tick.
+        """
+        if self._search_work <= 0:
+            raise _OverBudget()
+        self._search_work -= 1
+        first_age = road.age + first_tick
+        last_age = road.age + last_tick
+        key = (road, left, right)
+        column = self._columns.get (key)
+        if column is None:
+            column = self._column (road, left, right)
+            self._columns[key] = column
+        forecast, next_first, next_last = column
+        return forecast.blocked (first_age, last_age) or (next_first <= last_age and next_last >= first_age)
+
+    def _column(self, road, left, right):
+        """The forecast for a column of the road, and the first and last ages when the road's next
+        car, which hasn't spawned yet, might be over the column. That car's image isn't chosen
+        until it spawns, so it's assumed to be the widest car.
+        """
+        forecast = self.forecast (road, left, right)
+        spawn_age = road.next_spawn_age()
+        if spawn_age is None:
+            return forecast, 1, 0
+        low = road.spawnx - self.widest_car // 2 - road.speed * spawn_age
+        next_first, next_last = blocked_ages (left, right, low, low + self.widest_car, road.speed)
+        return forecast, next_first, next_last
+
+    def _wait_clear(self, left, right, top, bottom, tick):
+        """True if a frog can sit at top on the given tick"""
+        for road in self._roads_overlapping (top, bottom):
+            if self._blocked (road, left, right, tick, tick):
+                return False
+        return True
+
+    def _jump_roads(self, top, bottom):
+        """The roads that a frog at top would cross when jumping, with the first and last steps of
+        the jump that are over each of them.
+        """
+        key = (top, bottom)
+        if key not in self._jumps:
+            path = __class__.jump_path
+            result = []
+            for road in self._roads_overlapping (top + path[-1], bottom):
+                road_top = road.rect.top - self.overhang
+                road_bottom = road.rect.bottom + self.overhang
+                steps = [step for step, offset in enumerate (path) if top + offset < road_bottom and bottom + offset > road_top]
+                if steps:
+                    result.append ((road, steps[0], steps[-1]))
+            self._jumps[key] = result
+        return self._jumps[key]
+
+    def _jump_clear(self, left, right, top, bottom, tick):
+        """True if a frog at top can make a jump that starts on the given tick"""
+        for road, first_step, last_step in self._jump_roads (top, bottom):
+            if self._blocked (road, left, right, tick + first_step, tick + last_step):
+                return False
+        return True
+
+    def _safe_wait(self, left, right, top, bottom, tick, horizon, failed):
+        """How many ticks a frog that's still at top on the given tick should wait before jumping,
+        so that it survives until the horizon. If it can survive by waiting until the horizon the
+        result is the number of ticks until then, if it can't survive at all it's None. The failed
+        set is the (top, tick) positions that are already known to be hopeless.
+        """
+        if (top, tick) in failed:
+            return None
+        jump_ticks = len (__class__.jump_path)
+        for wait in range (horizon - tick):
+            start = tick + wait
+            if wait and not self._wait_clear (left, right, top, bottom, start - 1):
+                break
+            if self._jump_clear (left, right, top, bottom, start) and self._survives (left, right, top - GameConstants.jump_length, bottom - GameConstants.jump_length, start + jump_ticks, horizon, failed):
+                return wait
+        else:
+            if self._wait_clear (left, right, top, bottom, horizon - 1):
+                return horizon - tick
+        failed.add ((top, tick))
+        return None
+
+    def _survives(self, left, right, top, bottom, tick, horizon, failed):
+        """True if a frog that's still at top on the given tick can survive until the horizon. A
+        frog that's still on a road at the horizon also needs to be clear for a jump's length
+        after it, so that the plan doesn't end just before a car arrives.
+        """
+        roads = self._roads_overlapping (top, bottom)
+        if not roads:
+            return True
+        if tick >= horizon:
+            for road in roads:
+                if self._blocked (road, left, right, tick, tick + len (__class__.jump_path)):
+                    return False
+            return True
+        return self._safe_wait (left, right, top, bottom, tick, horizon, failed) is not None
+
+    def should_jump(self, frog):
+        """True if the frog should start a jump on this tick, False if it should wait, or None if
+        this tick's planning budget has been used up.
+        """
+        bounds = mask_shape (frog.mask)[0]
+        left = frog.rect.left + bounds.left
+        right = frog.rect.left + bounds.right
+        top = frog.rect.top + bounds.top
+        bottom = frog.rect.top + bounds.bottom
+        key = (left, right, top)
+        if key in self._decisions:
+            return self._decisions[key]
+        try:
+            # Cars that haven't spawned yet can ruin a plan, if the frog is now trapped then it
+            # does whatever survives longest
+            horizon = self.horizon
+            wait = None
+            while wait is None and horizon >= len (__class__.jump_path):
+                wait = self._safe_wait (left, right, top, bottom, 0, horizon, set())
+                horizon //= 2
+            if wait is None:
+                # Only jump if staying still gets the frog run over right now
+                decision = not self._wait_clear (left, right, top, bottom, 0)
+            else:
+                decision = wait == 0
+        except _OverBudget:
+            self.over_budget += 1
+            return None
+        self.decisions += 1
+        self._decisions[key] = decision
+        return decision
@@ -0,0 +1,181 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2019 Steve Cotton (Octalot)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Timing each phase of each frame, to find out where the time goes when the game feels janky.
+
+The code being timed calls mark (phase) at the end of each phase, and the time since the previous
+mark is added to that phase. RaceSimulation.step() marks its own phases, multiplayer_race marks the
+waiting, drawing and flipping.
+"""
+
+try:
+    import sys
+    import csv
+    from array import array
+    from time import perf_counter
+    import pygame
+    from pygame.locals import SRCALPHA
+except ImportError as err:
+    print ("couldn't load module. %s" % (err))
+    sys.exit(2)
+
+# The phases of a frame of multiplayer_race, in the order that they happen
+race_phases = [
+    "wait",             # clock.tick(), sleeping to limit the frame rate
+    "input",            # pygame.event.get()
+    "events",           # RaceSimulation.handle_event
+    "scroll",
+    "new_scenery",      # adding rows of grass and roads, and the milestone messages
+    "update_messages",
+    "update_hazards",   # moving the cars
+    "update_scenery",   # moving the roads' frames of reference
+    "scheduled",        # roads spawning cars, and cars reaching the ends of their roads
+    "update_frogs",
+    "offscreen",        # removing sprites that have scrolled off the screen
+    "collisions",
+    "record",           # writing the replay, if --record is used
+    "draw",
+    "flip",             # pygame.display.flip() or update()
+]
+
+class NullFrameTimer:
+    """A FrameTimer that does nothing, used when the game isn't being profiled"""
+    def start_frame(self):
+        pass
+
+    def mark(self, phase):
+        pass
+
+    def end_frame(self):
+        pass
+
+class FrameTimer:
+    """Per-phase timings of each frame.
+
+    The most recent capacity frames are kept in a ring buffer for each phase, which percentiles()
+    and histogram() look at. If keep_history is true then every frame is also kept, so that they can
+    all be exported by write_csv().
+
+    Times are in seconds.
+    """
+
+    def __init__(self, phases=race_phases, capacity=600, keep_history=False):
+        self.phases = list (phases)
+        self._phase_indexes = {phase: index for index, phase in enumerate (self.phases)}
+        self.capacity = capacity
+        self._samples = [array ("d", bytes (8 * capacity)) for phase in self.phases]
+        self._totals = array ("d", bytes (8 * capacity))
+        # The number of frames that have been finished
+        self.frames = 0
+        self.history = [] if keep_history else None
+        self._current = [0.0] * len (self.phases)
+        self._last_mark = None
+
+    def start_frame(self):
+        self._current = [0.0] * len (self.phases)
+        self._last_mark = perf_counter()
+
+    def mark(self, phase):
+        """The time since the last mark (or since start_frame) was spent in phase"""
+        now = perf_counter()
+        self._current[self._phase_indexes[phase]] += now - self._last_mark
+        self._last_mark = now
+
+    def end_frame(self):
+        slot = self.frames % self.capacity
+        current = self._current
+        for samples, seconds in zip (self._samples, current):
+            samples[slot] = seconds
+        self._totals[slot] = sum (current)
+        if self.history is not None:
+            self.history.append (current)
+        self.frames += 1
+
+    def _recent(self, phase):
+        """The samples in the ring buffer for phase (or for the whole frame, if phase is None)"""
+        samples = self._totals if phase is None else self._samples[self._phase_indexes[phase]]
+        return samples[:min (self.frames, self.capacity)]
+
+    def percentiles(self, phase, fractions=(0.5, 0.95, 1.0)):
+        """The given percentiles of the recent frames' times for phase, None means the whole frame.
+        Returns a list with a value for each fraction, all zero if there aren't any frames yet.
+        """
+        samples = sorted (self._recent (phase))
+        if not samples:
+            return [0.0 for fraction in fractions]
+        return [samples[min (len (samples) - 1, int (fraction * len (samples)))] for fraction in fractions]
+
+    def histogram(self, phase, edges=(0.001, 0.002, 0.004, 0.008, 0.016, 0.033)):
+        """Counts of the recent frames' times for phase (None means the whole frame), with a bucket
+        below each of the edges and one more for everything above the last edge.
+        """
+        counts = [0] * (len (edges) + 1)
+        for seconds in self._recent (phase):
+            bucket = 0
+            while bucket < len (edges) and seconds >= edges[bucket]:
+                bucket += 1
+            counts[bucket] += 1
+        return counts
+
+    def write_csv(self, path):
+        """Write every frame's timings, in milliseconds, one row per frame. Needs keep_history."""
+        with open (path, "w", newline="") as output:
+            writer = csv.writer (output)
+            writer.writerow (["frame"] + self.phases + ["total"])
+            for frame, row in enumerate (self.history):
+                writer.writerow ([frame] + ["%.3f" % (1000 * seconds) for seconds in row] + ["%.3f" % (1000 * sum (row))])
+
+class FrameTimeOverlay(pygame.sprite.Sprite):
+    """A sprite showing the median, 95th percentile and worst time of each phase over the frames in
+    the FrameTimer's ring buffer. Rendering the text is slow enough to show up in the timings, so
+    it's only redrawn every refresh_interval frames.
+    """
+
+    refresh_interval = 30
+
+    def __init__(self, frame_timer, fontsize=16):
+        pygame.sprite.Sprite.__init__(self)
+        self.frame_timer = frame_timer
+        self.font = pygame.font.SysFont (None, fontsize)
+        self._frames_at_last_refresh = None
+        self.image = pygame.Surface ((1, 1), flags=SRCALPHA)
+        self.rect = self.image.get_rect()
+
+    def update(self, camera):
+        """Keep the overlay at the camera's top-left corner, redrawing it if it's due"""
+        frames = self.frame_timer.frames
+        if self._frames_at_last_refresh is None or frames - self._frames_at_last_refresh >= __class__.refresh_interval:
+            self._frames_at_last_refresh = frames
+            self._redraw()
+        self.rect.topleft = (camera.left + 4, camera.top + 4)
+
+    def _redraw(self):
+        timer = self.frame_timer
+        lines = ["%-16s %6s %6s %6s" % ("ms", "p50", "p95", "max")]
+        for phase in timer.phases + [None]:
+            p50, p95, worst = timer.percentiles (phase)
+            lines.append ("%-16s %6.2f %6.2f %6.2f" % (phase or "frame", 1000 * p50, 1000 * p95, 1000 * worst))
+        line_height = self.font.get_linesize()
+        # SysFont's default font isn't monospaced, so the columns are rendered separately
+        columns = [line.split() for line in lines]
+        column_x = [0, 110, 160, 210]
+        self.image = pygame.Surface ((260, line_height * len (lines) + 4), flags=SRCALPHA)
+        self.image.fill ((0, 0, 0, 160))
+        for row, words in enumerate (columns):
+            for x, word in zip (column_x, words):
+                self.image.blit (self.font.render (word, True, (255, 255, 255)), (x + 2, row * line_height + 2))
+        self.rect = self.image.get_rect (topleft=self.rect.topleft)
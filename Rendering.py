@@ -0,0 +1,282 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2019 Steve Cotton (Octalot)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Drawing a RaceSimulation on to the screen"""
+
+try:
+    import sys
+    import pygame
+    from pygame.locals import *
+    from GameConstants import GameConstants
+    from Utils import ImageCache
+except ImportError as err:
+    print ("couldn't load module. %s" % (err))
+    sys.exit(2)
+
+def merge_overlapping(rects):
+    """Returns a list of Rects covering the same area as rects, where none of the Rects overlap. Any
+    overlapping rects are replaced by their union.
+
+    Overlapping dirty rects would make sprites with per-pixel alpha be drawn twice in the same
+    place, and look more opaque than they should.
+    """
+    merged = []
+    for rect in rects:
+        rect = rect.copy()
+        index = rect.collidelist (merged)
+        while index >= 0:
+            rect.union_ip (merged.pop (index))
+            index = rect.collidelist (merged)
+        merged.append (rect)
+    return merged
+
+class TerrainStrip:
+    """A ring buffer holding the pre-rendered scenery rows (grass and roads).
+
+    The strip is a Surface a little taller than the camera. Each row is painted in to it once, at
+    its world y coordinate modulo the strip's height, and the visible part of the strip is then
+    copied to the screen with one or two blits, however many rows are on screen.
+
+    The strip must be tall enough that a new row never overwrites one that's still on screen, which
+    means the camera's height, plus a row that's partly scrolled off each end, plus any rows that
+    are created ahead of the camera (lookahead_rows).
+
+    The width and camera_height are in screen pixels, which are scale times the world's coordinates;
+    the rows are painted with their ImageCache.scaled_image().
+    """
+
+    def __init__(self, width, camera_height, background_color, lookahead_rows=2, scale=1):
+        self.scale = scale
+        row_height = round (GameConstants.road_width * scale)
+        rows = -(-camera_height // row_height) + 2 + lookahead_rows
+        self.surface = pygame.Surface ((width, rows * row_height))
+        if pygame.display.get_surface() is not None:
+            self.surface = self.surface.convert()
+        self.surface.fill (background_color)
+        self.height = self.surface.get_height()
+        # The rows that have already been painted, killed rows drop out of this automatically
+        self.painted = pygame.sprite.Group()
+
+    def paint(self, row):
+        """Copy a scenery sprite's image in to the strip, at its position in the world"""
+        image = ImageCache.scaled_image (row.image, self.scale)
+        left = round (row.rect.left * self.scale)
+        top = round (row.rect.top * self.scale) % self.height
+        self.surface.blit (image, (left, top))
+        if top + image.get_height() > self.height:
+            self.surface.blit (image, (left, top - self.height))
+        self.painted.add (row)
+
+    def sync(self, scenery_sprites):
+        """Paint any of the scenery_sprites that haven't been painted yet"""
+        for row in scenery_sprites.spritedict.keys() - self.painted.spritedict.keys():
+            self.paint (row)
+
+    def blits(self, camera, rect):
+        """Returns a list of (surface, dest, area) tuples for Surface.blits(), which draw the terrain
+        behind rect. The rect is in screen coordinates, and the camera is in world coordinates
+        multiplied by the scale.
+        """
+        top = (camera.top + rect.top) % self.height
+        first_height = min (rect.height, self.height - top)
+        result = [(self.surface, rect.topleft, Rect (camera.left + rect.left, top, rect.width, first_height))]
+        if first_height < rect.height:
+            result.append ((self.surface, (rect.left, rect.top + first_height), Rect (camera.left + rect.left, 0, rect.width, rect.height - first_height)))
+        return result
+
+class LayeredRenderer:
+    """Draws the sprites of a RaceSimulation from a single layered group, updating only the parts of
+    the screen that changed.
+
+    The scenery rows are drawn from a TerrainStrip, so they aren't in the layered group.
+
+    While the screen is scrolling every pixel changes, so each frame is a full redraw followed by a
+    pygame.display.flip(). When the camera is still (for example while waiting for players to join)
+    only the rectangles covered by sprites that moved, appeared or disappeared are redrawn, and only
+    those are passed to pygame.display.update().
+
+    When the display runs faster than the simulation, draw() can interpolate between the positions
+    before and after the most recent tick, see remember_positions().
+
+    The screen can be a different resolution to the world, in which case everything is drawn with
+    its ImageCache.scaled_image(), at its world position multiplied by the scale. That's meant for
+    a display in pygame's SCALED mode, where SDL scales the whole screen to the window once per
+    frame; a smaller scale draws fewer pixels.
+    """
+
+    # Layer numbers in the LayeredUpdates group, higher numbers are drawn on top
+    hazard_layer = 1
+    frog_layer = 2
+    message_layer = 3
+    # Things that aren't part of the game, for example the Profiling.FrameTimeOverlay
+    overlay_layer = 4
+
+    # If the changed area is more than this fraction of the screen, just redraw everything
+    full_redraw_fraction = 0.5
+
+    def __init__(self, screen, background_color, dirty_rects=True, scale=1):
+        """background_color is shown anywhere that there isn't any scenery. If dirty_rects is false
+        then every frame is a full redraw. The screen shows the area of the world that's the
+        screen's size divided by scale, which should make GameConstants.road_width a whole number
+        of pixels.
+        """
+        self.screen = screen
+        self.scale = scale
+        self.terrain = TerrainStrip (screen.get_width(), screen.get_height(), background_color, scale=scale)
+        self.dirty_rects = dirty_rects
+        self.sprites = pygame.sprite.LayeredUpdates()
+        # Sprites to draw on top of the simulation's sprites, in world coordinates like the others
+        self.overlay_sprites = pygame.sprite.Group()
+        # For each sprite, the (image, screen rect) that was drawn in the previous frame
+        self._drawn = {}
+        self._last_camera = None
+        # The camera and sprite positions saved by remember_positions()
+        self._previous_camera = None
+        self._previous_positions = {}
+
+    def sync(self, simulation):
+        """Add any of the simulation's sprites that aren't already in the layered group, and paint
+        any new scenery in to the terrain strip. Killed sprites don't need to be handled here, kill()
+        removes them from every group.
+        """
+        self.terrain.sync (simulation.scenery_sprites)
+        for layer, group in (
+                (__class__.hazard_layer, simulation.hazard_sprites),
+                (__class__.frog_layer, simulation.frog_sprites),
+                (__class__.frog_layer, simulation.crowd_sprites),
+                (__class__.message_layer, simulation.message_sprites),
+                (__class__.overlay_layer, self.overlay_sprites)):
+            new_sprites = group.spritedict.keys() - self.sprites.spritedict.keys()
+            if new_sprites:
+                self.sprites.add (*new_sprites, layer=layer)
+
+    def remember_positions(self, simulation):
+        """Save the positions of the camera and the sprites, called before the simulation's last
+        step() before a draw() with an alpha. The ArrayTraffic's sprites are reused for different cars
+        each frame, so they're drawn where they are without interpolation.
+        """
+        self._previous_camera = simulation.camera.topleft
+        groups = [simulation.frog_sprites, simulation.message_sprites]
+        if simulation.traffic is None:
+            groups.append (simulation.hazard_sprites)
+        self._previous_positions = {sprite: sprite.rect.topleft for group in groups for sprite in group}
+
+    def _interpolate(previous, current, alpha):
+        """The point alpha of the way from previous to current. Anything that moved further than a
+        road's width in a single tick was reused from a SpritePool, and didn't really move.
+        """
+        if abs (current[0] - previous[0]) > GameConstants.road_width or abs (current[1] - previous[1]) > GameConstants.road_width:
+            return current
+        return (round (previous[0] + alpha * (current[0] - previous[0])), round (previous[1] + alpha * (current[1] - previous[1])))
+
+    def _screen_rect(self, sprite, camera, alpha):
+        """Where to draw sprite on the screen, camera is the view() of the world's camera"""
+        scale = self.scale
+        if scale == 1:
+            rect = sprite.rect.move (-camera.left, -camera.top)
+            if alpha is not None:
+                previous = self._previous_positions.get (sprite)
+                if previous is not None:
+                    rect.topleft = __class__._interpolate (previous, sprite.rect.topleft, alpha)
+                    rect.move_ip (-camera.left, -camera.top)
+            return rect
+        left, top = sprite.rect.topleft
+        if alpha is not None:
+            previous = self._previous_positions.get (sprite)
+            if previous is not None:
+                left, top = __class__._interpolate (previous, (left, top), alpha)
+        image = ImageCache.scaled_image (sprite.image, scale)
+        return Rect (round (left * scale) - camera.left, round (top * scale) - camera.top, image.get_width(), image.get_height())
+
+    def view(self, camera):
+        """The camera, which is in world coordinates, in the scaled coordinates of the screen"""
+        if self.scale == 1:
+            return camera
+        return Rect (round (camera.left * self.scale), round (camera.top * self.scale), self.screen.get_width(), self.screen.get_height())
+
+    def draw(self, simulation, alpha=None):
+        """Draw the simulation on to the screen. Returns the list of changed rectangles, or None if
+        the whole screen was redrawn.
+
+        If alpha is given, the camera and sprites are drawn that fraction of the way from the
+        positions saved by remember_positions() to their current positions.
+        """
+        simulation.prepare_for_drawing()
+        self.sync (simulation)
+        camera = simulation.camera
+        if alpha is None or self._previous_camera is None:
+            alpha = None
+        else:
+            camera = Rect (__class__._interpolate (self._previous_camera, camera.topleft, alpha), camera.size)
+        camera = self.view (camera)
+
+        if not self.dirty_rects or camera != self._last_camera:
+            return self._draw_everything (camera, alpha)
+
+        screen_rect = self.screen.get_rect()
+        scale = self.scale
+        drawn = {}
+        dirty = []
+        for sprite in self.sprites:
+            rect = self._screen_rect (sprite, camera, alpha)
+            image = ImageCache.scaled_image (sprite.image, scale)
+            drawn[sprite] = (image, rect)
+            previous = self._drawn.pop (sprite, None)
+            if previous is None:
+                dirty.append (rect)
+            elif previous[0] is not image or previous[1] != rect:
+                dirty.append (previous[1].union (rect))
+        # Anything left in _drawn has been killed since the last frame
+        for image, rect in self._drawn.values():
+            dirty.append (rect)
+        self._drawn = drawn
+
+        dirty = [rect.clip (screen_rect) for rect in dirty]
+        dirty = merge_overlapping ([rect for rect in dirty if rect.width and rect.height])
+        if not dirty:
+            return []
+        if sum (rect.width * rect.height for rect in dirty) > __class__.full_redraw_fraction * screen_rect.width * screen_rect.height:
+            return self._draw_everything (camera, alpha)
+
+        blits = []
+        for rect in dirty:
+            blits.extend (self.terrain.blits (camera, rect))
+        for sprite, (image, rect) in drawn.items():
+            for index in rect.collidelistall (dirty):
+                clip = rect.clip (dirty[index])
+                blits.append ((image, clip, clip.move (-rect.left, -rect.top)))
+        self.screen.blits (blits, False)
+        return dirty
+
+    def _draw_everything(self, camera, alpha=None):
+        self.screen.blits (self.terrain.blits (camera, self.screen.get_rect()), False)
+        scale = self.scale
+        self._drawn = {sprite: (ImageCache.scaled_image (sprite.image, scale), self._screen_rect (sprite, camera, alpha)) for sprite in self.sprites}
+        self.screen.blits (list (self._drawn.values()), False)
+        self._last_camera = camera.copy()
+        return None
+
+    def render(self, simulation):
+        """Draw the simulation and update the display, with either a flip or the changed rects."""
+        self.update_display (self.draw (simulation))
+
+    def update_display(self, dirty):
+        """Show what draw() drew, dirty is the value that it returned"""
+        if dirty is None:
+            pygame.display.flip()
+        elif dirty:
+            pygame.display.update (dirty)
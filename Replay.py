@@ -0,0 +1,308 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2019 Steve Cotton (Octalot)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Recording races, and playing them back exactly.
+
+A RaceSimulation is deterministic given its seed, its options and the input events for each tick,
+so that's all that a replay file holds. ReplayWriter streams the events to the file as the race is
+played, and every checkpoint_interval ticks it also writes a checkpoint, holding a digest of the
+simulation's state. Playback re-runs the race as fast as possible, and compares the digests to
+check that it's really reproducing the recorded race.
+
+To play back a recording headless, printing when each frog dies:
+
+    ./Replay.py recording.replay
+
+The file starts with the same kind of preamble as the AssetBundle, followed by a JSON header and then
+the records. Each record is a (kind, tick, value) triple, for events the value is the number of
+events that follow, for checkpoints it's the digest. If the game crashed, the file just stops after
+the last record that was written, and can still be played back.
+"""
+
+try:
+    import os
+    import sys
+    import argparse
+    import copy
+    import gettext
+    import json
+    import struct
+    import time
+    import zlib
+    import pygame
+    from pygame.locals import *
+    from Simulation import RaceSimulation
+except ImportError as err:
+    print ("couldn't load module. %s" % (err))
+    sys.exit(2)
+
+gettext.install ('DartingFrogs', 'data/locale')
+
+_magic = b"DFREPLAY"
+_version = 1
+_preamble = struct.Struct ("<8sII")
+_record = struct.Struct ("<BII")
+_event = struct.Struct ("<Hii")
+
+# Kinds of record
+_events_record = 1
+_checkpoint_record = 2
+_end_record = 3
+
+# The event types that RaceSimulation.handle_event uses, anything else isn't recorded
+recorded_event_types = tuple (RaceSimulation.input_event_types)
+
+def _encode_event(event):
+    """Only the attributes that the simulation reads are recorded"""
+    if event.type in (KEYDOWN, KEYUP):
+        return _event.pack (event.type, event.key, 0)
+    elif event.type in (MOUSEBUTTONDOWN, MOUSEBUTTONUP):
+        return _event.pack (event.type, event.button, 0)
+    elif event.type in (JOYBUTTONDOWN, JOYBUTTONUP):
+        return _event.pack (event.type, event.joy, event.button)
+    else:
+        return _event.pack (event.type, event.joy, event.axis)
+
+def _decode_event(event_type, a, b):
+    if event_type in (KEYDOWN, KEYUP):
+        return pygame.event.Event (event_type, key=a)
+    elif event_type in (MOUSEBUTTONDOWN, MOUSEBUTTONUP):
+        return pygame.event.Event (event_type, button=a)
+    elif event_type in (JOYBUTTONDOWN, JOYBUTTONUP):
+        return pygame.event.Event (event_type, joy=a, button=b)
+    else:
+        return pygame.event.Event (event_type, joy=a, axis=b, value=0.0)
+
+def digest(simulation):
+    """A checksum of the parts of the simulation's state that affect the race: the camera, the frogs,
+    and the positions of the cars. Two simulations with different digests have diverged.
+    """
+    state = [simulation.ticks, simulation.distance_covered, simulation.camera.top]
+    for player in simulation.players:
+        state.extend ((player.alive(), player.rect.left, player.rect.top, player.state.value, player.stateStep))
+    if simulation.crowd is not None:
+        state.append (zlib.crc32 (simulation.crowd.left.tobytes() + simulation.crowd.top.tobytes()))
+    if simulation.traffic is not None:
+        count = simulation.traffic.count
+        cars = simulation.traffic.left[:count].tobytes() + simulation.traffic.top[:count].tobytes()
+    else:
+        cars = repr (sorted (car.rect.topleft for car in simulation.hazard_sprites)).encode ("ascii")
+    return zlib.crc32 (cars, zlib.crc32 (repr (state).encode ("ascii")))
+
+class ReplayWriter:
+    """Streams a race's inputs to a file. Call record() after each call to simulation.step(), with the
+    same events, and close() at the end of the race.
+    """
+
+    def __init__(self, path, simulation, checkpoint_interval=300):
+        self.simulation = simulation
+        self.checkpoint_interval = checkpoint_interval
+        header = json.dumps ({
+            "seed": simulation.seed,
+            "camera": list (simulation.camera_area.size),
+            "array_traffic": simulation.array_traffic,
+            "spawn_range": simulation.spawn_range,
+            "analytic_collisions": simulation.analytic_collisions,
+            "crowd": simulation.crowd_size,
+            "ai_frogs": simulation.ai_frogs,
+            "ai_waits_for_players": simulation.ai_waits_for_players,
+            "checkpoint_interval": checkpoint_interval,
+        }).encode ("utf-8")
+        self._file = open (path, "wb")
+        self._file.write (_preamble.pack (_magic, _version, len (header)))
+        self._file.write (header)
+
+    def record(self, events):
+        events = [event for event in events if event.type in recorded_event_types]
+        tick = self.simulation.ticks
+        if events:
+            self._file.write (_record.pack (_events_record, tick, len (events)))
+            self._file.write (b"".join (_encode_event (event) for event in events))
+        if tick % self.checkpoint_interval == 0:
+            self._file.write (_record.pack (_checkpoint_record, tick, digest (self.simulation)))
+            # If the game crashes, everything up to the last checkpoint is saved
+            self._file.flush()
+
+    def close(self):
+        self._file.write (_record.pack (_end_record, self.simulation.ticks, digest (self.simulation)))
+        self._file.close()
+
+def _share_pygame_objects(root, memo):
+    """Prepare a deepcopy memo so that the Surfaces, Masks and Events reachable from root are shared
+    instead of copied. They can't be copied, and the images are shared by all of their sprites
+    anyway.
+    """
+    pending = [root]
+    seen = set()
+    while pending:
+        item = pending.pop()
+        if id (item) in seen:
+            continue
+        seen.add (id (item))
+        if isinstance (item, (pygame.Surface, pygame.mask.Mask, pygame.event.EventType)):
+            memo[id (item)] = item
+        elif isinstance (item, dict):
+            pending.extend (item.keys())
+            pending.extend (item.values())
+        elif isinstance (item, (list, tuple, set, frozenset)):
+            pending.extend (item)
+        elif hasattr (item, "__dict__") and not isinstance (item, type):
+            pending.extend (vars (item).values())
+
+def snapshot(simulation):
+    """A copy of the simulation, which can be stepped without affecting the original"""
+    memo = {}
+    _share_pygame_objects (simulation, memo)
+    return copy.deepcopy (simulation, memo)
+
+class Replay:
+    """A recording loaded from a file, which can be played back from the start or from any tick.
+
+    Playing back keeps a snapshot of the simulation at each checkpoint that it passes; those are the
+    seek index. seek() starts from the latest snapshot before the requested tick, so seeking
+    backwards and forwards through a race that has already been played is cheap.
+    """
+
+    def __init__(self, path):
+        with open (path, "rb") as replay_file:
+            data = replay_file.read()
+        magic, version, header_length = _preamble.unpack_from (data)
+        if magic != _magic or version != _version:
+            raise ValueError ("%s is not a version %d replay" % (path, _version))
+        self.header = json.loads (data[_preamble.size:_preamble.size + header_length].decode ("utf-8"))
+        # The events for each tick, the digest at each checkpoint, and the end of the race
+        self.events = {}
+        self.checkpoints = {}
+        self.end = None
+        position = _preamble.size + header_length
+        while position + _record.size <= len (data):
+            kind, tick, value = _record.unpack_from (data, position)
+            position += _record.size
+            if kind == _events_record:
+                if position + value * _event.size > len (data):
+                    break
+                self.events[tick] = [_decode_event (*_event.unpack_from (data, position + i * _event.size)) for i in range (value)]
+                position += value * _event.size
+            elif kind == _checkpoint_record:
+                self.checkpoints[tick] = value
+            elif kind == _end_record:
+                self.checkpoints[tick] = value
+                self.end = tick
+        # Snapshots of the simulation at checkpoints, by tick
+        self._snapshots = {}
+        # Each (tick, recorded digest, played-back digest) where they didn't match
+        self.divergences = []
+
+    def new_simulation(self):
+        """A simulation at tick 0, set up the same way as the recorded one"""
+        header = self.header
+        spawn_range = header["spawn_range"]
+        return RaceSimulation (pygame.Rect ((0, 0), header["camera"]),
+                array_traffic=header["array_traffic"],
+                spawn_range=spawn_range and tuple (spawn_range),
+                analytic_collisions=header["analytic_collisions"],
+                seed=header["seed"],
+                crowd=header["crowd"],
+                ai_frogs=header.get ("ai_frogs", 0),
+                # Older recordings were made before the AI frogs waited for the players
+                ai_waits_for_players=header.get ("ai_waits_for_players", False))
+
+    def last_tick(self):
+        """The tick that the race ended on. For a truncated recording, it's the last tick that has
+        any record, after that the inputs aren't known.
+        """
+        if self.end is not None:
+            return self.end
+        return max (list (self.checkpoints) + list (self.events), default=0)
+
+    def seek(self, tick):
+        """Returns a simulation that's been run to the given tick, or to the end of the race"""
+        earlier = [checkpoint for checkpoint in self._snapshots if checkpoint <= tick]
+        if earlier:
+            simulation = snapshot (self._snapshots[max (earlier)])
+        else:
+            simulation = self.new_simulation()
+        return self.play (simulation, tick)
+
+    def play(self, simulation, until=None, on_step=None):
+        """Step the simulation forward until the tick until, or the end of the race. Checkpoints are
+        verified and snapshotted along the way. If on_step is given, it's called after each step
+        with the simulation.
+        """
+        last_tick = self.last_tick()
+        if until is not None:
+            last_tick = min (last_tick, until)
+        while not simulation.finished and simulation.ticks < last_tick:
+            simulation.step (self.events.get (simulation.ticks + 1, ()))
+            if on_step is not None:
+                on_step (simulation)
+            tick = simulation.ticks
+            if tick in self.checkpoints:
+                actual = digest (simulation)
+                if actual != self.checkpoints[tick]:
+                    self.divergences.append ((tick, self.checkpoints[tick], actual))
+                if tick not in self._snapshots:
+                    self._snapshots[tick] = snapshot (simulation)
+        return simulation
+
+def main():
+    parser = argparse.ArgumentParser (description="Play back a recorded Darting Frogs race")
+    parser.add_argument ("replay", help="the file recorded by DartingFrogs.py --record")
+    parser.add_argument ("--seek", type=int, help="stop at this tick, instead of the end of the race")
+    parser.add_argument ("--watch", action="store_true", help="show the race on screen at normal speed, instead of headless at full speed")
+    args = parser.parse_args()
+
+    if not args.watch:
+        os.environ["SDL_VIDEODRIVER"] = "dummy"
+    pygame.init()
+    replay = Replay (args.replay)
+    simulation = replay.new_simulation()
+
+    deaths = []
+    def on_step(simulation):
+        for player in simulation.players:
+            if not player.alive() and player not in deaths:
+                deaths.append (player)
+                print ("Tick %d: %s died" % (simulation.ticks, player.get_name()))
+
+    if args.watch:
+        from Rendering import LayeredRenderer
+        screen = pygame.display.set_mode (simulation.camera_area.size)
+        renderer = LayeredRenderer (screen, (0x40, 0x80, 0x40))
+        clock = pygame.time.Clock()
+        def watch(simulation):
+            on_step (simulation)
+            renderer.render (simulation)
+            pygame.event.pump()
+            clock.tick (60)
+        callback = watch
+    else:
+        callback = on_step
+
+    start = time.perf_counter()
+    simulation = replay.play (simulation, args.seek, callback)
+    elapsed = time.perf_counter() - start
+    print ("Played %d ticks in %.3f seconds (%.0f ticks per second), distance %d" % (simulation.ticks, elapsed, simulation.ticks / max (elapsed, 1e-9), simulation.distance_covered))
+    if replay.end is None:
+        print ("The recording is truncated, it has no end record")
+    for tick, expected, actual in replay.divergences:
+        print ("Diverged at tick %d: recorded digest %08x, played back %08x" % (tick, expected, actual))
+    if replay.divergences:
+        sys.exit (1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2019 Steve Cotton (Octalot)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Scheduling things to happen at a later tick, instead of checking for them every tick.
+
+A RaceSimulation's roads schedule their next car spawn, each car schedules the tick that it will
+leave the road, and the scenery rows, cars and messages schedule the point at which they'll have
+scrolled off the bottom of the screen. Anything that's waiting costs nothing until its time comes.
+"""
+
+try:
+    import sys
+    from itertools import count
+except ImportError as err:
+    print ("couldn't load module. %s" % (err))
+    sys.exit(2)
+
+class ScheduledCall:
+    """A callback waiting in a TimerWheel, returned by call_at() so that it can be cancelled"""
+    def __init__(self, time, order, callback, args):
+        self.time = time
+        self.order = order
+        self.callback = callback
+        self.args = args
+
+class TimerWheel:
+    """A hierarchical timer wheel: callbacks are scheduled for an integer time, and run_due() calls
+    the ones whose time has come, in order of time and then in the order that they were scheduled,
+    unless call_at() is given an order.
+
+    Level 0 has a slot for each of the next 64 times, level 1 a slot for each of the next 64 blocks
+    of 64, and so on; the callbacks in a higher level's slot are moved down a level when the wheel
+    reaches the start of their block. Scheduling and cancelling are O(1), and running the wheel
+    costs O(1) for each time that it passes, however many callbacks are waiting. Callbacks further
+    ahead than all of the levels wait in an overflow list.
+
+    The times are whatever the caller chooses, for example simulation ticks, and can be negative.
+    The callbacks should be bound methods rather than lambdas or closures, so that a wheel can be
+    deep-copied along with the objects that it calls, as Replay.snapshot() does.
+    """
+
+    slot_bits = 6
+    levels = 4
+
+    def __init__(self, now=0):
+        # The current time, which the caller moves forward before calling run_due()
+        self.now = now
+        # Every callback at or before this time has been run
+        self._cursor = now
+        slots = 1 << __class__.slot_bits
+        self._mask = slots - 1
+        self._wheels = [[[] for slot in range (slots)] for level in range (__class__.levels)]
+        self._overflow = []
+        # Callbacks that were scheduled for a time that the cursor has already reached
+        self._due = []
+        self._serials = count()
+        # The number of callbacks that are waiting
+        self.pending = 0
+
+    def call_at(self, time, callback, *args, order=None):
+        """Call callback (*args) during the first run_due() with self.now >= time.
+
+        Callbacks for the same time are run in order of their order, which by default is a serial
+        number that's the order they were scheduled in. Passing the order of an earlier call keeps a
+        repeating callback in the same position relative to the others.
+        """
+        if order is None:
+            order = next (self._serials)
+        call = ScheduledCall (time, order, callback, args)
+        self._insert (call)
+        self.pending += 1
+        return call
+
+    def cancel(self, call):
+        """Stop a call_at() from happening, it's harmless if it's already happened"""
+        if call.callback is not None:
+            call.callback = None
+            call.args = None
+            self.pending -= 1
+
+    def _insert(self, call):
+        time = call.time
+        if time <= self._cursor:
+            self._due.append (call)
+            return
+        slot_bits = __class__.slot_bits
+        for level in range (__class__.levels):
+            if time >> (slot_bits * (level + 1)) == self._cursor >> (slot_bits * (level + 1)):
+                self._wheels[level][(time >> (slot_bits * level)) & self._mask].append (call)
+                return
+        self._overflow.append (call)
+
+    def _cascade(self, time):
+        """Called when the cursor reaches time, move the callbacks for the block that starts at time
+        down from the higher levels.
+        """
+        slot_bits = __class__.slot_bits
+        for level in range (1, __class__.levels):
+            if time & ((1 << (slot_bits * level)) - 1):
+                return
+            slot = self._wheels[level][(time >> (slot_bits * level)) & self._mask]
+            self._wheels[level][(time >> (slot_bits * level)) & self._mask] = []
+            for call in slot:
+                if call.callback is not None:
+                    self._insert (call)
+        if not time & ((1 << (slot_bits * __class__.levels)) - 1):
+            overflow = self._overflow
+            self._overflow = []
+            for call in overflow:
+                if call.callback is not None:
+                    self._insert (call)
+
+    def _run(self, calls):
+        calls.sort (key=lambda call: (call.time, call.order))
+        for call in calls:
+            callback = call.callback
+            if callback is not None:
+                args = call.args
+                call.callback = None
+                call.args = None
+                self.pending -= 1
+                callback (*args)
+
+    def run_due(self):
+        """Run every waiting callback whose time is at or before self.now. Callbacks may schedule
+        more callbacks, including ones that are already due, which are run before this returns.
+        """
+        while self._due:
+            due = self._due
+            self._due = []
+            self._run (due)
+        while self._cursor < self.now:
+            time = self._cursor + 1
+            self._cursor = time
+            if not time & self._mask:
+                self._cascade (time)
+            slot = self._wheels[0][time & self._mask]
+            self._wheels[0][time & self._mask] = []
+            due = slot + self._due
+            self._due = []
+            while due:
+                self._run (due)
+                due = self._due
+                self._due = []
+
+    def advance(self, now):
+        """Move the current time to now, and run everything that's due"""
+        self.now = now
+        self.run_due()
+
+class RaceSchedule:
+    """The two timer wheels of a race.
+
+    ticks is timed in the simulation's ticks. scroll is timed by how far the camera has scrolled,
+    its time is -camera.bottom, so that it increases as the camera moves up the world.
+    """
+
+    def __init__(self, camera):
+        self.ticks = TimerWheel()
+        self.scroll = TimerWheel (-camera.bottom)
+
+    def call_when_offscreen(self, sprite, callback, *args):
+        """Call callback (*args) when the sprite has scrolled off the bottom of the screen, which is
+        when sprite.rect.top > camera.bottom. The sprite mustn't move vertically.
+        """
+        return self.scroll.call_at (1 - sprite.rect.top, callback, *args)
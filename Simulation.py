@@ -0,0 +1,464 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2017 Steve Cotton (Octalot)
+# Based on code from Tom Chance's PyGame tutorial
+# Copyright (C) 2003-2016 Tom Chance
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""The game logic for a single race, separated from the display.
+
+RaceSimulation doesn't touch pygame.display, doesn't limit the frame rate and doesn't draw anything,
+so it can be run headless (with SDL_VIDEODRIVER=dummy) many times faster than real time. The
+interactive game in DartingFrogs.py is a renderer on top of this.
+"""
+
+try:
+    import sys
+    import random
+    import pygame
+    from pygame.locals import *
+    from GameConstants import GameConstants
+    from Hazards import Grass, Road
+    from MessageSprites import *
+    from Utils import *
+    from Frogs import AiFrog, FrogPositionIndex, InputTest, PlayerFrog
+    from Collisions import AnalyticLaneCollisions, LaneCollisionIndex
+    from Traffic import ArrayTraffic
+    from Crowd import AiCrowd
+    from Planner import LanePlanner
+    from Scheduler import RaceSchedule
+    from LanePipeline import LanePipeline
+    from Profiling import NullFrameTimer
+except ImportError as err:
+    print ("couldn't load module. %s" % (err))
+    sys.exit(2)
+
+class RaceSimulation:
+    """One complete race, from waiting for players until game over.
+
+    Each call to step() is one clock tick of the game. The sprite groups are public so that a
+    renderer can draw them.
+
+    Sprites are positioned in world coordinates, which stay fixed while the screen scrolls. The
+    world-space rect of the visible area is self.camera, so a renderer draws each sprite at
+    sprite.rect.move (-camera.left, -camera.top). The frogs race towards negative y, so scrolling
+    just moves the camera upwards, without touching any of the sprites.
+    """
+
+    # The types of event that handle_event() uses, the game doesn't need any others in the queue
+    input_event_types = [KEYDOWN, KEYUP, MOUSEBUTTONDOWN, MOUSEBUTTONUP, JOYBUTTONDOWN, JOYBUTTONUP, JOYAXISMOTION]
+
+    credits = [
+        "Darting Frogs",
+        "by Octalot (Steve Cotton), based on Tom Chance's GPLv2+ PyGame tutorial",
+        "cars and trucks by Lowder2 (CC-BY 3.0) and Satik64 (CC0)",
+        "road textures by Thomas Oppl for SuperTuxKart (CC-BY-SA 3.0)",
+        "grass textures from Widelands (GPLv2+)",
+        "Thanks to all of the above, and to the OpenGameArt and PyGame communities",
+    ]
+
+    # How far ahead of the camera the rows of grass and road are planned, see LanePipeline
+    lookahead_screens = 3
+
+    def __init__(self, camera_area, array_traffic=False, spawn_range=None, analytic_collisions=False, seed=None, crowd=0, ai_frogs=0, row_worker=False, ai_waits_for_players=True):
+        """camera_area is the size of the screen. At the start of the race the world coordinates and
+        screen coordinates are the same.
+
+        If array_traffic is true, the cars are held in an ArrayTraffic instead of being Car sprites,
+        and hazard_sprites is only filled by prepare_for_drawing(). The spawn_range overrides
+        Road.random_spawn_range, with Road.rush_hour_spawn_range the roads are much busier.
+
+        If analytic_collisions is true, collisions are found with AnalyticLaneCollisions instead of
+        rebuilding a LaneCollisionIndex each tick. That can't be combined with array_traffic.
+
+        Everything random in the race comes from generators seeded from seed, so a race with the same
+        seed, options and inputs is exactly reproducible (see Replay.py). If seed is None, a random
+        seed is chosen, it's available afterwards as self.seed.
+
+        If crowd is more than zero, that many AI frogs are added in an AiCrowd, which needs NumPy.
+        They race along with the players and affect the scrolling, but the race is over when all of
+        the players' frogs are dead.
+
+        If ai_frogs is more than zero, that many AiFrogs race as players, and the race isn't over
+        until they're dead too. Unless array_traffic is used, they plan their jumps with a shared
+        LanePlanner. If ai_waits_for_players is true, they and the crowd wait off-screen until the
+        first player joins (or the time for joining ends), otherwise they start on the first tick and
+        the first AI death ends the time for joining, as there's nobody to wait for.
+
+        If row_worker is true, the rows of grass and road are prepared ahead of time on a worker
+        thread, instead of on the tick that they're needed. That doesn't change the race.
+        """
+        if array_traffic and analytic_collisions:
+            raise ValueError ("analytic_collisions needs Car sprites, it can't be used with array_traffic")
+        self.camera_area = camera_area
+        self.array_traffic = array_traffic
+        self.analytic_collisions = analytic_collisions
+        self.crowd_size = crowd
+        self.ai_frogs = ai_frogs
+        self.ai_waits_for_players = ai_waits_for_players
+        self.traffic = ArrayTraffic() if array_traffic else None
+        self.spawn_range = spawn_range
+        self.camera = camera_area.copy()
+        # The roads' spawns and the cars' kills are scheduled by tick, and everything that scrolls
+        # off the bottom of the screen is scheduled by the camera's position
+        self.schedule = RaceSchedule (self.camera)
+
+        # Initialise players
+        self.players = []
+        # The living PlayerFrogs, by the InputTest.dispatch_key of the key or button that controls them
+        self.input_dispatch = {}
+        self.new_players_can_join = PlayersCanJoinMessage()
+        self.new_players_can_join.rect.midtop = camera_area.midtop
+        self.game_over_sprite = None
+        self.distance_covered = 0
+        self.distance_until_next_hazard = GameConstants.road_width
+        # The text saying how far the frogs have gone
+        self.next_milestone = GameConstants.milestone_distance
+        # Set to true when the game over message has scrolled off the screen
+        self.finished = False
+        # Each (tick, frog, speed) when a frog was run over, speed is the speed of the car that hit
+        # it, or None if that isn't known (ArrayTraffic only reports that there was a collision)
+        self.deaths = []
+
+        # Initialise sprite groups
+        self.frog_sprites = pygame.sprite.Group()
+        # The same frogs, sorted by their positions
+        self.frog_index = FrogPositionIndex()
+        # Scenery isn't dangerous (but includes roads, which spawn hazards)
+        self.scenery_sprites = pygame.sprite.Group()
+        # Hazard sprites are the ones that will kill colliding frogs
+        self.hazard_sprites = pygame.sprite.Group()
+        # The roads are also in scenery_sprites, this group is for collision detection by lane
+        self.road_sprites = pygame.sprite.Group()
+        # Cars can be taller than their road, so they may still be on screen for a moment after
+        # their road has been removed. Those aren't in any lane, they're collision-checked directly.
+        self.orphaned_cars = pygame.sprite.Group()
+        if analytic_collisions:
+            self.collision_index = AnalyticLaneCollisions()
+        else:
+            self.collision_index = LaneCollisionIndex()
+        # There's no separate title screen, it's just something that's shown on top
+        # of the grass area before any players join.
+        credits_message = MultiLineMessageSprite(__class__.credits, firstLineSize=40)
+        credits_message.rect.bottomleft = camera_area.bottomleft
+
+        # Message sprites are overlayed over everything else
+        self.message_sprites = pygame.sprite.Group()
+        self._add_message (self.new_players_can_join)
+        self._add_message (credits_message)
+
+        if seed is None:
+            seed = random.getrandbits (32)
+        self.seed = seed
+        # The race's own decisions, and the seeds for each road, grass row and frog
+        self.random_number_generator = random.Random (seed)
+        # The number of calls to step() so far
+        self.ticks = 0
+        # Replace with a Profiling.FrameTimer to time the phases of step()
+        self.frame_timer = NullFrameTimer()
+
+        # The crowd's frogs aren't sprites, this group is filled by prepare_for_drawing()
+        self.crowd_sprites = pygame.sprite.Group()
+        if crowd:
+            self.crowd = AiCrowd (crowd, camera_area, -self.distance_until_next_hazard, self._new_seed())
+        else:
+            self.crowd = None
+        # While this is true the crowd waits with the waiting_ai_frogs, and isn't moved or collided
+        self.crowd_waiting = crowd > 0
+
+        # The planner needs the cars' lane_offsets, which ArrayTraffic doesn't have
+        if ai_frogs and not array_traffic:
+            self.planner = LanePlanner()
+        else:
+            self.planner = None
+        # AI frogs that are waiting for a player to join, they're neither moved nor collision-checked
+        self.waiting_ai_frogs = pygame.sprite.Group()
+        for column in range (ai_frogs):
+            frog = AiFrog (None, column=column, distance_align=-self.distance_until_next_hazard, camera_area=self.camera, seed=self._new_seed(), planner=self.planner)
+            self.players.append (frog)
+            self.waiting_ai_frogs.add (frog)
+        if not ai_waits_for_players:
+            self._start_ai_frogs()
+
+        # For the first screen, generate some roads and cover the rest of the start-screen in grass
+        initial_roads = self.random_number_generator.sample(range (0,4), 3)
+        for i in range (-1, 1 + int (camera_area.height / GameConstants.road_width)):
+            if i in initial_roads:
+                new_scenery = self._create_road (Rect(0, i * GameConstants.road_width, camera_area.width, GameConstants.road_width))
+            else:
+                new_scenery = Grass.create (Rect(0, i * GameConstants.road_width, camera_area.width, GameConstants.road_width), self._new_seed())
+            self._add_scenery (new_scenery)
+            new_scenery.update()
+        # The rest of the rows, starting just above the first screen
+        lookahead_rows = __class__.lookahead_screens * -(-camera_area.height // GameConstants.road_width)
+        next_top = self.camera.top - self.distance_until_next_hazard - GameConstants.road_width
+        self.lanes = LanePipeline (self.random_number_generator, camera_area.width, next_top, spawn_range, lookahead_rows, threaded=row_worker)
+
+    def step(self, inputs=()):
+        """Advance the race by one clock tick.
+
+        inputs is an iterable of pygame events that happened since the last tick. Quitting the game
+        is the caller's responsibility, QUIT and K_ESCAPE events are ignored here.
+
+        After this returns, if self.finished is true then the race is over and further calls to
+        step() are pointless.
+        """
+        timer = self.frame_timer
+        self.ticks += 1
+        self.schedule.ticks.now = self.ticks
+        for event in inputs:
+            self.handle_event (event)
+        if (self.waiting_ai_frogs or self.crowd_waiting) and (self.frog_sprites or not self.new_players_can_join.alive()):
+            self._start_ai_frogs()
+        timer.mark ("events")
+        screen_scroll = self._calculate_scroll()
+        self._scroll (screen_scroll)
+        timer.mark ("scroll")
+        self._add_new_scenery()
+        self._add_milestone()
+        timer.mark ("new_scenery")
+
+        self.message_sprites.update()
+        timer.mark ("update_messages")
+        self.hazard_sprites.update()
+        if self.traffic is not None:
+            self.traffic.update (self.camera.bottom)
+        timer.mark ("update_hazards")
+        self.scenery_sprites.update()
+        timer.mark ("update_scenery")
+        # Spawning cars, and killing the ones that have reached the end of their road
+        self.schedule.ticks.run_due()
+        timer.mark ("scheduled")
+        if self.planner is not None:
+            self.planner.start_tick (self.road_sprites)
+        self.frog_sprites.update()
+        if self.crowd is not None and not self.crowd_waiting:
+            self.crowd.update()
+        timer.mark ("update_frogs")
+
+        self.schedule.scroll.advance (-self.camera.bottom)
+        timer.mark ("offscreen")
+        if self.game_over_sprite and not self.game_over_sprite.alive():
+            self.finished = True
+            return
+
+        self._check_collisions()
+        self._check_game_over()
+        timer.mark ("collisions")
+
+    def handle_event(self, event):
+        """Process a single input event, which may add a new frog or make an existing frog jump."""
+        if event.type in [KEYDOWN, MOUSEBUTTONDOWN, JOYBUTTONDOWN]:
+            player = self.input_dispatch.get (InputTest.dispatch_key (event))
+            if player is not None:
+                player.jump()
+            elif self.new_players_can_join.alive():
+                # Dead frogs aren't in input_dispatch, but this can't add a second frog for the same
+                # key, because the first death ends the time when players can join.
+                self.add_player (event)
+            else:
+                # todo: show that the new-player phase has ended
+                pass
+
+        elif event.type in [KEYUP, MOUSEBUTTONUP, JOYBUTTONUP]:
+            player = self.input_dispatch.get (InputTest.dispatch_key (event))
+            if player is not None:
+                player.rest()
+
+        # To support JOYAXISMOTION would need logic for which positions represent "button down",
+        # which represent "button up", and which pairs of axis should represent a single frog.
+        # IMO buttons and keys seem better suited to this game anyway.
+        elif event.type == JOYAXISMOTION:
+            if self.new_players_can_join.alive():
+                self.new_players_can_join.kill()
+                self.new_players_can_join = PlayersCanJoinMessage(self.new_players_can_join)
+                self._add_message (self.new_players_can_join)
+
+    def add_player(self, event):
+        """Create a PlayerFrog controlled by the key or button of event, and start it jumping."""
+        frog = PlayerFrog (input_event=event, column=len (self.players) - self.ai_frogs, distance_align=-self.distance_until_next_hazard, camera_area=self.camera)
+        self.players.append (frog)
+        self.input_dispatch[frog.dispatch_key] = frog
+        self.frog_sprites.add (frog)
+        self.frog_index.add (frog)
+        frog.jump()
+        self._add_message (EachJoiningPlayerMessage (frog))
+        return frog
+
+    def _start_ai_frogs(self):
+        """Start the AiFrogs and the crowd, which have been waiting for a player to join"""
+        self.crowd_waiting = False
+        for frog in self.players:
+            if frog in self.waiting_ai_frogs:
+                frog.remove (self.waiting_ai_frogs)
+                self.frog_sprites.add (frog)
+                self.frog_index.add (frog)
+
+    def _calculate_scroll(self):
+        """Find out where the frogs are, calculate whether the screen should scroll"""
+        camera_area = self.camera_area
+        screen_scroll = 0
+        top = bottom = None
+        front = self.frog_index.front()
+        if front is not None:
+            top = front.rect.top
+            bottom = self.frog_index.back().rect.bottom
+        if self.crowd is not None and not self.crowd_waiting and self.crowd.count:
+            crowd_bounds = self.crowd.bounding_box()
+            if top is None:
+                top, bottom = crowd_bounds.top, crowd_bounds.bottom
+            else:
+                top, bottom = min (top, crowd_bounds.top), max (bottom, crowd_bounds.bottom)
+        if top != None:
+            # Scroll if no-one's near the bottom
+            # Convert to screen coordinates
+            top -= self.camera.top
+            bottom -= self.camera.top
+            if bottom < 0.8 * camera_area.height:
+                screen_scroll += 1
+            # Scroll if anyone is ahead
+            if top < 0.5 * camera_area.height:
+                screen_scroll += 1
+            # Scroll faster if someone is far ahead
+            if top < 0.2 * camera_area.height:
+                screen_scroll += 2
+            # Jumpy scroll if someone is almost off-screen
+            if top < GameConstants.furthest_single_tick_jump:
+                screen_scroll += GameConstants.furthest_single_tick_jump - top
+        # In a single-player game, the screen always scrolls
+        if len (self.frog_sprites) == 1 and screen_scroll == 0 and not self.new_players_can_join.alive():
+            screen_scroll = 1
+        # When the game over message is being displayed, the screen scrolls continually. This
+        # scrolls at a fixed speed, it's no problem if a frog jumps off the top of the screen.
+        if self.game_over_sprite != None:
+            screen_scroll = 3
+        return screen_scroll
+
+    def _scroll(self, screen_scroll):
+        # Scrolling is just moving the camera, the sprites stay where they are in the world
+        self.camera.move_ip (0, -screen_scroll)
+
+        # If any frogs are at the back of the screen, move them
+        if screen_scroll:
+            self.distance_covered += screen_scroll
+            self.distance_until_next_hazard -= screen_scroll
+            for player in self.frog_index.bottom_at_least (self.camera.bottom - screen_scroll):
+                player.jump_forced()
+            if self.crowd is not None and not self.crowd_waiting:
+                self.crowd.force_jumps (self.camera.bottom, screen_scroll)
+
+    def _add_new_scenery(self):
+        """Scrolling the screen may introduce a new hazard or hazard-spawning scenery"""
+        if self.distance_until_next_hazard <= 0:
+            self.distance_until_next_hazard += GameConstants.road_width
+            plan = self.lanes.next_row()
+            if plan.kind == "grass":
+                self._add_scenery (Grass.create (plan.rect, plan=plan))
+            if plan.kind == "road":
+                self._add_scenery (self._create_road (plan.rect, plan))
+        else:
+            self.lanes.prepare_ahead()
+
+    def _add_milestone(self):
+        if self.distance_covered >= self.next_milestone:
+            milestone = MessageSprite (_("Distance: %d") % self.next_milestone)
+            milestone.rect.midtop = self.camera.midtop
+            self._add_message (milestone)
+            self.next_milestone += GameConstants.milestone_distance
+
+    def _add_scenery(self, row):
+        """Add a row of grass or road, which is removed when it scrolls off the screen"""
+        self.scenery_sprites.add (row)
+        if isinstance (row, Road):
+            self.road_sprites.add (row)
+        self.schedule.call_when_offscreen (row, self._scroll_off, row)
+
+    def _scroll_off(self, row):
+        if row in self.road_sprites:
+            self.orphaned_cars.add (row.cars)
+        row.kill()
+
+    def _add_message(self, message):
+        """Add a message, which must already be positioned, it's removed when it scrolls off the
+        screen.
+        """
+        self.message_sprites.add (message)
+        self.schedule.call_when_offscreen (message, message.kill)
+
+    def _new_seed(self):
+        """A seed for a new road, grass row or AI frog, derived from the race's seed"""
+        return self.random_number_generator.getrandbits (32)
+
+    def _create_road(self, rect, plan=None):
+        """A road made from the plan, or with a new seed if there isn't one"""
+        seed = self._new_seed() if plan is None else None
+        return Road.create (self.hazard_sprites, rect, traffic=self.traffic, spawn_range=self.spawn_range, seed=seed, schedule=self.schedule, plan=plan)
+
+    def _check_collisions(self):
+        if self.traffic is None:
+            # Each frog is only tested against the cars in the lanes that it overlaps
+            self.collision_index.rebuild (self.road_sprites)
+        for player in self.frog_sprites:
+            if self.traffic is None:
+                hit = self.collision_index.collide (player, collided=pygame.sprite.collide_mask)
+            else:
+                hit = self.traffic.collides (player)
+            if not hit and self.orphaned_cars:
+                hit = pygame.sprite.spritecollideany (player, self.orphaned_cars, collided=pygame.sprite.collide_mask)
+            if (hit):
+                self.deaths.append ((self.ticks, player, __class__._speed_of (hit)))
+                player.kill()
+                self.input_dispatch.pop (player.dispatch_key, None)
+                if isinstance (player, PlayerFrog) or not self.ai_waits_for_players:
+                    self.new_players_can_join.kill()
+        if self.crowd is not None and not self.crowd_waiting and self.crowd.count:
+            if self.traffic is None:
+                cars = [(car.rect, car.mask) for car in self.hazard_sprites]
+            else:
+                cars = self.traffic.shapes (self.crowd.bounding_box())
+            self.crowd.collide (cars)
+
+    def _speed_of(hit):
+        """The speed of the car (or the fastest of the cars) returned by a collision check"""
+        if isinstance (hit, pygame.sprite.Sprite):
+            return hit.speed
+        if isinstance (hit, bool):
+            return None
+        return max ((car.speed for car in hit), key=abs)
+
+    def _check_game_over(self):
+        frog_sprites = self.frog_sprites
+        if (not frog_sprites) and (not self.new_players_can_join.alive()):
+            if not self.game_over_sprite:
+                self.game_over_sprite = MessageSprite (_("GAME OVER (distance %d)") % self.distance_covered)
+                self.game_over_sprite.rect.midtop = self.camera.midtop
+                self._add_message (self.game_over_sprite)
+        # Check for victory in multiplayer, if there is exactly one frog still alive
+        if len (frog_sprites) == 1 and len (self.players) > 1:
+            if not self.game_over_sprite:
+                for player in self.players:
+                    if player.alive():
+                        self.game_over_sprite = VictoryMessage (player)
+                        self.game_over_sprite.rect.midtop = self.camera.midtop
+                        self._add_message (self.game_over_sprite)
+
+    def prepare_for_drawing(self):
+        """Called by the renderer before drawing. With array_traffic, this fills hazard_sprites with
+        sprites for the cars that are on screen, and with a crowd it fills crowd_sprites.
+        """
+        if self.traffic is not None:
+            self.traffic.materialize (self.hazard_sprites, self.camera)
+        if self.crowd is not None:
+            self.crowd.materialize (self.crowd_sprites, self.camera)
@@ -0,0 +1,171 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2019 Steve Cotton (Octalot)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Playing many headless races of AI frogs in parallel, to balance the game's difficulty.
+
+Each race is a RaceSimulation with only AI frogs, seeded so that any race in the report can be
+played again. The races are shared out between worker processes, one race at a time, and the
+results are combined into a summary of how far the frogs got, how long they survived and what
+killed them. For example, to try slower roads:
+
+    ./Tournament.py --races 2000 --ai 4 --speeds 1,2,2,3,3,-1,-2,-2,-3,-3
+
+The road speeds and spawn range replace Road.random_speeds and Road.random_spawn_range in the
+workers, the game itself isn't affected.
+"""
+
+try:
+    import os
+    import sys
+    import argparse
+    import contextlib
+    import gettext
+    import io
+    import json
+    import multiprocessing
+    import statistics
+    import time
+    from collections import Counter
+    import pygame
+    from Frogs import Frog
+    from Hazards import Road
+    from Simulation import RaceSimulation
+except ImportError as err:
+    print ("couldn't load module. %s" % (err))
+    sys.exit(2)
+
+gettext.install ('DartingFrogs', 'data/locale')
+
+# The same size as the real game's screen
+camera_area = pygame.Rect (0, 0, 1024, 700)
+
+def _init_worker(random_speeds, spawn_range):
+    """Set up each worker process to run simulations headless, with the road settings being tested"""
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    # Otherwise SDL catches SIGTERM, and the pool can't stop the workers at the end
+    os.environ["SDL_NO_SIGNAL_HANDLERS"] = "1"
+    pygame.init()
+    if random_speeds:
+        Road.random_speeds = random_speeds
+    if spawn_range:
+        Road.random_spawn_range = spawn_range
+
+def play_race(race):
+    """Play one race until every frog is dead, or one has won, or max_ticks have passed. The race is
+    a (seed, ai_frogs, max_ticks) triple, the result is a dict that can be sent back from a worker.
+    """
+    seed, ai_frogs, max_ticks = race
+    # Each frog prints a line when it's created
+    with contextlib.redirect_stdout (io.StringIO()):
+        simulation = RaceSimulation (camera_area, seed=seed, ai_frogs=ai_frogs, ai_waits_for_players=False)
+        start_tops = {frog: frog.rect.top for frog in simulation.players}
+        while not simulation.finished and simulation.game_over_sprite is None and simulation.ticks < max_ticks:
+            simulation.step()
+    deaths = {frog: (tick, speed) for tick, frog, speed in simulation.deaths}
+    frogs = []
+    for frog in simulation.players:
+        tick, speed = deaths.get (frog, (None, None))
+        frogs.append ({
+            "distance": start_tops[frog] - frog.rect.top,
+            "ticks": simulation.ticks if tick is None else tick,
+            "died": tick is not None,
+            "jumping": frog.state != Frog.State.still,
+            "speed": speed,
+        })
+    return {"seed": seed, "ticks": simulation.ticks, "distance": simulation.distance_covered, "frogs": frogs}
+
+def _percentiles(values, fractions=(0.1, 0.5, 0.9)):
+    values = sorted (values)
+    if not values:
+        return [0 for fraction in fractions]
+    return [values[min (len (values) - 1, int (fraction * len (values)))] for fraction in fractions]
+
+def summarize(results, elapsed):
+    """Combine the results of play_race into a dict of statistics"""
+    frogs = [frog for result in results for frog in result["frogs"]]
+    dead = [frog for frog in frogs if frog["died"]]
+    summary = {
+        "races": len (results),
+        "frogs": len (frogs),
+        "seconds": elapsed,
+        "races_per_minute": 60 * len (results) / max (elapsed, 1e-9),
+        "race_distance": {
+            "mean": statistics.mean (result["distance"] for result in results) if results else 0,
+            "p10_p50_p90": _percentiles ([result["distance"] for result in results]),
+        },
+        "frog_distance": {
+            "mean": statistics.mean (frog["distance"] for frog in frogs) if frogs else 0,
+            "p10_p50_p90": _percentiles ([frog["distance"] for frog in frogs]),
+        },
+        "survival_ticks": {
+            "mean": statistics.mean (frog["ticks"] for frog in frogs) if frogs else 0,
+            "p10_p50_p90": _percentiles ([frog["ticks"] for frog in frogs]),
+        },
+        "survivors": len (frogs) - len (dead),
+        # JSON keys have to be strings
+        "deaths_by_car_speed": {str (speed): count for speed, count in sorted (Counter (frog["speed"] for frog in dead).items(), key=lambda item: (item[0] is None, item[0] or 0))},
+        "deaths_while": {
+            "jumping": sum (1 for frog in dead if frog["jumping"]),
+            "still": sum (1 for frog in dead if not frog["jumping"]),
+        },
+    }
+    return summary
+
+def print_report(summary):
+    print ("%d races, %d frogs, in %.1f seconds (%.0f races per minute)" % (summary["races"], summary["frogs"], summary["seconds"], summary["races_per_minute"]))
+    for name, label in (("race_distance", "Race distance"), ("frog_distance", "Frog distance"), ("survival_ticks", "Frog survival (ticks)")):
+        stats = summary[name]
+        print ("%-22s mean %8.1f   p10 %6d   median %6d   p90 %6d" % ((label, stats["mean"]) + tuple (stats["p10_p50_p90"])))
+    print ("Survivors (the winners, and any frogs still racing at --max-ticks): %d" % summary["survivors"])
+    print ("Deaths while jumping: %d, while still: %d" % (summary["deaths_while"]["jumping"], summary["deaths_while"]["still"]))
+    print ("Deaths by the speed of the car:")
+    for speed, count in summary["deaths_by_car_speed"].items():
+        print ("  %5s  %d" % (speed, count))
+
+def main():
+    parser = argparse.ArgumentParser (description="Play many headless Darting Frogs races between AI frogs, and summarize the results")
+    parser.add_argument ("--races", type=int, default=1000, help="how many races to play")
+    parser.add_argument ("--seed", type=int, default=0, help="the races use consecutive seeds starting from this one")
+    parser.add_argument ("--ai", type=int, default=4, metavar="COUNT", help="the number of AI frogs in each race")
+    parser.add_argument ("--speeds", help="comma-separated road speeds to choose from, instead of Road.random_speeds")
+    parser.add_argument ("--spawn-range", type=int, nargs=2, metavar=("MIN", "MAX"), help="the range of distances between cars, instead of Road.random_spawn_range")
+    parser.add_argument ("--max-ticks", type=int, default=20000, help="stop any race that's still going after this many ticks")
+    parser.add_argument ("--workers", type=int, default=os.cpu_count(), help="the number of processes, by default one per CPU")
+    parser.add_argument ("--output", metavar="FILE", help="also save the summary and each race's results as JSON")
+    args = parser.parse_args()
+    if args.ai < 1:
+        parser.error ("a race needs at least one AI frog, otherwise it never ends")
+
+    speeds = [int (speed) for speed in args.speeds.split (",")] if args.speeds else None
+    if speeds is not None and 0 in speeds:
+        parser.error ("a road speed of 0 would mean that the road chooses a random speed")
+    races = [(args.seed + i, args.ai, args.max_ticks) for i in range (args.races)]
+
+    start = time.perf_counter()
+    with multiprocessing.Pool (args.workers, initializer=_init_worker, initargs=(speeds, args.spawn_range)) as pool:
+        results = list (pool.imap_unordered (play_race, races, chunksize=max (1, args.races // (args.workers * 8))))
+    elapsed = time.perf_counter() - start
+    results.sort (key=lambda result: result["seed"])
+
+    summary = summarize (results, elapsed)
+    print_report (summary)
+    if args.output:
+        with open (args.output, "w") as output:
+            json.dump ({"summary": summary, "races": results}, output, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2019 Steve Cotton (Octalot)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""An alternative to having a Car sprite for each car, for games with thousands of cars.
+
+This needs NumPy, which is otherwise optional.
+"""
+
+try:
+    import sys
+    import pygame
+    from Hazards import Car
+except ImportError as err:
+    print ("couldn't load module. %s" % (err))
+    sys.exit(2)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class TrafficSprite(pygame.sprite.Sprite):
+    """A sprite that's only used to draw one of ArrayTraffic's cars. These are reused each frame, so
+    they don't keep any identity between frames.
+    """
+    def __init__(self):
+        pygame.sprite.Sprite.__init__(self)
+        self.image = None
+        self.rect = pygame.Rect (0, 0, 0, 0)
+
+class ArrayTraffic:
+    """All of the cars on all of the roads, stored as NumPy arrays instead of Car sprites.
+
+    Each car is an index in to the arrays: its left edge and top edge in world coordinates, its
+    speed, the x coordinate where it's removed (with the same meaning as Car.kill_point) and a
+    variant number, which is an index in to the table of (image, mask) pairs. Each tick, update()
+    moves every car in a single vectorized step and removes the finished ones by filtering the
+    arrays with a mask.
+
+    Roads created with traffic=this_object call spawn() instead of creating Car sprites. Nothing is
+    drawn from the arrays directly, materialize() makes sprites for the cars that are on screen.
+    """
+
+    def __init__(self, capacity=1024):
+        if numpy is None:
+            raise RuntimeError ("ArrayTraffic requires NumPy")
+        self.count = 0
+        self.left = numpy.zeros (capacity, dtype=numpy.int32)
+        self.top = numpy.zeros (capacity, dtype=numpy.int32)
+        self.speed = numpy.zeros (capacity, dtype=numpy.int32)
+        self.kill_point = numpy.zeros (capacity, dtype=numpy.int32)
+        self.variant = numpy.zeros (capacity, dtype=numpy.int16)
+
+        # The (spritefile, rotation) of each variant, and their images, masks and sizes
+        self._variant_ids = {}
+        self._images = []
+        self._masks = []
+        self._widths = numpy.zeros (0, dtype=numpy.int32)
+        self._heights = numpy.zeros (0, dtype=numpy.int32)
+
+        # Reused each frame by materialize()
+        self._sprites = []
+
+    def __len__(self):
+        return self.count
+
+    def _variant(self, spritefile, rotation):
+        key = (spritefile, rotation)
+        if key not in self._variant_ids:
+            image = Car.image_cache.load_rotated_image (spritefile, rotation)
+            self._variant_ids[key] = len (self._images)
+            self._images.append (image)
+            self._masks.append (Car.image_cache.load_rotated_mask (spritefile, rotation))
+            self._widths = numpy.append (self._widths, image.get_width()).astype (numpy.int32)
+            self._heights = numpy.append (self._heights, image.get_height()).astype (numpy.int32)
+        return self._variant_ids[key]
+
+    def _grow(self):
+        capacity = 2 * len (self.left)
+        for name in ("left", "top", "speed", "kill_point", "variant"):
+            old = getattr (self, name)
+            new = numpy.zeros (capacity, dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr (self, name, new)
+
+    def spawn(self, road, spawnx, spritefile=None):
+        """Add a car to road, with its center at (spawnx, road's center). This is the equivalent of
+        Road.spawn_car for sprite-based cars.
+        """
+        if self.count == len (self.left):
+            self._grow()
+        if spritefile is None:
+            spritefile, rotation = Car.choose_image (road.speed, road.random)
+        else:
+            rotation = Car.rotation (road.speed)
+        variant = self._variant (spritefile, rotation)
+        index = self.count
+        self.left[index] = spawnx - self._widths[variant] // 2
+        self.top[index] = road.rect.centery - self._heights[variant] // 2
+        self.speed[index] = road.speed
+        self.kill_point[index] = road.killx
+        self.variant[index] = variant
+        self.count += 1
+
+    def update(self, bottom=None):
+        """Move all of the cars, and remove any that have reached their kill point. If bottom is
+        given, cars whose top is below it are removed too, the same as offscreen sprites.
+        """
+        count = self.count
+        left = self.left[:count]
+        left += self.speed[:count]
+        kill_point = self.kill_point[:count]
+        right = left + self._widths[self.variant[:count]]
+        finished = ((kill_point > 0) & (left > kill_point)) | ((kill_point < 0) & (right < kill_point))
+        if bottom is not None:
+            finished |= self.top[:count] > bottom
+        if finished.any():
+            keep = ~finished
+            remaining = int (numpy.count_nonzero (keep))
+            for array in (self.left, self.top, self.speed, self.kill_point, self.variant):
+                array[:remaining] = array[:count][keep]
+            self.count = remaining
+
+    def overlapping(self, rect):
+        """The indexes of the cars whose rects overlap rect"""
+        count = self.count
+        left = self.left[:count]
+        top = self.top[:count]
+        variant = self.variant[:count]
+        near = ((left < rect.right) & (left + self._widths[variant] > rect.left)
+                & (top < rect.bottom) & (top + self._heights[variant] > rect.top))
+        return numpy.flatnonzero (near)
+
+    def shapes(self, rect):
+        """A (rect, mask) pair for each car that overlaps rect"""
+        result = []
+        for index in self.overlapping (rect):
+            variant = self.variant[index]
+            result.append ((pygame.Rect (int (self.left[index]), int (self.top[index]), int (self._widths[variant]), int (self._heights[variant])), self._masks[variant]))
+        return result
+
+    def collides(self, sprite):
+        """True if sprite's mask overlaps any of the cars, the equivalent of spritecollide with
+        collide_mask.
+        """
+        rect = sprite.rect
+        for index in self.overlapping (rect):
+            offset = (int (self.left[index]) - rect.left, int (self.top[index]) - rect.top)
+            if sprite.mask.overlap (self._masks[self.variant[index]], offset):
+                return True
+        return False
+
+    def materialize(self, group, camera):
+        """Make the sprites in group match the cars that are visible in camera, reusing the same
+        TrafficSprites each frame. The group should only be used for drawing.
+        """
+        visible = self.overlapping (camera)
+        while len (self._sprites) < len (visible):
+            self._sprites.append (TrafficSprite())
+        for sprite, index in zip (self._sprites, visible):
+            variant = self.variant[index]
+            sprite.image = self._images[variant]
+            sprite.rect = pygame.Rect (int (self.left[index]), int (self.top[index]), int (self._widths[variant]), int (self._heights[variant]))
+        group.add (self._sprites[:len (visible)])
+        for sprite in self._sprites[len (visible):]:
+            sprite.kill()
@@ -22,12 +22,20 @@
 try:
     import sys
     import os
+    import weakref
+    from functools import lru_cache
     import pygame
     from pygame.locals import *
 except ImportError as err:
     print ("couldn't load module. %s" % (err))
     sys.exit(2)
 
+try:
+    import numpy
+except ImportError:
+    # Optional, without NumPy the TeamColorPainter uses the slower pygame.PixelArray
+    numpy = None
+
 def get_bounding_box(*groups):
     """Returns the smallest Rect containing all of the sprites in a pygame.sprite.Group, or None
     for an empty group."""
@@ -40,29 +48,52 @@ def get_bounding_box(*groups):
                 result.union_ip (entity.rect)
     return result
 
+def convert_for_display(image):
+    """Convert image to the display's pixel format, for faster blitting. Converting needs a video
+    mode, a headless simulation keeps the image's own format.
+    """
+    if pygame.display.get_surface() is None:
+        return image
+    elif image.get_alpha() is None:
+        return image.convert()
+    else:
+        return image.convert_alpha()
+
 class ImageCache:
     """Caching image loader, each call to one of the load_*_image functions with the same arguments
-    will return the same instance of pygame.Surface.
+    will return the same instance of pygame.Surface. Similarly, the load_*_mask functions return the
+    same pygame.mask.Mask for the same image, which callers must treat as read-only.
 
     Each instance of ImageCache has its own cache, which is not shared with other instances; the
     caller is expected to share the instance appropriately. For example, all instances of the Car
     class share Car.image_cache.
+
+    The caches may be filled from a worker thread as well as the main thread (see LanePipeline.py).
+    If both load the same image at once, the first one stored is the one that both of them return.
+
+    The sprites' images are always at the world's scale, which their rects and masks are based on.
+    For drawing at a different resolution, scaled_image() returns a scaled copy of any image, and
+    prescale() makes the copies of everything in a cache in advance.
     """
     _code_dir = os.path.abspath(os.path.dirname(__file__))
     _data_dir = os.path.normpath(os.path.join(_code_dir, 'data'))
 
+    # For each scale, the scaled copy of each image. These are shared by all of the instances,
+    # because they're found from the original image, and they're dropped when the original is.
+    _scaled_images = {}
+
     def __init__(self):
         self._cache = {}
-        pass
+        self._masks = {}
+
+    def data_path(name):
+        """The full path of a file in the data directory"""
+        return os.path.join(__class__._data_dir, name)
 
     def _load_from_file(self, name):
         fullname = os.path.join(self._data_dir, name)
         try:
-            image = pygame.image.load(fullname)
-            if image.get_alpha() is None:
-                image = image.convert()
-            else:
-                image = image.convert_alpha()
+            image = convert_for_display (pygame.image.load(fullname))
         except pygame.error as message:
             print ('Cannot load image:', fullname)
             raise SystemExit (message)
@@ -78,8 +109,24 @@ class ImageCache:
         image = self._load_from_file(filename)
         if rotation != 0:
             image = pygame.transform.rotate (image, rotation)
-        self._cache[key] = image
-        return image
+        return self._cache.setdefault (key, image)
+
+    def store_rotated_image (self, filename, rotation, image):
+        """Put an image that's already been rotated in to the cache, for example one loaded from
+        an AssetBundle, so that load_rotated_image won't need to load it from the file.
+        """
+        self._cache[(filename, rotation)] = image
+
+    def load_mask(self, filename):
+        return self.load_rotated_mask (filename, 0)
+
+    def load_rotated_mask (self, filename, rotation):
+        """The collision mask for load_rotated_image (filename, rotation)"""
+        key = (filename, rotation)
+        if key in self._masks:
+            return self._masks[key]
+        mask = pygame.mask.from_surface (self.load_rotated_image (filename, rotation))
+        return self._masks.setdefault (key, mask)
 
     def load_tiled_image (self, filename, width, height):
         key = (filename, width, height)
@@ -87,13 +134,44 @@ class ImageCache:
             return self._cache[key]
         tile = self._load_from_file(filename)
         if tile.get_rect().width < 1 or tile.get_rect().height < 1:
-            raise RuntimeException ("Failed to load tileable image %s" % (imagefile))
+            raise RuntimeError ("Failed to load tileable image %s" % (filename))
         image = pygame.Surface ((width, height))
         for x in range (0, width, tile.get_rect().width):
-            for y in range (0, width, tile.get_rect().width):
+            for y in range (0, height, tile.get_rect().height):
                 image.blit (tile, (x, y))
-        self._cache[key] = image
-        return image
+        return self._cache.setdefault (key, image)
+
+    def store_tiled_image (self, filename, width, height, image):
+        """The equivalent of store_rotated_image for load_tiled_image"""
+        self._cache[(filename, width, height)] = image
+
+    def scaled_image(image, scale):
+        """A copy of image that's scale times the size, or image itself if scale is 1. Each call with
+        the same image and scale returns the same copy.
+        """
+        if scale == 1:
+            return image
+        scaled_images = __class__._scaled_images.get (scale)
+        if scaled_images is None:
+            scaled_images = __class__._scaled_images.setdefault (scale, weakref.WeakKeyDictionary())
+        scaled = scaled_images.get (image)
+        if scaled is None:
+            width, height = image.get_size()
+            size = (max (1, round (width * scale)), max (1, round (height * scale)))
+            if image.get_bitsize() in (24, 32):
+                scaled = pygame.transform.smoothscale (image, size)
+            else:
+                scaled = pygame.transform.scale (image, size)
+            scaled = scaled_images.setdefault (image, scaled)
+        return scaled
+
+    def prescale(self, scale):
+        """Make the scaled_image() of every image in this cache, so that drawing them at that scale
+        doesn't need to scale anything.
+        """
+        # A copy of the list, as the worker thread may be adding to the cache
+        for image in list (self._cache.values()):
+            __class__.scaled_image (image, scale)
 
 class TeamColorPainter:
     """The game only has one set of frog images, and uses palette shifting to
@@ -103,15 +181,69 @@ class TeamColorPainter:
     https://wiki.wesnoth.org/Team_Color_Shifting
     """
 
-    # The base image is cached, but a copy is made for each recoloration
+    # The base image is cached, and so are the recolorations; all frogs of the same color share the
+    # same Surface.  The caches are least-recently-used, dropping the oldest recolorations when a lot
+    # of different colors have been used.
     image_cache = ImageCache()
+    recolor_cache_size = 256
+
+    # The red (and blue) components of the shades of magenta that are replaced
+    magenta_shades = range (40, 241, 40)
 
     def load_image(name, team_color):
+        return __class__._recolor (name, tuple (team_color))
+
+    @lru_cache (maxsize=recolor_cache_size)
+    def _recolor(name, color):
         image = __class__.image_cache.load_image(name).copy()
-        pxarray = pygame.PixelArray (image)
-        for x in range (40, 241, 40):
+        if numpy is not None and image.get_bytesize() == 4:
+            __class__._recolor_with_numpy (image, name, color)
+        else:
+            __class__._recolor_with_pixelarray (image, color)
+        return image
+
+    @lru_cache (maxsize=recolor_cache_size)
+    def _palette(color):
+        """The replacement for each of the magenta_shades, as (magenta, replacement) pairs"""
+        palette = []
+        for x in __class__.magenta_shades:
             magenta = pygame.Color (x, 0, x, 255)
-            replacement = pygame.Color (int (x * team_color.r / 255), int (x * team_color.g / 255), int (x * team_color.b / 255), 255)
+            replacement = pygame.Color (int (x * color[0] / 255), int (x * color[1] / 255), int (x * color[2] / 255), 255)
+            palette.append ((magenta, replacement))
+        return palette
+
+    @lru_cache (maxsize=None)
+    def _shade_lookup(name):
+        """Finds the team-colored pixels of a base image, which are the same for every team color.
+
+        Returns (positions, shade_indexes), positions is a NumPy index of every pixel that's one of
+        the magenta_shades, and shade_indexes says which entry of the palette each of them uses.
+        """
+        image = __class__.image_cache.load_image(name)
+        # The mapped values of the magenta shades, as unsigned like pixels2d's values
+        shades = numpy.array ([image.map_rgb ((x, 0, x, 255)) & 0xffffffff for x in __class__.magenta_shades], dtype=numpy.uint32)
+        pixels = pygame.surfarray.array2d (image).view (numpy.uint32)
+        positions = numpy.nonzero (numpy.isin (pixels, shades))
+        order = numpy.argsort (shades)
+        shade_indexes = order[numpy.searchsorted (shades[order], pixels[positions])]
+        return positions, shade_indexes
+
+    def _recolor_with_numpy(image, name, color):
+        """Recolor a copy of the named base image in a single vectorized assignment"""
+        positions, shade_indexes = __class__._shade_lookup (name)
+        replacements = numpy.array ([image.map_rgb (replacement) & 0xffffffff for magenta, replacement in __class__._palette (color)], dtype=numpy.uint32)
+        pixels = pygame.surfarray.pixels2d (image)
+        pixels[positions] = replacements[shade_indexes]
+        del pixels
+
+    def _recolor_with_pixelarray(image, color):
+        pxarray = pygame.PixelArray (image)
+        for magenta, replacement in __class__._palette (color):
             pxarray.replace (magenta, replacement)
         del pxarray
-        return image
+
+    def load_mask(name):
+        """The collision mask for any recoloration of the image, recoloring doesn't change the alpha
+        channel so they can all share the base image's mask.
+        """
+        return __class__.image_cache.load_mask(name)
@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2019 Steve Cotton (Octalot)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for RaceSimulation, run headless with SDL's dummy video driver.
+
+    python3 -m unittest test_Simulation
+"""
+
+try:
+    import os
+    # This must be set before pygame initialises its display module
+    os.environ.setdefault ("SDL_VIDEODRIVER", "dummy")
+    import contextlib
+    import gettext
+    import io
+    import sys
+    import unittest
+    import pygame
+    from pygame.locals import *
+    from GameConstants import GameConstants
+    from Simulation import RaceSimulation
+    from Traffic import numpy
+except ImportError as err:
+    print ("couldn't load module. %s" % (err))
+    sys.exit(2)
+
+gettext.install ('DartingFrogs', 'data/locale')
+
+camera_area = pygame.Rect (0, 0, 1024, 700)
+
+class CrowdWaitsForPlayersTest(unittest.TestCase):
+    def setUp(self):
+        pygame.init()
+
+    @unittest.skipIf (numpy is None, "the crowd needs NumPy")
+    def test_join_after_waiting(self):
+        """The crowd doesn't move before anyone joins, so it can't make the camera jump ahead when
+        the first player does.
+        """
+        with contextlib.redirect_stdout (io.StringIO()):
+            simulation = RaceSimulation (camera_area, seed=1, crowd=100)
+            start = simulation.crowd.bounding_box()
+            for i in range (500):
+                simulation.step()
+            self.assertEqual (simulation.camera.top, 0)
+            self.assertEqual (simulation.crowd.count, 100)
+            self.assertEqual (simulation.crowd.bounding_box(), start)
+            self.assertTrue (simulation.new_players_can_join.alive())
+
+            camera_top = simulation.camera.top
+            simulation.step ([pygame.event.Event (KEYDOWN, key=K_a, mod=0, unicode="a", scancode=0)])
+        self.assertEqual (len (simulation.frog_sprites), 1)
+        self.assertLessEqual (camera_top - simulation.camera.top, GameConstants.jump_length)
+        self.assertTrue (simulation.new_players_can_join.alive())
+
+if __name__ == '__main__':
+    unittest.main()